@@ -1,9 +1,70 @@
 from django.contrib import admin
-from .models import AttendanceRecord
+from django.contrib.admin import ShowFacets
+from django.db.models import Q
+from users import search
+from .archive import archived_through
+from .export import CSV, NDJSON, stream_export
+from .models import AttendanceRecord, HeatmapCell, Purpose
+from .pagination import EstimatedCountPaginator
+from .purposes import matching_purposes
+from .rollups import HOURS
 
 @admin.register(AttendanceRecord)
 class AttendanceRecordAdmin(admin.ModelAdmin):
-    list_display = ('user', 'date', 'check_in_time', 'check_out_time', 'purpose_of_visit')  # Removed temperature
-    list_filter = ('check_in_time', 'user__user_type')
-    search_fields = ('user__email', 'user__first_name', 'user__last_name', 'purpose_of_visit')
+    """
+    Changelist that opens in the same time whatever the size of the table:
+    estimated page counts and no unfiltered total, users and purposes joined
+    into the page query, the date hierarchy drilled down through the heatmap's
+    dates (see templatetags/attendance_admin.py) and filters on the indexed
+    date column.
+    """
+    list_display = ('user', 'date', 'check_in_time', 'check_out_time', 'purpose')  # Removed temperature
+    list_filter = ('date', 'user__user_type')
+    search_fields = ('user__email', 'user__first_name', 'user__last_name', 'purpose__name')
     date_hierarchy = 'date'
+    list_select_related = ('user', 'purpose')
+    autocomplete_fields = ('user', 'purpose')
+    actions = ('export_csv', 'export_ndjson')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = ShowFacets.NEVER
+
+    def get_hierarchy_dates(self, params):
+        """
+        The live dates with visits under the year/month/day drilled down to
+        in `params`, as one HeatmapCell per date (every date has a cell for
+        each hour). The heatmap ignores the changelist's other filters.
+        """
+        cells = HeatmapCell.objects.filter(hour=HOURS[0])
+        newest_archived = archived_through()
+        if newest_archived:
+            cells = cells.filter(date__gt=newest_archived)
+        for part in ('year', 'month', 'day'):
+            value = params.get(f'{self.date_hierarchy}__{part}')
+            if value:
+                cells = cells.filter(**{f'date__{part}': int(value)})
+        return cells
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Records of the users matching `search_term` in the full-text index,
+        or whose purpose matches it, instead of LIKE scans across the join
+        """
+        if not search.words(search_term):
+            return queryset, False
+        matches = Q(user__in=search.user_ids(search_term)) | Q(purpose__in=matching_purposes(search_term))
+        return queryset.filter(matches), False
+
+    @admin.action(description='Export selected records as CSV')
+    def export_csv(self, request, queryset):
+        return stream_export(queryset, CSV, 'attendance')
+
+    @admin.action(description='Export selected records as NDJSON')
+    def export_ndjson(self, request, queryset):
+        return stream_export(queryset, NDJSON, 'attendance')
+
+
+@admin.register(Purpose)
+class PurposeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key')
+    search_fields = ('name', 'key')
@@ -0,0 +1,287 @@
+"""
+Analytics for the attendance dashboards.
+
+A range summary is three aggregate queries, whatever the number of visits
+or series it shows:
+
+* the record count per purpose, which also gives the total;
+* the completed visits (check-out after check-in, filtered in SQL) grouped
+  by user type and duration in whole minutes, the durations computed by the
+  database's own date functions. The duration statistics are read off these
+  histograms, so neither the rows nor the memory grow with the number of
+  visits;
+* one read of the rollup rows of the range (one row per date, user type and
+  check-in hour), folded into the daily, weekly, monthly, hourly and
+  user-type chart series.
+
+Plus the names of the top purposes, looked up by id in the purpose catalog.
+Today's headline counters are one conditional aggregate, and the weekday by
+hour heatmap is one read of the precomputed HeatmapCell rows of the range.
+"""
+import math
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import NotSupportedError
+from django.db.models import Count, F, FloatField, Func, Q, Sum, Value
+from django.db.models.functions import Round
+
+from .archive import records_between
+from .models import AttendanceRecord, DailyAttendanceRollup, HeatmapCell, Purpose
+
+# Nearest-rank percentiles reported for visit durations
+DURATION_PERCENTILES = {'median': 0.5, 'p90': 0.9}
+TOP_PURPOSES = 10
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def _empty_stats():
+    return {'count': 0, 'avg': 0, 'median': 0, 'p90': 0, 'max': 0}
+
+
+class DurationHistogram:
+    """
+    Visit durations counted per whole minute, plus their exact total. The
+    statistics are reported in whole minutes and rounding keeps the order of
+    durations, so the percentiles and max read off the histogram are the
+    ones of the individual durations.
+    """
+
+    def __init__(self):
+        self.minutes = Counter()
+        self.count = 0
+        self.seconds = 0
+
+    def add(self, seconds):
+        self.add_bucket(round(seconds / 60), 1, seconds)
+
+    def add_bucket(self, minute, visits, seconds):
+        """Count `visits` visits of `minute` minutes, lasting `seconds` in total"""
+        self.minutes[minute] += visits
+        self.count += visits
+        self.seconds += seconds
+
+    def update(self, other):
+        self.minutes.update(other.minutes)
+        self.count += other.count
+        self.seconds += other.seconds
+
+    def stats(self):
+        """Count, average, percentiles and max, in minutes"""
+        if not self.count:
+            return _empty_stats()
+        ranks = {name: math.ceil(self.count * fraction) for name, fraction in DURATION_PERCENTILES.items()}
+        stats = {'count': self.count, 'avg': round(self.seconds / self.count / 60)}
+        seen = 0
+        for minute, visits in sorted(self.minutes.items()):
+            seen += visits
+            for name, rank in ranks.items():
+                if name not in stats and seen >= rank:
+                    stats[name] = minute
+            stats['max'] = minute
+        return {name: stats[name] for name in _empty_stats()}
+
+
+class DurationSeconds(Func):
+    """
+    Seconds from the `start` to the `end` datetime expression, with the
+    database's native date functions (Django's datetime subtraction is a
+    Python function called per row on SQLite)
+    """
+    output_field = FloatField()
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'DurationSeconds is not implemented for {connection.vendor}')
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='((julianday(%(expressions)s)) * 86400.0)',
+            arg_joiner=') - julianday(', **extra_context,
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='EXTRACT(EPOCH FROM (%(expressions)s))', arg_joiner=' - ',
+            **extra_context,
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        end, start = self.get_source_expressions()
+        clone = self.copy()
+        clone.set_source_expressions([start, end])
+        return super(DurationSeconds, clone).as_sql(
+            compiler, connection, template='(TIMESTAMPDIFF(MICROSECOND, %(expressions)s) / 1000000.0)',
+            **extra_context,
+        )
+
+
+def count_purposes(records):
+    """``(record count, purpose id Counter)`` of `records`, from one GROUP BY"""
+    total = 0
+    purposes = Counter()
+    for purpose_id, count in records.order_by().values_list('purpose_id').annotate(count=Count('id')):
+        total += count
+        if purpose_id:
+            purposes[purpose_id] += count
+    return total, purposes
+
+
+def duration_histograms(records):
+    """
+    ``{user_type: DurationHistogram}`` of the completed visits in `records`
+    (check-out after check-in), bucketed by minute in one GROUP BY
+    """
+    durations = defaultdict(DurationHistogram)
+    seconds = DurationSeconds('check_out_time', 'check_in_time')
+    buckets = records.order_by().filter(check_out_time__gt=F('check_in_time')).annotate(
+        minute=Round(seconds / Value(60.0)),
+    ).values_list('user__user_type', 'minute').annotate(visits=Count('id'), seconds=Sum(seconds))
+    for user_type, minute, visits, total_seconds in buckets:
+        durations[user_type].add_bucket(int(minute), visits, total_seconds)
+    return durations
+
+
+def _duration_summary(durations):
+    overall = DurationHistogram()
+    for histogram in durations.values():
+        overall.update(histogram)
+    return {
+        'overall': overall.stats(),
+        'by_user_type': {user_type: histogram.stats() for user_type, histogram in durations.items()},
+    }
+
+
+def duration_stats(queryset):
+    """
+    Average, median, p90 and max visit duration (in minutes) for the
+    completed visits in `queryset`, overall and per user type, from one
+    aggregate query of per-minute histograms.
+    Returns ``{'overall': {...}, 'by_user_type': {user_type: {...}}}``.
+    """
+    return _duration_summary(duration_histograms(queryset))
+
+
+def today_summary(today):
+    """Headline counters for `today`, from one conditional aggregate"""
+    return AttendanceRecord.objects.filter(date=today).aggregate(
+        today_count=Count('id'),
+        today_checked_in=Count('id', filter=Q(check_in_time__isnull=False)),
+        today_checked_out=Count('id', filter=Q(check_out_time__isnull=False)),
+    )
+
+
+def _ranked(counter):
+    """(label, count) pairs, largest count first"""
+    return sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+
+
+def top_purposes(purposes, limit=TOP_PURPOSES):
+    """
+    The `limit` most frequent purposes of a purpose id Counter, largest
+    count first, as ``[{'purpose_of_visit': name, 'count': count}]``
+    """
+    top = _ranked(purposes)[:limit]
+    if not top:
+        return []
+    names = dict(Purpose.objects.filter(id__in=[purpose_id for purpose_id, _ in top]).values_list('id', 'name'))
+    return [{'purpose_of_visit': names[purpose_id], 'count': count} for purpose_id, count in top]
+
+
+def chart_series(filter_start, filter_end):
+    """Every chart series of the range, folded from one read of its rollup rows"""
+    daily, user_types, hours, weekly, monthly = Counter(), Counter(), Counter(), Counter(), Counter()
+    rows = DailyAttendanceRollup.objects.filter(
+        date__gte=filter_start, date__lte=filter_end,
+    ).values_list('date', 'user_type', 'hour', 'visit_count')
+    for day, user_type, hour, visits in rows:
+        daily[day] += visits
+        user_types[user_type] += visits
+        hours[hour] += visits
+        weekly[day - timedelta(days=day.weekday())] += visits
+        monthly[day.replace(day=1)] += visits
+
+    daily, hours, weekly, monthly = (sorted(series.items()) for series in (daily, hours, weekly, monthly))
+    user_types = _ranked(user_types)
+    return {
+        'daily_labels': [day.strftime('%Y-%m-%d') for day, _ in daily],
+        'daily_counts': [count for _, count in daily],
+        'user_type_labels': [user_type for user_type, _ in user_types],
+        'user_type_counts': [count for _, count in user_types],
+        'hour_labels': [f"{hour}:00" for hour, _ in hours],
+        'hour_counts': [count for _, count in hours],
+        'weekly_labels': [week.strftime('%Y-%m-%d') for week, _ in weekly],
+        'weekly_counts': [count for _, count in weekly],
+        'monthly_labels': [month.strftime('%Y-%m') for month, _ in monthly],
+        'monthly_counts': [count for _, count in monthly],
+    }
+
+
+def range_summary(filter_start, filter_end):
+    """
+    Everything the analytics dashboard shows for a date range: totals,
+    duration statistics and the chart series. The result only holds plain
+    Python values so it can be cached.
+    """
+    # The archive is read too when the range reaches into it
+    records = records_between(filter_start, filter_end)
+    total_records, purposes = count_purposes(records)
+    durations = _duration_summary(duration_histograms(records))
+    purpose_counts = top_purposes(purposes)
+
+    chart_data = chart_series(filter_start, filter_end)
+    chart_data['purpose_labels'] = [entry['purpose_of_visit'] for entry in purpose_counts]
+    chart_data['purpose_counts'] = [entry['count'] for entry in purpose_counts]
+
+    return {
+        'total_records': total_records,
+        'avg_duration_minutes': durations['overall']['avg'],
+        'duration_stats': durations['overall'],
+        'duration_by_user_type': durations['by_user_type'],
+        'purpose_counts': purpose_counts,
+        'chart_data': chart_data,
+    }
+
+
+def _weekday_days(filter_start, filter_end):
+    """How many days of each weekday (Monday first) the range holds"""
+    total = max((filter_end - filter_start).days + 1, 0)
+    return [
+        total // 7 + ((weekday - filter_start.weekday()) % 7 < total % 7)
+        for weekday in range(7)
+    ]
+
+
+def _averages(matrix, days):
+    return [[round(count / n, 2) if n else 0 for count in row] for row, n in zip(matrix, days)]
+
+
+def heatmap(filter_start, filter_end):
+    """
+    The 7x24 weekday (Monday first) by local hour heatmap of the range, from
+    one read of its HeatmapCell rows: total arrivals and people on site, and
+    their averages per day of that weekday in the range.
+    """
+    arrivals = [[0] * 24 for _ in WEEKDAYS]
+    on_site = [[0] * 24 for _ in WEEKDAYS]
+    rows = HeatmapCell.objects.filter(
+        date__gte=filter_start, date__lte=filter_end,
+    ).values_list('date', 'hour', 'arrivals', 'on_site')
+    for day, hour, arrived, present in rows:
+        arrivals[day.weekday()][hour] += arrived
+        on_site[day.weekday()][hour] += present
+
+    days = _weekday_days(filter_start, filter_end)
+    return {
+        'date_from': filter_start.isoformat(),
+        'date_to': filter_end.isoformat(),
+        'weekdays': WEEKDAYS,
+        'hours': list(range(24)),
+        'days': days,
+        'arrivals': arrivals,
+        'on_site': on_site,
+        'avg_arrivals': _averages(arrivals, days),
+        'avg_on_site': _averages(on_site, days),
+    }
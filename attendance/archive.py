@@ -0,0 +1,151 @@
+"""
+Tiered storage for attendance records.
+
+Recent visits live in AttendanceRecord. The `archive_attendance` command
+moves records older than ATTENDANCE_ARCHIVE_AFTER_DAYS into
+ArchivedAttendanceRecord in batches, so the live table and its indexes stay
+the size of the recent past however long the history grows. Records keep
+their id, so (date, id) keyset cursors stay valid across the move.
+
+Readers that may need old records ask records_between() for their date
+range, which picks the tiers from the newest archived and oldest live dates
+(two index lookups; none at all for ranges starting today):
+
+* the live table for ranges after the newest archived date;
+* the archive table for ranges before the oldest live date;
+* otherwise the AttendanceHistory view, the UNION ALL of both tables, which
+  supports the same lookups, joins and aggregates.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from . import caching
+from .models import ArchivedAttendanceRecord, AttendanceHistory, AttendanceRecord
+
+DEFAULT_BATCH_SIZE = 5000
+# Columns copied from the live table to the archive
+ARCHIVED_FIELDS = ['id', 'user_id', 'date', 'check_in_time', 'check_out_time', 'purpose_id', 'comments']
+UPDATE_FIELDS = ['check_in_time', 'check_out_time', 'purpose', 'comments']
+
+
+def archive_horizon(today=None, days=None):
+    """Records dated before this are archived"""
+    if days is None:
+        days = getattr(settings, 'ATTENDANCE_ARCHIVE_AFTER_DAYS', 365)
+    if days < 1:
+        raise ValueError('Only records older than today can be archived')
+    return (today or timezone.localdate()) - timedelta(days=days)
+
+
+def archived_through():
+    """The newest archived date, or None when the archive is empty"""
+    return ArchivedAttendanceRecord.objects.aggregate(newest=Max('date'))['newest']
+
+
+async def aarchived_through():
+    """Async archived_through()"""
+    return (await ArchivedAttendanceRecord.objects.aaggregate(newest=Max('date')))['newest']
+
+
+def _live_since():
+    """The oldest live date, or None when the live table is empty"""
+    return AttendanceRecord.objects.aggregate(oldest=Min('date'))['oldest']
+
+
+async def _alive_since():
+    return (await AttendanceRecord.objects.aaggregate(oldest=Min('date')))['oldest']
+
+
+def _starts_live(date_from):
+    # Today's records are never archived
+    return date_from is not None and date_from >= timezone.localdate()
+
+
+def _source(date_from, date_to, newest, live_since):
+    """The model holding the records between the dates, given the tier bounds"""
+    if newest is None or (date_from is not None and newest < date_from):
+        return AttendanceRecord
+    if date_to is not None and (live_since() or date_to) > date_to:
+        return ArchivedAttendanceRecord
+    return AttendanceHistory
+
+
+def _between(source, date_from, date_to):
+    records = source.objects.all()
+    if date_from is not None:
+        records = records.filter(date__gte=date_from)
+    if date_to is not None:
+        records = records.filter(date__lte=date_to)
+    return records
+
+
+def records_between(date_from=None, date_to=None):
+    """
+    Records dated between `date_from` and `date_to` (inclusive, open-ended
+    when None) from whichever tiers can hold them.
+    """
+    if _starts_live(date_from):
+        source = AttendanceRecord
+    else:
+        source = _source(date_from, date_to, archived_through(), _live_since)
+    return _between(source, date_from, date_to)
+
+
+async def arecords_between(date_from=None, date_to=None):
+    """Async records_between(): the tier lookups use the async ORM"""
+    if _starts_live(date_from):
+        source = AttendanceRecord
+    else:
+        newest = await aarchived_through()
+        live_since = await _alive_since() if newest is not None else None
+        source = _source(date_from, date_to, newest, lambda: live_since)
+    return _between(source, date_from, date_to)
+
+
+def user_records(user):
+    """All of `user`'s records, from both tiers"""
+    return AttendanceHistory.objects.filter(user=user)
+
+
+def _delete_live(ids):
+    table = connection.ops.quote_name(AttendanceRecord._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    # A plain DELETE: per-row delete signals would only repeat the cache
+    # invalidation done once per batch below
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+
+
+def archive_records(before, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Move the live records dated before `before` to the archive, oldest first,
+    one transaction per batch of `batch_size`, and return how many moved.
+    `on_batch(moved, last_date)` is called after every committed batch.
+
+    An archived record for the same person and day (from an import after an
+    earlier archival) is replaced by the live one.
+    """
+    if before > timezone.localdate():
+        raise ValueError('Only records older than today can be archived')
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(AttendanceRecord.objects.filter(date__lt=before).order_by('date', 'id').values(
+                *ARCHIVED_FIELDS
+            )[:batch_size])
+            if not rows:
+                break
+            ArchivedAttendanceRecord.objects.bulk_create(
+                [ArchivedAttendanceRecord(**row) for row in rows],
+                update_conflicts=True, unique_fields=['user', 'date'], update_fields=UPDATE_FIELDS,
+            )
+            _delete_live([row['id'] for row in rows])
+            caching.bump_data_version({row['date'] for row in rows})
+        moved += len(rows)
+        if on_batch:
+            on_batch(moved, rows[-1]['date'])
+    return moved
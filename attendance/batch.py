@@ -0,0 +1,188 @@
+"""
+Batch check-in/check-out for kiosks replaying sign-ins queued while offline.
+
+A batch is applied in one transaction: users and the affected attendance
+records are resolved with one query each, events are replayed in order in
+memory (so a check-in followed by a check-out of the same person works), and
+the results are written back with bulk_create/bulk_update.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import User
+from .models import AttendanceRecord
+from . import occupancy, purposes
+from .caching import bump_data_version
+from .events import counters_changed
+from .rollups import RollupBatch
+from .services import check_out_comment
+
+MAX_BATCH_SIZE = 500
+CHECK_IN = 'check_in'
+CHECK_OUT = 'check_out'
+
+
+class BatchError(ValueError):
+    """Raised when the batch as a whole is malformed"""
+
+
+def _parse_timestamp(value):
+    if not value:
+        return timezone.now()
+    timestamp = parse_datetime(str(value))
+    if timestamp is None:
+        raise ValueError('Invalid timestamp. Use ISO 8601')
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def _error(index, message, status=400, **extra):
+    return {'index': index, 'status': status, 'error': message, **extra}
+
+
+def _validate(events):
+    """Split `events` into parsed events and per-item validation errors"""
+    if not isinstance(events, list):
+        raise BatchError('events must be a list')
+    if len(events) > MAX_BATCH_SIZE:
+        raise BatchError(f'A batch may contain at most {MAX_BATCH_SIZE} events')
+
+    parsed, errors = [], {}
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            errors[index] = _error(index, 'Each event must be an object')
+            continue
+        action = event.get('action')
+        if action not in (CHECK_IN, CHECK_OUT):
+            errors[index] = _error(index, "action must be 'check_in' or 'check_out'")
+            continue
+        if not event.get('user_id') and not event.get('email'):
+            errors[index] = _error(index, 'user_id or email is required')
+            continue
+        try:
+            timestamp = _parse_timestamp(event.get('timestamp'))
+        except ValueError as e:
+            errors[index] = _error(index, str(e))
+            continue
+        parsed.append((index, action, event, timestamp))
+    return parsed, errors
+
+
+def _resolve_users(parsed):
+    ids, emails = set(), set()
+    for _, _, event, _ in parsed:
+        if event.get('user_id'):
+            ids.add(_as_int(event['user_id']))
+        else:
+            emails.add(User.objects.normalize_email(event['email']))
+    users = User.objects.filter(Q(id__in=ids) | Q(email__in=emails)).only('id', 'email', 'user_type')
+    by_id, by_email = {}, {}
+    for user in users:
+        by_id[user.id] = user
+        by_email[user.email] = user
+    return by_id, by_email
+
+
+def apply_batch(events):
+    """
+    Apply a list of check-in/check-out events and return one result dict per
+    event, in input order. Each result carries an HTTP-style `status`
+    mirroring what api_check_in/api_check_out would have returned.
+    """
+    parsed, results = _validate(events)
+    by_id, by_email = _resolve_users(parsed)
+
+    resolved = []
+    for index, action, event, timestamp in parsed:
+        if event.get('user_id'):
+            user = by_id.get(_as_int(event['user_id']))
+        else:
+            user = by_email.get(User.objects.normalize_email(event['email']))
+        if user is None:
+            results[index] = _error(index, 'User not found', status=404)
+            continue
+        resolved.append((index, action, event, timestamp, user))
+
+    # The records are read in the writing transaction, so a check-in or
+    # check-out made meanwhile by another request (services) is not
+    # overwritten: SQLite's IMMEDIATE transactions serialize the writers, and
+    # other databases lock the rows
+    with transaction.atomic():
+        catalog = purposes.intern_many(
+            _purpose_text(event) for _, action, event, _, _ in resolved if action == CHECK_IN
+        )
+        keys = {(user.id, timezone.localdate(timestamp)) for _, _, _, timestamp, user in resolved}
+        existing = AttendanceRecord.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in keys},
+            date__in={day for _, day in keys},
+        )
+        records = {(record.user_id, record.date): record for record in existing}
+
+        to_create, to_update = {}, {}
+        applied = []
+        rollup = RollupBatch()
+        for index, action, event, timestamp, user in resolved:
+            key = (user.id, timezone.localdate(timestamp))
+            record = records.get(key)
+
+            if action == CHECK_IN:
+                if record and record.check_in_time:
+                    results[index] = _error(index, 'Already checked in', check_in_time=record.check_in_time)
+                    continue
+                if record is None:
+                    record = AttendanceRecord(user=user, date=key[1])
+                    records[key] = to_create[key] = record
+                elif key not in to_create:
+                    to_update[key] = record
+                record.check_in_time = timestamp
+                record.purpose = catalog[_purpose_text(event)]
+                record.comments = event.get('comments', '')
+                rollup.check_in(record, user.user_type)
+                applied.append((index, record))
+                results[index] = {'index': index, 'status': 201, 'action': action, 'user_id': user.id,
+                                  'check_in_time': record.check_in_time}
+            else:
+                if record is None:
+                    results[index] = _error(index, 'No check-in record found for today')
+                    continue
+                if record.check_out_time:
+                    results[index] = _error(index, 'Already checked out', check_out_time=record.check_out_time)
+                    continue
+                if key not in to_create:
+                    to_update[key] = record
+                record.check_out_time = timestamp
+                record.comments += check_out_comment(event.get('comments'))
+                rollup.check_out(record, user.user_type)
+                applied.append((index, record))
+                results[index] = {'index': index, 'status': 200, 'action': action, 'user_id': user.id,
+                                  'check_out_time': record.check_out_time}
+
+        AttendanceRecord.objects.bulk_create(to_create.values(), batch_size=MAX_BATCH_SIZE)
+        AttendanceRecord.objects.bulk_update(
+            to_update.values(),
+            ['check_in_time', 'check_out_time', 'purpose', 'comments'],
+            batch_size=MAX_BATCH_SIZE,
+        )
+        rollup.apply()
+        dates = {day for _, day in list(to_create) + list(to_update)}
+        bump_data_version(dates)
+        occupancy.invalidate_on_commit(dates)
+        counters_changed(dates)
+
+    for index, record in applied:
+        results[index]['record_id'] = record.id
+    return [results[index] for index in sorted(results)]
+
+
+def _purpose_text(event):
+    return str(event.get('purpose_of_visit') or '')
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
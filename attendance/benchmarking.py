@@ -0,0 +1,78 @@
+"""
+Shared plumbing for the benchmark management commands.
+"""
+import math
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def benchmark_database(on_disk=False):
+    """
+    Run the block against a freshly migrated throwaway test database, with
+    the analytics cache replaced by a dummy so the database work is timed.
+    SQLite test databases live in shared memory, where concurrent writers
+    fail with "table is locked" instead of waiting; pass `on_disk` to use a
+    temporary file instead when the block writes from several threads.
+    """
+    directory = None
+    test_settings = connection.settings_dict.get('TEST', {})
+    if on_disk and connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp()
+        connection.settings_dict['TEST'] = {**test_settings, 'NAME': os.path.join(directory, 'benchmark.sqlite3')}
+    # DEBUG off, as in the test runner: query logging would skew timings
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    no_cache = override_settings(
+        CACHES={**settings.CACHES, 'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ANALYTICS_CACHE_ALIAS='benchmark',
+    )
+    try:
+        with no_cache:
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if directory:
+            connection.settings_dict['TEST'] = test_settings
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def time_calls(call, repeat, warmup=1):
+    """Wall time in milliseconds of each of `repeat` calls of `call(i)`"""
+    for i in range(warmup):
+        call(i)
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        call(warmup + i)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+    }
+
+
+def timed(call):
+    """(result, wall time in milliseconds) of `call()`"""
+    start = time.perf_counter()
+    result = call()
+    return result, (time.perf_counter() - start) * 1000
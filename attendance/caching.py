@@ -0,0 +1,137 @@
+"""
+Versioned cache for the analytics dashboard.
+
+Computed summaries are cached under data-version numbers that are bumped on
+every AttendanceRecord write, so a cached summary is never served after the
+data behind it changed (except within the stale window described below).
+There are two versions:
+
+* the *history* version, bumped by writes to dates before today (imports,
+  admin edits, archival). Ranges that end before today can only change
+  through those, so they are cached for ANALYTICS_CACHE_PAST_TTL;
+* the *live* version, bumped by writes to today's records. Ranges that
+  include today are cached for ANALYTICS_CACHE_LIVE_TTL and then served
+  stale for up to ANALYTICS_CACHE_STALE_TTL more while a single request
+  recomputes them (stale-while-revalidate).
+
+The versions are not kept in the cache but in the DataVersion table,
+bumped in the transaction that writes the records. Every process (web
+workers, management commands) sees a bump exactly when it sees the data
+behind it, so a per-process cache such as LocMemCache never serves a summary
+that another process has invalidated; a read costs one primary key query.
+Only the basic get/set/add/delete cache API is used, so this works with the
+local-memory and file-based backends.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import analytics
+from .models import DataVersion
+
+LIVE = 'live'
+HISTORY = 'history'
+
+
+def _cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def data_versions():
+    """Current data versions, {LIVE: ..., HISTORY: ...}, read with one query"""
+    versions = dict.fromkeys((LIVE, HISTORY), 0)
+    versions.update(DataVersion.objects.filter(scope__in=versions).values_list('scope', 'version'))
+    return versions
+
+
+def data_version(scope):
+    """Current data version for `scope` (LIVE or HISTORY)"""
+    return data_versions()[scope]
+
+
+def _bump(scope):
+    if DataVersion.objects.filter(scope=scope).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            # Start from the clock, so a database reset can never come back to
+            # a number that entries in a persistent cache were stored under
+            DataVersion.objects.create(scope=scope, version=time.time_ns())
+    except IntegrityError:
+        # Created by a concurrent write
+        DataVersion.objects.filter(scope=scope).update(version=F('version') + 1)
+
+
+def bump_data_version(dates=None):
+    """
+    Invalidate cached summaries affected by a write to records on `dates`
+    (an iterable of dates; None when unknown, which bumps both versions).
+
+    Call it in the transaction that writes the records: the bump commits
+    (or rolls back) with them, so a summary computed meanwhile from the old
+    data is stored under the old version.
+    """
+    if dates is None:
+        scopes = [LIVE, HISTORY]
+    else:
+        today = timezone.now().date()
+        scopes = sorted({LIVE if day >= today else HISTORY for day in dates})
+
+    for scope in scopes:
+        _bump(scope)
+
+
+def today_summary(today):
+    """Headline counters for today, cached until the next write to today"""
+    cache = _cache()
+    key = f"attendance:analytics:today:{today.isoformat()}:{data_version(LIVE)}"
+    summary = cache.get(key)
+    if summary is None:
+        summary = analytics.today_summary(today)
+        cache.set(key, summary, _setting('ANALYTICS_CACHE_LIVE_TTL', 60))
+    return summary
+
+
+def range_summary(filter_start, filter_end, today):
+    """Cached analytics.range_summary() for the given date range"""
+    if filter_end < today:
+        key = f"attendance:analytics:range:{filter_start}:{filter_end}:{data_version(HISTORY)}"
+        summary = _cache().get(key)
+        if summary is None:
+            summary = analytics.range_summary(filter_start, filter_end)
+            _cache().set(key, summary, _setting('ANALYTICS_CACHE_PAST_TTL', 24 * 60 * 60))
+        return summary
+
+    return _live_range_summary(filter_start, filter_end, today)
+
+
+def _live_range_summary(filter_start, filter_end, today):
+    cache = _cache()
+    fresh_ttl = _setting('ANALYTICS_CACHE_LIVE_TTL', 60)
+    stale_ttl = _setting('ANALYTICS_CACHE_STALE_TTL', 300)
+    key = f"attendance:analytics:live:{filter_start}:{filter_end}:{today}"
+    versions = data_versions()
+    version = (versions[LIVE], versions[HISTORY])
+
+    entry = cache.get(key)
+    if entry is not None:
+        age = time.time() - entry['computed_at']
+        if entry['version'] == version and age < fresh_ttl:
+            return entry['summary']
+        # Stale: let exactly one request recompute, everybody else gets the
+        # previous summary until it is done
+        if age < fresh_ttl + stale_ttl and not cache.add(f"{key}:refresh", 1, 30):
+            return entry['summary']
+
+    summary = analytics.range_summary(filter_start, filter_end)
+    cache.set(key, {'version': version, 'computed_at': time.time(), 'summary': summary}, fresh_ttl + stale_ttl)
+    cache.delete(f"{key}:refresh")
+    return summary
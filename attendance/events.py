@@ -0,0 +1,234 @@
+"""
+Live dashboard updates over Server-Sent Events.
+
+Check-ins and check-outs are handed to one in-process Publisher once their
+transaction commits. A single publisher thread drains them, computes the
+headline counters once for the whole batch, encodes each SSE message once
+and puts the same bytes on every connected dashboard's queue. The cost of an
+event does not grow with the number of open dashboards, and writes never
+wait on slow clients: a client whose queue fills up is disconnected (its
+EventSource reconnects and starts from fresh counters).
+
+Streams are only served under ASGI, where an open dashboard costs a
+coroutine. Under WSGI each one would hold a worker thread for as long as it
+stays open, so a few wall screens could starve a small deployment; there the
+dashboards poll occupancy_status every POLL_INTERVAL seconds instead.
+
+The publisher only sees writes made by its own process. Behind several
+worker processes a dashboard only receives the check-in and check-out events
+its own process handled, and the publisher sends fresh counters after
+HEARTBEAT_INTERVAL seconds without events. Today's check-in and check-out
+counts are cached under the data version kept in the database (see
+attendance.caching), so they trail writes handled by other processes by at
+most about HEARTBEAT_INTERVAL. The on-site count comes from
+attendance.occupancy, whose cache only follows the taps of the processes
+sharing it: with a per-process cache (the default LocMemCache) it trails
+other processes' writes by up to HEARTBEAT_INTERVAL plus
+OCCUPANCY_RECONCILE_INTERVAL, and by about HEARTBEAT_INTERVAL when
+OCCUPANCY_CACHE_ALIAS names a cache shared by the workers.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import caching, occupancy
+
+logger = logging.getLogger(__name__)
+
+CHECK_IN = 'check_in'
+CHECK_OUT = 'check_out'
+COUNTERS = 'counters'
+
+SUBSCRIBER_QUEUE_SIZE = 100
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+HEARTBEAT = b': keepalive\n\n'
+# Seconds between occupancy_status polls of dashboards that cannot stream
+POLL_INTERVAL = 30
+
+
+def streams_available(request):
+    """Whether live_events can stream to `request` (only under ASGI)"""
+    return isinstance(request, ASGIRequest)
+
+
+def live_update_context(request):
+    """Template context telling a dashboard whether to stream or poll"""
+    return {'live_events': streams_available(request), 'poll_interval': POLL_INTERVAL}
+
+
+def counters():
+    """Headline counters every event carries"""
+    today = timezone.localdate()
+    return {**caching.today_summary(today), 'on_site': occupancy.occupancy_count(today)}
+
+
+def encode(event_type, data):
+    """One SSE message"""
+    return f"event: {event_type}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n".encode()
+
+
+class Subscriber:
+    """A connected dashboard's queue of messages"""
+
+    def __init__(self):
+        self.queue = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped = True
+
+    def get(self, timeout):
+        """Next message, or HEARTBEAT after `timeout` seconds without one"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return HEARTBEAT
+
+
+class AsyncSubscriber(Subscriber):
+    """A connected dashboard served by an async (ASGI) response"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def deliver(self, message):
+        # Called from the publisher thread
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return HEARTBEAT
+
+
+class Publisher:
+    def __init__(self):
+        self.threaded = True
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._thread = None
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self.threaded and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='attendance-events', daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event_type, data=None):
+        """Queue an event for every connected dashboard; free when none are"""
+        if self._subscribers:
+            self._pending.put((event_type, data or {}))
+
+    def flush(self, timeout=None):
+        """
+        Send everything published so far, waiting up to `timeout` seconds for
+        the first event when there is none (no waiting when None).
+        """
+        try:
+            events = [self._pending.get(timeout=timeout) if timeout else self._pending.get_nowait()]
+        except queue.Empty:
+            return 0
+        while True:
+            try:
+                events.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+
+        # Computed once for the whole batch, whatever the number of clients
+        current = counters()
+        messages = [encode(event_type, {**data, 'counters': current}) for event_type, data in events]
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for message in messages:
+                subscriber.deliver(message)
+        return len(messages)
+
+    def step(self):
+        """One turn of the publisher thread"""
+        if not self.flush(timeout=HEARTBEAT_INTERVAL):
+            # Nothing written through this process for a while: pick up
+            # other processes' writes in fresh counters
+            self.publish(COUNTERS)
+
+    def _run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                # Keep serving dashboards through a failed counters query
+                logger.exception('Failed to publish attendance events')
+            finally:
+                close_old_connections()
+
+
+publisher = Publisher()
+
+
+def _person(record, user):
+    return {
+        'user_id': user.id,
+        'name': f"{user.first_name} {user.last_name}".strip() or user.email,
+        'user_type': user.user_type,
+        'date': record.date,
+    }
+
+
+def checked_in(record, user):
+    """Announce a check-in once the surrounding transaction commits"""
+    data = {**_person(record, user), 'time': record.check_in_time}
+    transaction.on_commit(lambda: publisher.publish(CHECK_IN, data))
+
+
+def checked_out(record, user):
+    """Announce a check-out once the surrounding transaction commits"""
+    data = {**_person(record, user), 'time': record.check_out_time}
+    transaction.on_commit(lambda: publisher.publish(CHECK_OUT, data))
+
+
+def counters_changed(dates):
+    """Push fresh counters after other writes to today's records commit"""
+    if timezone.localdate() in set(dates):
+        transaction.on_commit(lambda: publisher.publish(COUNTERS))
+
+
+async def astream(initial):
+    """SSE bytes for an async response, starting with the `initial` message"""
+    subscriber = AsyncSubscriber()
+    publisher.subscribe(subscriber)
+    try:
+        yield initial
+        while not subscriber.dropped:
+            yield await subscriber.get(HEARTBEAT_INTERVAL)
+    finally:
+        publisher.unsubscribe(subscriber)
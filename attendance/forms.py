@@ -1,22 +1,37 @@
 from django import forms
 from .models import AttendanceRecord
+from .purposes import MAX_LENGTH, canonical
 
 class CheckInForm(forms.ModelForm):
+    # Free text, interned into the purpose catalog when the record is written
+    purpose_of_visit = forms.CharField(
+        max_length=MAX_LENGTH,
+        required=False,
+        widget=forms.TextInput(attrs={
+            'placeholder': 'Why are you visiting today?',
+            'class': 'form-control'
+        }),
+    )
+
     class Meta:
         model = AttendanceRecord
-        fields = ['purpose_of_visit', 'comments']  # Removed temperature
+        fields = ['comments']  # Removed temperature
         widgets = {
             # Removed temperature widget
-            'purpose_of_visit': forms.TextInput(attrs={
-                'placeholder': 'Why are you visiting today?',
-                'class': 'form-control'
-            }),
             'comments': forms.Textarea(attrs={
                 'rows': 3, 
                 'placeholder': 'Any additional information...',
                 'class': 'form-control'
             }),
         }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.purpose_id:
+            self.initial.setdefault('purpose_of_visit', self.instance.purpose_of_visit)
+
+    def clean_purpose_of_visit(self):
+        return canonical(self.cleaned_data['purpose_of_visit'])
         
 class CheckOutForm(forms.Form):
     comments = forms.CharField(
@@ -26,4 +41,4 @@ class CheckOutForm(forms.Form):
             'class': 'form-control'
         }), 
         required=False
-    )
\ No newline at end of file
+    )
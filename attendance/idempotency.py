@@ -0,0 +1,185 @@
+"""
+Idempotency keys for the check-in/check-out APIs.
+
+Kiosks on flaky networks retry a request when its response is lost. A
+request sent with an `Idempotency-Key` header is handled once: its
+successful response is stored in IdempotencyKey, and retries carrying the
+same key get that response back from one primary key lookup. They skip the
+user lookup, the attendance tables and the side effects, and are marked
+with an `Idempotent-Replayed: true` header.
+
+* The first request claims the key with a short-lived row before running
+  the view. A retry arriving while it is still running gets 409.
+* Only 2xx responses are kept. After an error the claim is released, so a
+  retry runs the request again.
+* Reusing a key for a different request (another endpoint or body) gets
+  422.
+* Stored responses expire after IDEMPOTENCY_KEY_TTL seconds (default one
+  day). Claims expire after IN_FLIGHT_TIMEOUT seconds, so a worker dying
+  mid-request does not block the key. Every claim deletes the expired rows
+  first, through the expires_at index, which keeps the table down to the
+  keys of the last TTL.
+
+Requests without the header are handled as before.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+from .services import aretry_on_lock, retry_on_lock
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+IN_FLIGHT_TIMEOUT = 60
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+
+def fingerprint(request):
+    """Hash of what makes two requests the same: method, path and body"""
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _in_progress():
+    return _error(f'A request with this {HEADER} is still in progress, retry later', 409)
+
+
+def _replay(stored, request_fingerprint):
+    """The response to a request whose key is already stored"""
+    if stored.fingerprint != request_fingerprint:
+        return _error(f'{HEADER} was already used for a different request', 422)
+    if stored.status is None:
+        return _in_progress()
+    response = HttpResponse(stored.body, status=stored.status, content_type='application/json')
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def lookup(key):
+    """The unexpired IdempotencyKey row for `key`, or None"""
+    return IdempotencyKey.objects.filter(key=key, expires_at__gt=timezone.now()).first()
+
+
+async def alookup(key):
+    """Async lookup()"""
+    return await IdempotencyKey.objects.filter(key=key, expires_at__gt=timezone.now()).afirst()
+
+
+def claim(key, request_fingerprint):
+    """Take `key` for a request about to run; False if another request holds it"""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+            IdempotencyKey.objects.create(
+                key=key, fingerprint=request_fingerprint,
+                expires_at=now + timedelta(seconds=IN_FLIGHT_TIMEOUT),
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def finish(key, response):
+    """Store `response` for `key` if it succeeded, otherwise release the key"""
+    if not 200 <= response.status_code < 300:
+        release(key)
+        return
+    if hasattr(response, 'render'):
+        # REST framework responses are rendered after the view returns
+        response.render()
+    IdempotencyKey.objects.filter(key=key).update(
+        status=response.status_code,
+        body=response.content.decode(),
+        expires_at=timezone.now() + timedelta(seconds=_ttl()),
+    )
+
+
+def release(key):
+    IdempotencyKey.objects.filter(key=key).delete()
+
+
+_aclaim = sync_to_async(claim)
+_afinish = sync_to_async(finish)
+_arelease = sync_to_async(release)
+
+
+def _request_key(request):
+    """The request's Idempotency-Key, '' without one; ValueError if malformed"""
+    key = request.headers.get(HEADER, '').strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters')
+    return key
+
+
+def idempotent(view):
+    """
+    Handle requests to `view` (sync or async) that carry an Idempotency-Key
+    header once, replaying the stored response to their retries
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            try:
+                key = _request_key(request)
+            except ValueError as e:
+                return _error(str(e), 400)
+            if not key:
+                return await view(request, *args, **kwargs)
+
+            request_fingerprint = fingerprint(request)
+            stored = await alookup(key)
+            if stored is not None:
+                return _replay(stored, request_fingerprint)
+            if not await aretry_on_lock(lambda: _aclaim(key, request_fingerprint)):
+                return _in_progress()
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await _arelease(key)
+                raise
+            await aretry_on_lock(lambda: _afinish(key, response))
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            key = _request_key(request)
+        except ValueError as e:
+            return _error(str(e), 400)
+        if not key:
+            return view(request, *args, **kwargs)
+
+        request_fingerprint = fingerprint(request)
+        stored = lookup(key)
+        if stored is not None:
+            return _replay(stored, request_fingerprint)
+        if not retry_on_lock(lambda: claim(key, request_fingerprint)):
+            # Claimed by a concurrent request since the lookup
+            return _in_progress()
+        try:
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            release(key)
+            raise
+        retry_on_lock(lambda: finish(key, response))
+        return response
+    return wrapper
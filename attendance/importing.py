@@ -0,0 +1,319 @@
+"""
+Bulk import of historical attendance from CSV or JSON Lines.
+
+Rows carry email, date, check-in, check-out, purpose and comments; the
+column names of the CSV export are accepted, so an export can be imported
+elsewhere unchanged. Rows are read in batches. Each batch resolves its users
+with one query, creates the missing ones with bulk_create and a single
+precomputed unusable password, and inserts its records with bulk_create in
+one transaction. Existing (user, date) records, archived ones included, are
+skipped, updated or make the import fail, depending on the conflict mode.
+
+Input is read as bytes so the importer can report the byte offset after
+every committed batch; passing that offset back resumes an interrupted
+import right after the last committed row.
+"""
+import csv
+import json
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+from users.cache import normalize_email
+from users.models import User
+from .models import ArchivedAttendanceRecord, AttendanceRecord
+from .purposes import canonical, intern_many
+from .rollups import rebuild_rollups
+
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = (CSV, JSONL)
+
+SKIP = 'skip'
+UPDATE = 'update'
+FAIL = 'fail'
+CONFLICT_MODES = (SKIP, UPDATE, FAIL)
+
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+# Accepted input names for each field, the export's column name first
+FIELD_ALIASES = {
+    'email': ('email',),
+    'date': ('date',),
+    'check_in_time': ('check_in_time', 'check_in'),
+    'check_out_time': ('check_out_time', 'check_out'),
+    'purpose_of_visit': ('purpose_of_visit', 'purpose'),
+    'comments': ('comments',),
+}
+UPDATE_FIELDS = ['check_in_time', 'check_out_time', 'purpose', 'comments']
+
+
+class ImportConflict(Exception):
+    """Raised in FAIL mode when a batch contains records that already exist"""
+
+    def __init__(self, offset, keys):
+        self.offset = offset
+        self.keys = keys
+        sample = ', '.join(f"{email} on {day}" for email, day in keys[:5])
+        super().__init__(f"{len(keys)} record(s) already exist, e.g. {sample}")
+
+
+class ImportStats:
+    """Running totals of an import; `offset` is where to resume from"""
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.users_created = 0
+        self.errors = []
+        self.date_from = None
+        self.date_to = None
+
+    def error(self, offset, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((offset, message))
+
+    def cover(self, dates):
+        low, high = min(dates), max(dates)
+        self.date_from = low if self.date_from is None else min(self.date_from, low)
+        self.date_to = high if self.date_to is None else max(self.date_to, high)
+
+
+class _OffsetLines:
+    """Iterate decoded lines of a binary file, tracking the byte offset"""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raw = self.f.readline()
+        if not raw:
+            raise StopIteration
+        self.offset += len(raw)
+        return raw.decode('utf-8')
+
+
+def read_rows(f, input_format, offset=0):
+    """
+    Yield (start offset, end offset, row dict) for every row of the binary
+    file `f`, starting at byte `offset` (0 or an offset reported earlier).
+    """
+    if input_format == CSV:
+        f.seek(0)
+        reader = csv.reader(_OffsetLines(f))
+        header = [name.lstrip('\ufeff').strip() for name in next(reader, [])]
+        if offset:
+            f.seek(offset)
+        lines = _OffsetLines(f)
+        reader = csv.reader(lines)
+        start = lines.offset
+        for values in reader:
+            if any(values):
+                yield start, lines.offset, dict(zip(header, values))
+            start = lines.offset
+    else:
+        f.seek(offset)
+        lines = _OffsetLines(f)
+        start = lines.offset
+        for line in lines:
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield start, lines.offset, row
+            start = lines.offset
+
+
+def _field(row, name):
+    for alias in FIELD_ALIASES[name]:
+        value = row.get(alias)
+        if value not in (None, ''):
+            return str(value).strip()
+    return ''
+
+
+def _parse(parser, value):
+    """`parser(value)`, or None when the value is empty or malformed"""
+    try:
+        return parser(value) if value else None
+    except ValueError:
+        return None
+
+
+def _parse_moment(value, day):
+    """An aware datetime from an ISO datetime, or a time of day on `day`"""
+    if not value:
+        return None
+    moment = _parse(parse_datetime, value)
+    if moment is None:
+        clock = _parse(parse_time, value)
+        if clock is None or day is None:
+            raise ValueError(f"Invalid time '{value}'")
+        moment = datetime.combine(day, clock)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_row(row):
+    """Validate one input row; returns (email, date, fields) or raises ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError('Row is not a JSON object')
+    email = normalize_email(_field(row, 'email'))
+    if not email:
+        raise ValueError('email is required')
+
+    day = _field(row, 'date')
+    date = _parse(parse_date, day)
+    if day and date is None:
+        raise ValueError(f"Invalid date '{day}'")
+    check_in = _parse_moment(_field(row, 'check_in_time'), date)
+    check_out = _parse_moment(_field(row, 'check_out_time'), date)
+    if date is None:
+        if check_in is None:
+            raise ValueError('date or a full check-in timestamp is required')
+        date = timezone.localdate(check_in)
+    if check_in and check_out and check_out < check_in:
+        raise ValueError('check-out is before check-in')
+
+    return email, date, {
+        'check_in_time': check_in,
+        'check_out_time': check_out,
+        'purpose_of_visit': canonical(_field(row, 'purpose_of_visit')),
+        'comments': _field(row, 'comments'),
+    }
+
+
+def _resolve_users(emails, password, stats):
+    """Map each email to a user id, creating missing users in bulk"""
+    user_ids = dict(User.objects.filter(email__in=emails).values_list('email', 'id'))
+    missing = sorted(set(emails) - user_ids.keys())
+    if missing:
+        User.objects.bulk_create([User(email=email, password=password) for email in missing])
+        user_ids.update(User.objects.filter(email__in=missing).values_list('email', 'id'))
+        stats.users_created += len(missing)
+    return user_ids
+
+
+def _record_fields(fields, catalog):
+    """`fields` from parse_row() with the purpose text replaced by its Purpose"""
+    fields = dict(fields)
+    fields['purpose'] = catalog[fields.pop('purpose_of_visit')]
+    return fields
+
+
+def _write_batch(batch, conflict, password, stats):
+    """Write one batch of (start offset, email, date, fields) in a transaction"""
+    with transaction.atomic():
+        user_ids = _resolve_users({email for _, email, _, _ in batch}, password, stats)
+        catalog = intern_many(fields['purpose_of_visit'] for _, _, _, fields in batch)
+
+        # Later rows for the same person and day replace earlier ones when
+        # updating; otherwise the first one wins
+        records = {}
+        duplicates = []
+        for _, email, date, fields in batch:
+            key = (user_ids[email], date)
+            if key in records:
+                duplicates.append((email, date))
+                if conflict != UPDATE:
+                    continue
+            records[key] = AttendanceRecord(user_id=key[0], date=date, **_record_fields(fields, catalog))
+
+        candidates = {
+            'user_id__in': {user_id for user_id, _ in records},
+            'date__in': {date for _, date in records},
+        }
+        existing = set(AttendanceRecord.objects.filter(**candidates).values_list('user_id', 'date'))
+        archived = {
+            (record.user_id, record.date): record
+            for record in ArchivedAttendanceRecord.objects.filter(**candidates)
+            if (record.user_id, record.date) in records
+        }
+        existing = (existing & records.keys()) | archived.keys()
+
+        if conflict == FAIL and (existing or duplicates):
+            emails = {user_id: email for email, user_id in user_ids.items()}
+            keys = duplicates + [(emails[user_id], date) for user_id, date in sorted(existing)]
+            raise ImportConflict(batch[0][0], keys)
+
+        # Records other transactions add after the read above conflict too,
+        # so count the rows the insert itself adds
+        written = AttendanceRecord.objects.filter(**candidates)
+        before = written.count()
+        if conflict == UPDATE:
+            # Archived records are updated where they are
+            for key, record in archived.items():
+                for name in UPDATE_FIELDS:
+                    setattr(record, name, getattr(records[key], name))
+            ArchivedAttendanceRecord.objects.bulk_update(archived.values(), UPDATE_FIELDS)
+            AttendanceRecord.objects.bulk_create(
+                [record for key, record in records.items() if key not in archived], update_conflicts=True,
+                unique_fields=['user', 'date'], update_fields=UPDATE_FIELDS,
+            )
+        else:
+            AttendanceRecord.objects.bulk_create(
+                [record for key, record in records.items() if key not in existing],
+                ignore_conflicts=True,
+            )
+        created = written.count() - before
+        if conflict == UPDATE:
+            stats.updated += len(records) - created + len(duplicates)
+        else:
+            stats.skipped += len(records) - created + len(duplicates)
+        stats.created += created
+        stats.cover({date for _, date in records})
+
+
+def import_records(f, input_format=CSV, conflict=SKIP, offset=0,
+                   batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    """
+    Import attendance rows from the binary file `f` and return ImportStats.
+
+    Invalid rows are counted and reported in `stats.errors` but do not stop
+    the import. `on_batch(stats)` is called after every committed batch, when
+    `stats.offset` is the position to resume from. The rollups of the
+    imported dates are rebuilt at the end, even if the import fails midway.
+    """
+    stats = ImportStats(offset)
+    password = make_password(None)
+    batch = []
+    end = offset
+    try:
+        for start, end, row in read_rows(f, input_format, offset):
+            stats.rows += 1
+            try:
+                email, date, fields = parse_row(row)
+            except ValueError as e:
+                stats.error(start, str(e))
+                continue
+            batch.append((start, email, date, fields))
+            if len(batch) >= batch_size:
+                _write_batch(batch, conflict, password, stats)
+                batch = []
+                stats.offset = end
+                if on_batch:
+                    on_batch(stats)
+        if batch:
+            _write_batch(batch, conflict, password, stats)
+        stats.offset = end
+        if on_batch:
+            on_batch(stats)
+    finally:
+        if stats.date_from:
+            rebuild_rollups(stats.date_from, stats.date_to)
+    return stats
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import archive
+from attendance.models import AttendanceRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Move attendance records older than the archive horizon "
+        "(ATTENDANCE_ARCHIVE_AFTER_DAYS) from the live table to the archive, in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Archive records older than this many days (default: ATTENDANCE_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the records that would move')
+
+    def handle(self, *args, **options):
+        try:
+            before = archive.archive_horizon(days=options['days'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            count = AttendanceRecord.objects.filter(date__lt=before).count()
+            self.stdout.write(f"{count} records dated before {before} would be archived")
+            return
+
+        start = time.perf_counter()
+
+        def progress(moved, last_date):
+            rate = moved / max(time.perf_counter() - start, 1e-9)
+            self.stderr.write(f"{moved} records archived ({rate:.0f} records/s), through {last_date}")
+
+        moved = archive.archive_records(before, batch_size=options['batch_size'], on_batch=progress)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} records dated before {before} in {elapsed:.1f}s"
+        ))
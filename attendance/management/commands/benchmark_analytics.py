@@ -0,0 +1,57 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from attendance import analytics
+from attendance.benchmarking import benchmark_database, summarize, time_calls
+from attendance.rollups import rebuild_rollups
+from attendance.seeding import seed_attendance, seed_users
+
+RANGES = (30, 90, 365)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and report the query count and wall "
+        "time of the analytics dashboard summaries (uncached) over several ranges"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--repeat', type=int, default=10, help='Calls per summary')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            report = self.run_benchmark(options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{report['records']} records, {report['users']} users")
+        self.stdout.write(f"{'summary':<16}{'queries':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}")
+        for name, result in report['summaries'].items():
+            self.stdout.write(f"{name:<16}{result['queries']:>9}{result['p50_ms']:>11.2f}{result['p95_ms']:>11.2f}")
+
+    def run_benchmark(self, options):
+        users = seed_users(options['users'], prefix='bench')
+        records = seed_attendance(users, options['days'], seed=options['seed'])
+        rebuild_rollups()
+
+        today = timezone.localdate()
+        calls = {'today': lambda: analytics.today_summary(today)}
+        for days in RANGES:
+            calls[f'range {days}d'] = lambda days=days: analytics.range_summary(today - timedelta(days=days), today)
+
+        summaries = {}
+        for name, call in calls.items():
+            with CaptureQueriesContext(connection) as queries:
+                call()
+            summaries[name] = {'queries': len(queries), **summarize(time_calls(lambda i: call(), options['repeat']))}
+        return {'users': len(users), 'records': records, 'summaries': summaries}
@@ -0,0 +1,91 @@
+import json
+import statistics
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from attendance.benchmarking import benchmark_database, time_calls
+from attendance.models import AttendanceRecord
+from attendance.rollups import rebuild_rollups
+from attendance.seeding import seed_attendance, seed_users
+from users.models import User
+
+BENCHMARKED_VIEWS = ['attendance_list', 'attendance_dashboard', 'analytics_dashboard']
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and time the attendance list, dashboard "
+        "and analytics views with and without the AttendanceRecord query indexes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per view and phase')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            report = self.run_benchmark(options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{report['records']} records, {report['users']} users")
+        self.stdout.write(f"{'view':<24}{'without (ms)':>14}{'with (ms)':>12}{'speedup':>10}")
+        for name, timings in report['views'].items():
+            self.stdout.write(
+                f"{name:<24}{timings['without_indexes_ms']:>14.2f}"
+                f"{timings['with_indexes_ms']:>12.2f}{timings['speedup']:>9.1f}x"
+            )
+
+    def run_benchmark(self, options):
+        users = seed_users(options['users'], prefix='bench')
+        records = seed_attendance(users, options['days'], seed=options['seed'])
+        rebuild_rollups()
+        staff = User.objects.create_user(email='bench-staff@example.com', password='bench', is_staff=True)
+
+        client = Client()
+        client.force_login(staff)
+
+        indexes = AttendanceRecord._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(AttendanceRecord, index)
+        self.analyze()
+        without = {name: self.time_view(client, name, options['repeat']) for name in BENCHMARKED_VIEWS}
+
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(AttendanceRecord, index)
+        self.analyze()
+        with_indexes = {name: self.time_view(client, name, options['repeat']) for name in BENCHMARKED_VIEWS}
+
+        return {
+            'users': len(users),
+            'records': records,
+            'views': {
+                name: {
+                    'without_indexes_ms': without[name],
+                    'with_indexes_ms': with_indexes[name],
+                    'speedup': without[name] / with_indexes[name] if with_indexes[name] else 0,
+                }
+                for name in BENCHMARKED_VIEWS
+            },
+        }
+
+    @staticmethod
+    def analyze():
+        """Refresh planner statistics so both phases are planned fairly"""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    @staticmethod
+    def time_view(client, name, repeat):
+        """Median wall time in milliseconds of `repeat` GETs of a view"""
+        url = reverse(name)
+        return statistics.median(time_calls(lambda i: client.get(url), repeat))
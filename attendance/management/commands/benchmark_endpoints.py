@@ -0,0 +1,236 @@
+import json
+import platform
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+
+from attendance import services
+from attendance.benchmarking import benchmark_database, summarize, time_calls
+from attendance.models import AttendanceRecord
+from attendance.rollups import rebuild_rollups
+from attendance.seeding import seed_attendance, seed_users
+from users.models import User
+
+# URL confs whose every named route must have a request spec below
+BENCHMARKED_URLCONFS = ('attendance.urls', 'users.urls')
+
+# Check-in events per api_batch_attendance request
+BATCH_SIZE = 20
+
+
+class Context:
+    """
+    Users handed out to request specs. Read-only requests rotate through the
+    seeded users; requests that change state get a user of their own so each
+    call takes the same code path (a first check-in, a check-out of an open
+    visit, and so on).
+    """
+
+    def __init__(self, users):
+        self.users = users
+        self.password = make_password(None)
+        self.created = 0
+
+    def user(self, i):
+        return self.users[i % len(self.users)]
+
+    def new_user(self, user_type='visitor'):
+        self.created += 1
+        return User.objects.create(
+            email=f"bench-new{self.created}@example.com", user_type=user_type, password=self.password,
+        )
+
+    def checked_in_user(self):
+        user = self.new_user()
+        services.check_in(user, purpose_of_visit='Work')
+        return user
+
+
+def _json(method, url, payload):
+    return method, url, {'data': json.dumps(payload), 'content_type': 'application/json'}
+
+
+def _new_email(ctx, kind):
+    ctx.created += 1
+    return f"bench-{kind}{ctx.created}@example.com"
+
+
+# Each spec builds (client method, url, client kwargs) for call number i.
+# Specs run before the timed section, so any setup they do is not measured.
+REQUEST_SPECS = {
+    'attendance_dashboard': lambda i, ctx: ('get', reverse('attendance_dashboard'), {}),
+    'sign_attendance': lambda i, ctx: ('post', reverse('sign_attendance'), {'data': {
+        'email': ctx.new_user().email, 'check_in': '1', 'purpose_of_visit': 'Work',
+    }}),
+    'check_in': lambda i, ctx: ('post', reverse('check_in', args=[ctx.new_user().id]), {'data': {
+        'purpose_of_visit': 'Work', 'comments': '',
+    }}),
+    'check_out': lambda i, ctx: ('post', reverse('check_out', args=[ctx.checked_in_user().id]), {'data': {
+        'comments': 'Done',
+    }}),
+    'attendance_success': lambda i, ctx: ('get', reverse('attendance_success'), {}),
+    'attendance_list': lambda i, ctx: ('get', reverse('attendance_list'), {}),
+    'analytics_dashboard': lambda i, ctx: ('get', reverse('analytics_dashboard'), {}),
+    'attendance_heatmap': lambda i, ctx: ('get', reverse('attendance_heatmap'), {'data': {
+        'date_from': (timezone.now().date() - timedelta(days=365)).isoformat(),
+    }}),
+    'attendance_events': lambda i, ctx: ('get', reverse('attendance_events'), {}),
+    'attendance_export': lambda i, ctx: ('get', reverse('attendance_export'), {'data': {
+        'date_from': (timezone.now().date() - timedelta(days=30)).isoformat(),
+    }}),
+    'api_check_in': lambda i, ctx: _json('post', reverse('api_check_in'), {
+        'user_id': ctx.new_user().id, 'purpose_of_visit': 'Work',
+    }),
+    'api_check_out': lambda i, ctx: _json('post', reverse('api_check_out'), {'user_id': ctx.checked_in_user().id}),
+    'api_batch_attendance': lambda i, ctx: _json('post', reverse('api_batch_attendance'), {'events': [
+        {'action': 'check_in', 'user_id': ctx.new_user().id} for _ in range(BATCH_SIZE)
+    ]}),
+    'api_occupancy': lambda i, ctx: ('get', reverse('api_occupancy'), {}),
+    'api_attendance_records': lambda i, ctx: ('get', reverse('api_attendance_records'), {}),
+    'api_check_in_async': lambda i, ctx: _json('post', reverse('api_check_in_async'), {
+        'user_id': ctx.new_user().id, 'purpose_of_visit': 'Work',
+    }),
+    'api_check_out_async': lambda i, ctx: _json('post', reverse('api_check_out_async'), {
+        'user_id': ctx.checked_in_user().id,
+    }),
+    'api_attendance_records_async': lambda i, ctx: ('get', reverse('api_attendance_records_async'), {}),
+    'api_user_attendance': lambda i, ctx: ('get', reverse('api_user_attendance', args=[ctx.user(i).id]), {}),
+    'user-detail': lambda i, ctx: ('get', reverse('user-detail', args=[ctx.user(i).id]), {}),
+    'user-create': lambda i, ctx: _json('post', reverse('user-create'), {
+        'email': _new_email(ctx, 'create'), 'user_type': 'visitor', 'phone_number': '0700000000',
+    }),
+    'user-update': lambda i, ctx: _json('put', reverse('user-update', args=[ctx.user(i).id]), {
+        'last_name': f"Bench{i}",
+    }),
+    'user-delete': lambda i, ctx: ('delete', reverse('user-delete', args=[ctx.new_user().id]), {}),
+    'user-lookup-cache-stats': lambda i, ctx: ('get', reverse('user-lookup-cache-stats'), {}),
+    'user-search': lambda i, ctx: ('get', reverse('user-search'), {'data': {'q': ctx.user(i).email[:8]}}),
+    'user-profile': lambda i, ctx: _json('post', reverse('user-profile'), {
+        'email': _new_email(ctx, 'profile'), 'user_type': 'member', 'phone_number': '0700000000',
+    }),
+    'user-profile-detail': lambda i, ctx: _json('put', reverse('user-profile-detail', args=[ctx.user(i).id]), {
+        'first_name': f"Bench{i}",
+    }),
+}
+
+
+def benchmarked_url_names():
+    names = []
+    for urlconf in BENCHMARKED_URLCONFS:
+        names.extend(pattern.name for pattern in get_resolver(urlconf).url_patterns if pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and report p50/p95 latency, query count and "
+        "peak memory for every view and API in attendance.urls and users.urls"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=180)
+        parser.add_argument('--repeat', type=int, default=30, help='Timed requests per endpoint')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', nargs='*', help='Benchmark only these URL names')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        names = benchmarked_url_names()
+        missing = [name for name in names if name not in REQUEST_SPECS]
+        if missing:
+            raise CommandError(f"No benchmark request spec for: {', '.join(missing)}")
+        if options['only']:
+            names = [name for name in names if name in options['only']]
+
+        with benchmark_database():
+            report = self.run_benchmark(names, options)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def run_benchmark(self, names, options):
+        users = seed_users(options['users'], prefix='bench')
+        records = seed_attendance(users, options['days'], seed=options['seed'])
+        rebuild_rollups()
+        staff = User.objects.create_user(email='bench-staff@example.com', password='bench',
+                                         is_staff=True, user_type='staff')
+        # Leave today's slate empty so check-in/check-out paths do real writes
+        AttendanceRecord.objects.filter(date=timezone.now().date()).delete()
+
+        client = Client()
+        client.force_login(staff)
+        context = Context(users)
+
+        endpoints = {}
+        for name in names:
+            self.stderr.write(f"Benchmarking {name}")
+            endpoints[name] = self.measure(client, REQUEST_SPECS[name], context, options['repeat'])
+
+        return {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'users': len(users),
+                'days': options['days'],
+                'records': records,
+                'repeat': options['repeat'],
+                'seed': options['seed'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'endpoints': endpoints,
+        }
+
+    @staticmethod
+    def measure(client, spec, context, repeat):
+        # Build every request up front: one warm-up, the timed calls, then one
+        # call each for the query count and the memory peak, measured apart
+        # so neither the query log nor tracemalloc distorts the timings
+        requests = [spec(i, context) for i in range(repeat + 3)]
+
+        def send(i):
+            method, url, kwargs = requests[i]
+            response = getattr(client, method)(url, **kwargs)
+            if response.get('Content-Type') == 'text/event-stream':
+                # Endless: measure up to the first event
+                next(iter(response.streaming_content))
+                response.close()
+            elif response.streaming:
+                # Drain the body so the streamed work is measured too
+                for _ in response.streaming_content:
+                    pass
+            return response
+
+        timings = time_calls(send, repeat)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = send(repeat + 1)
+        # Read now: the next request resets the connection's query log
+        query_count = len(queries)
+        tracemalloc.start()
+        try:
+            send(repeat + 2)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            **summarize(timings),
+            'status': response.status_code,
+            'queries': query_count,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
@@ -0,0 +1,80 @@
+import json
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from attendance.benchmarking import benchmark_database, summarize, time_calls
+from attendance.models import AttendanceRecord
+from attendance.representation import record_rows, record_values
+from attendance.seeding import seed_attendance, seed_users
+
+try:
+    from rest_framework.renderers import JSONRenderer
+    from attendance.serializers import AttendanceRecordSerializer
+except ImportError:
+    JSONRenderer = AttendanceRecordSerializer = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and time serializing attendance records "
+        "to JSON with AttendanceRecordSerializer and with the values() rows of "
+        "attendance.representation"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Records serialized per call')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--days', type=int, default=60)
+        parser.add_argument('--repeat', type=int, default=10, help='Calls per path')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            report = self.run_benchmark(options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{report['rows']} records per call")
+        self.stdout.write(f"{'path':<10}{'p50 (ms)':>12}{'p95 (ms)':>12}{'peak (KB)':>12}")
+        for name, result in report['paths'].items():
+            self.stdout.write(
+                f"{name:<10}{result['p50_ms']:>12.1f}{result['p95_ms']:>12.1f}{result['peak_memory_kb']:>12.0f}"
+            )
+        if 'speedup' in report:
+            self.stdout.write(f"values() rows are {report['speedup']:.1f}x faster")
+
+    def run_benchmark(self, options):
+        users = seed_users(options['users'], prefix='bench')
+        seed_attendance(users, options['days'], seed=options['seed'])
+        ids = list(AttendanceRecord.objects.order_by('-date', '-id').values_list('id', flat=True)[:options['rows']])
+        if len(ids) < options['rows']:
+            raise CommandError(f"Only {len(ids)} records were seeded; raise --users or --days")
+        records = AttendanceRecord.objects.filter(id__in=ids).order_by('-date', '-id')
+
+        # Both paths run their query and encode the response body
+        paths = {
+            'values': lambda i: json.dumps(record_rows(record_values(records)), cls=DjangoJSONEncoder),
+        }
+        if AttendanceRecordSerializer is not None:
+            paths['values'] = lambda i: JSONRenderer().render(record_rows(record_values(records)))
+            paths['drf'] = lambda i: JSONRenderer().render(
+                AttendanceRecordSerializer(records.select_related('user'), many=True).data
+            )
+            if json.loads(paths['values'](0)) != json.loads(paths['drf'](0)):
+                raise CommandError('The two paths produce different JSON')
+
+        report = {'rows': len(ids), 'paths': {}}
+        for name, call in paths.items():
+            result = summarize(time_calls(call, options['repeat']))
+            tracemalloc.start()
+            call(0)
+            result['peak_memory_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+            report['paths'][name] = result
+        if 'drf' in report['paths']:
+            report['speedup'] = round(report['paths']['drf']['p50_ms'] / report['paths']['values']['p50_ms'], 1)
+        return report
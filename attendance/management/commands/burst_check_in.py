@@ -0,0 +1,99 @@
+import json
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from attendance.benchmarking import benchmark_database, summarize
+from attendance.models import AttendanceRecord
+from attendance.seeding import seed_users
+
+
+def _burst_worker(url, user_ids, start_at, interval):
+    """
+    Post a check-in/check-out for each of `user_ids` from this process, the
+    n-th one `n * interval` seconds after `start_at` (or as soon as the
+    previous request returns, when behind schedule).
+    """
+    client = Client()
+    results = []
+    for n, user_id in enumerate(user_ids):
+        delay = start_at + n * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.perf_counter()
+        response = client.post(url, {'user_id': user_id}, content_type='application/json')
+        results.append((response.status_code, (time.perf_counter() - start) * 1000))
+    connections.close_all()
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire check-ins, then check-outs, at the sync API from several worker "
+        "processes at a target rate, like a pre-forking WSGI server at opening "
+        "time, on a throwaway on-disk SQLite database, and count lost writes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Worker processes')
+        parser.add_argument('--requests', type=int, default=400, help='Check-ins (and check-outs) in total')
+        parser.add_argument('--rate', type=float, default=200, help='Target requests per second, all workers together')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('This command needs the fork start method')
+        with benchmark_database(on_disk=True):
+            report = self.run_burst(options['processes'], options['requests'], options['rate'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f"{options['requests']} requests per phase from {options['processes']} processes "
+            f"at {options['rate']:.0f} req/s, journal_mode={report['journal_mode']}"
+        )
+        self.stdout.write(f"{'phase':<12}{'req/s':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}{'errors':>8}{'lost':>6}")
+        for phase in ('check_in', 'check_out'):
+            result = report[phase]
+            self.stdout.write(
+                f"{phase:<12}{result['requests_per_second']:>9.0f}{result['p50_ms']:>11.2f}"
+                f"{result['p95_ms']:>11.2f}{result['errors']:>8}{result['lost']:>6}"
+            )
+
+    def run_burst(self, processes, requests, rate):
+        user_ids = [user.id for user in seed_users(requests, prefix='burst')]
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        report = {'journal_mode': journal_mode}
+
+        for phase, name, written in (
+            ('check_in', 'api_check_in', {'check_in_time__isnull': False}),
+            ('check_out', 'api_check_out', {'check_out_time__isnull': False}),
+        ):
+            # Closed before forking so every worker opens its own connection
+            connections.close_all()
+            chunks = [user_ids[i::processes] for i in range(processes)]
+            start_at = time.time() + 0.5
+            interval = processes / rate
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.starmap(
+                    _burst_worker, [(reverse(name), chunk, start_at, interval) for chunk in chunks],
+                )
+            elapsed = time.time() - start_at
+            results = [result for chunk in results for result in chunk]
+            statuses, timings = zip(*results)
+
+            saved = AttendanceRecord.objects.filter(user_id__in=user_ids, **written).count()
+            report[phase] = {
+                **summarize(timings),
+                'requests_per_second': round(len(results) / elapsed, 1),
+                'errors': sum(1 for code in statuses if code >= 300),
+                'lost': len(user_ids) - saved,
+            }
+        return report
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance import importing
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import historical attendance (email, date, check-in, check-out, "
+        "purpose, comments) from a CSV or JSON Lines file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or JSON Lines file')
+        parser.add_argument('--format', choices=importing.FORMATS,
+                            help='Input format (default: guessed from the file extension)')
+        parser.add_argument('--conflict', choices=importing.CONFLICT_MODES, default=importing.SKIP,
+                            help='What to do with records that already exist for that user and date')
+        parser.add_argument('--offset', type=int, default=0,
+                            help='Byte offset to resume from, as reported by an interrupted import')
+        parser.add_argument('--batch-size', type=int, default=importing.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        input_format = options['format'] or (
+            importing.JSONL if options['path'].endswith(('.jsonl', '.ndjson')) else importing.CSV
+        )
+        start = time.perf_counter()
+
+        def progress(stats):
+            rate = stats.rows / max(time.perf_counter() - start, 1e-9)
+            self.stderr.write(f"{stats.rows} rows ({rate:.0f} rows/s), resume offset {stats.offset}")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                stats = importing.import_records(
+                    f, input_format, conflict=options['conflict'], offset=options['offset'],
+                    batch_size=options['batch_size'], on_batch=progress,
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+        except importing.ImportConflict as e:
+            raise CommandError(f"{e}. Nothing after byte {e.offset} was imported; "
+                               f"rerun with --offset {e.offset} and another --conflict mode")
+
+        for offset, message in stats.errors:
+            self.stderr.write(self.style.WARNING(f"Skipped invalid row at byte {offset}: {message}"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.rows} rows in {elapsed:.1f}s ({stats.rows / max(elapsed, 1e-9):.0f} rows/s): "
+            f"{stats.created} created, {stats.updated} updated, {stats.skipped} skipped, "
+            f"{stats.invalid} invalid, {stats.users_created} new users"
+        ))
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from attendance.benchmarking import benchmark_database, summarize, timed
+from attendance.seeding import seed_users
+
+# (stack, URL name) pairs for the burst; each phase gets fresh users
+PHASES = (
+    ('wsgi', 'check_in', 'api_check_in'),
+    ('wsgi', 'check_out', 'api_check_out'),
+    ('asgi', 'check_in', 'api_check_in_async'),
+    ('asgi', 'check_out', 'api_check_out_async'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a check-in/check-out burst against the sync API under WSGI "
+        "and the async API under ASGI, on a throwaway database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Check-ins (and check-outs) per stack')
+        parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight at once')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        # On disk: the WSGI phase writes from several threads at once
+        with benchmark_database(on_disk=True):
+            report = self.run_load_test(options['requests'], options['concurrency'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{options['requests']} requests per phase, concurrency {options['concurrency']}")
+        self.stdout.write(f"{'phase':<18}{'req/s':>9}{'p50 (ms)':>11}{'p95 (ms)':>11}{'errors':>8}")
+        for phase, result in report.items():
+            self.stdout.write(
+                f"{phase:<18}{result['requests_per_second']:>9.0f}{result['p50_ms']:>11.2f}"
+                f"{result['p95_ms']:>11.2f}{result['errors']:>8}"
+            )
+
+    def run_load_test(self, requests, concurrency):
+        users = seed_users(requests * 2, prefix='load')
+        user_ids = {
+            'wsgi': [user.id for user in users[:requests]],
+            'asgi': [user.id for user in users[requests:]],
+        }
+        report = {}
+        for stack, action, name in PHASES:
+            burst = self.wsgi_burst if stack == 'wsgi' else self.asgi_burst
+            results, elapsed = timed(lambda: burst(reverse(name), user_ids[stack], concurrency))
+            statuses, timings = zip(*results)
+            report[f"{stack} {action}"] = {
+                **summarize(timings),
+                'requests_per_second': round(len(results) / (elapsed / 1000), 1),
+                'errors': sum(1 for code in statuses if code >= 300),
+            }
+        return report
+
+    @staticmethod
+    def wsgi_burst(url, user_ids, concurrency):
+        """Sync views through the WSGI handler, one thread per worker"""
+        def post(user_id):
+            response, elapsed = timed(lambda: Client().post(url, {'user_id': user_id}, content_type='application/json'))
+            return response.status_code, elapsed
+
+        def worker(chunk):
+            try:
+                return [post(user_id) for user_id in chunk]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            chunks = [user_ids[i::concurrency] for i in range(concurrency)]
+            return [result for results in pool.map(worker, chunks) for result in results]
+
+    @staticmethod
+    def asgi_burst(url, user_ids, concurrency):
+        """Async views through the ASGI handler, `concurrency` tasks in flight"""
+        async def burst():
+            client = AsyncClient()
+            limit = asyncio.Semaphore(concurrency)
+
+            async def post(user_id):
+                async with limit:
+                    start = time.perf_counter()
+                    response = await client.post(url, {'user_id': user_id}, content_type='application/json')
+                    return response.status_code, (time.perf_counter() - start) * 1000
+
+            return await asyncio.gather(*(post(user_id) for user_id in user_ids))
+
+        return asyncio.run(burst())
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Backfill the daily attendance rollup table (and the heatmap cells) from AttendanceRecord"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='First date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--date-to', help='Last date to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = self._parse_date(options['date_from'])
+            date_to = self._parse_date(options['date_to'])
+        except ValueError:
+            raise CommandError('Invalid date format. Use YYYY-MM-DD')
+
+        written = rebuild_rollups(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup rows"))
+
+    @staticmethod
+    def _parse_date(value):
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
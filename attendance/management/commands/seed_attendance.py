@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.rollups import rebuild_rollups
+from attendance.seeding import seed_attendance, seed_users
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed N users across every user type and M days of realistic "
+        "check-in/check-out records using bulk inserts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Number of users to create')
+        parser.add_argument('--days', type=int, default=90, help='Days of attendance ending today')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for reproducible data')
+        parser.add_argument('--prefix', default='seed', help='Email prefix of the generated users')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(email__startswith=prefix).exists():
+            raise CommandError(f"Users with the email prefix '{prefix}' already exist; pass another --prefix")
+
+        start = time.perf_counter()
+        users = seed_users(options['users'], prefix=prefix, batch_size=options['batch_size'])
+        records = seed_attendance(users, options['days'], seed=options['seed'], batch_size=options['batch_size'])
+        rebuild_rollups()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users and {records} attendance records in {elapsed:.1f}s"
+        ))
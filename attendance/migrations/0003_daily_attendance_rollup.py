@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_remove_temperature_field'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user_type', models.CharField(max_length=10)),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('visit_count', models.PositiveIntegerField(default=0)),
+                ('completed_count', models.PositiveIntegerField(default=0)),
+                ('duration_seconds', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date', 'hour'],
+                'unique_together': {('date', 'user_type', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+COLUMNS = 'id, user_id, check_in_time, check_out_time, date, purpose_of_visit, comments'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendance_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('check_in_time', models.DateTimeField(blank=True, null=True)),
+                ('check_out_time', models.DateTimeField(blank=True, null=True)),
+                ('date', models.DateField()),
+                ('purpose_of_visit', models.CharField(blank=True, max_length=255)),
+                ('comments', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'db_table': 'attendance_history',
+                'ordering': ['-date', '-check_in_time'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedAttendanceRecord',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('check_in_time', models.DateTimeField(blank=True, null=True)),
+                ('check_out_time', models.DateTimeField(blank=True, null=True)),
+                ('date', models.DateField()),
+                ('purpose_of_visit', models.CharField(blank=True, max_length=255)),
+                ('comments', models.TextField(blank=True, default='')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_attendance_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date', '-check_in_time'],
+                'indexes': [models.Index(fields=['date', 'check_in_time', 'check_out_time'], name='archive_date_times_idx')],
+                'unique_together': {('user', 'date')},
+            },
+        ),
+        migrations.RunSQL(
+            f"CREATE VIEW attendance_history AS "
+            f"SELECT {COLUMNS} FROM attendance_attendancerecord "
+            f"UNION ALL "
+            f"SELECT {COLUMNS} FROM attendance_archivedattendancerecord",
+            "DROP VIEW attendance_history",
+        ),
+    ]
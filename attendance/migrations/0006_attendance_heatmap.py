@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_attendance_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('arrivals', models.PositiveIntegerField(default=0)),
+                ('on_site', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date', 'hour'],
+                'unique_together': {('date', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:42
+
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+OLD_COLUMNS = 'id, user_id, check_in_time, check_out_time, date, purpose_of_visit, comments'
+NEW_COLUMNS = 'id, user_id, check_in_time, check_out_time, date, purpose_id, comments'
+RECORD_MODELS = ('AttendanceRecord', 'ArchivedAttendanceRecord')
+PURPOSE_MAP = 'attendance_purpose_map'
+
+
+def create_view(columns):
+    return (
+        f"CREATE VIEW attendance_history AS "
+        f"SELECT {columns} FROM attendance_attendancerecord "
+        f"UNION ALL "
+        f"SELECT {columns} FROM attendance_archivedattendancerecord"
+    )
+
+
+def canonical(text):
+    # attendance.purposes.canonical() as of this migration
+    return ' '.join(str(text or '').split())[:255]
+
+
+def intern_purposes(apps, schema_editor):
+    """Point every record at the Purpose of its free text, named after its most common spelling"""
+    Purpose = apps.get_model('attendance', 'Purpose')
+    record_models = [apps.get_model('attendance', name) for name in RECORD_MODELS]
+    spellings, texts = defaultdict(Counter), defaultdict(set)
+    for model in record_models:
+        counts = model.objects.values_list('purpose_of_visit').annotate(count=models.Count('id')).order_by()
+        for text, count in counts:
+            key = canonical(text).casefold()
+            if key:
+                spellings[key][canonical(text)] += count
+                texts[key].add(text)
+
+    Purpose.objects.bulk_create(
+        Purpose(key=key, name=names.most_common(1)[0][0]) for key, names in spellings.items()
+    )
+    ids = dict(Purpose.objects.values_list('key', 'id'))
+
+    # One text -> purpose mapping, applied with one UPDATE per table rather
+    # than one per purpose
+    quote = schema_editor.quote_name
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"CREATE TEMPORARY TABLE {quote(PURPOSE_MAP)} (purpose_of_visit TEXT PRIMARY KEY, purpose_id BIGINT NOT NULL)")
+        cursor.executemany(
+            f"INSERT INTO {quote(PURPOSE_MAP)} (purpose_of_visit, purpose_id) VALUES (%s, %s)",
+            [(text, ids[key]) for key, key_texts in texts.items() for text in key_texts],
+        )
+        for model in record_models:
+            table = quote(model._meta.db_table)
+            cursor.execute(
+                f"UPDATE {table} SET purpose_id = ("
+                f"SELECT purpose_id FROM {quote(PURPOSE_MAP)} WHERE {quote(PURPOSE_MAP)}.purpose_of_visit = {table}.purpose_of_visit"
+                f") WHERE purpose_of_visit IN (SELECT purpose_of_visit FROM {quote(PURPOSE_MAP)})"
+            )
+        cursor.execute(f"DROP TABLE {quote(PURPOSE_MAP)}")
+
+
+def restore_purpose_text(apps, schema_editor):
+    purposes = schema_editor.quote_name(apps.get_model('attendance', 'Purpose')._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        for model_name in RECORD_MODELS:
+            table = schema_editor.quote_name(apps.get_model('attendance', model_name)._meta.db_table)
+            cursor.execute(
+                f"UPDATE {table} SET purpose_of_visit = ("
+                f"SELECT name FROM {purposes} WHERE id = {table}.purpose_id"
+                f") WHERE purpose_id IS NOT NULL"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0006_attendance_heatmap'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # The view selects the column being replaced
+        migrations.RunSQL("DROP VIEW attendance_history", create_view(OLD_COLUMNS)),
+        migrations.CreateModel(
+            name='Purpose',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('name', models.CharField(max_length=255)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedattendancerecord',
+            name='purpose',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archived_attendance_records', to='attendance.purpose'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='purpose',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='attendance_records', to='attendance.purpose'),
+        ),
+        migrations.RunPython(intern_purposes, restore_purpose_text),
+        migrations.RemoveIndex(
+            model_name='attendancerecord',
+            name='attendance_date_purpose_idx',
+        ),
+        migrations.RemoveField(
+            model_name='archivedattendancerecord',
+            name='purpose_of_visit',
+        ),
+        migrations.RemoveField(
+            model_name='attendancerecord',
+            name='purpose_of_visit',
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['date', 'purpose'], name='attendance_date_purpose_idx'),
+        ),
+        migrations.RemoveField(
+            model_name='attendancehistory',
+            name='purpose_of_visit',
+        ),
+        migrations.AddField(
+            model_name='attendancehistory',
+            name='purpose',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='attendance.purpose'),
+        ),
+        migrations.RunSQL(create_view(NEW_COLUMNS), "DROP VIEW attendance_history"),
+    ]
@@ -3,17 +3,173 @@ from django.utils import timezone
 from users.models import User
 
 
-class AttendanceRecord(models.Model):
+class Purpose(models.Model):
+    """
+    One purpose of visit, referenced by attendance records instead of free
+    text. Spellings are matched on `key`, their canonical form (see
+    attendance.purposes); `name` is the first spelling seen.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class PurposeOfVisitMixin:
+    """The free-text `purpose_of_visit` of records that reference a Purpose"""
+
+    @property
+    def purpose_of_visit(self):
+        """The purpose's name, '' when none was given"""
+        return self.purpose.name if self.purpose_id else ''
+
+
+class AttendanceRecord(PurposeOfVisitMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance_records')
     check_in_time = models.DateTimeField(null=True, blank=True)
     check_out_time = models.DateTimeField(null=True, blank=True)
     date = models.DateField(default=timezone.now)
-    purpose_of_visit = models.CharField(max_length=255, blank=True)
+    purpose = models.ForeignKey(Purpose, on_delete=models.PROTECT, null=True, blank=True,
+                                related_name='attendance_records')
     comments = models.TextField(blank=True, default="")
     
     class Meta:
         unique_together = ['user', 'date']
         ordering = ['-date', '-check_in_time']
+        indexes = [
+            # Day listings ordered by check-in time, and date-range scans that
+            # only need the check-in/check-out times (visit durations)
+            models.Index(fields=['date', 'check_in_time', 'check_out_time'], name='attendance_date_times_idx'),
+            # Visits still open on a given day (the "currently on site" lookups)
+            models.Index(fields=['date'], condition=models.Q(check_out_time__isnull=True),
+                         name='attendance_open_visits_idx'),
+            # Purpose breakdowns over a date range
+            models.Index(fields=['date', 'purpose'], name='attendance_date_purpose_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.email} - {self.date}"
\ No newline at end of file
+        return f"{self.user.email} - {self.date}"
+
+
+class DailyAttendanceRollup(models.Model):
+    """
+    Pre-aggregated attendance counts keyed by (date, user_type, check-in hour).
+    Rows are updated in the same transaction as check-in/check-out so the
+    analytics dashboard never has to scan AttendanceRecord for its charts.
+    Use the `rebuild_attendance_rollups` management command to backfill.
+    """
+    date = models.DateField()
+    user_type = models.CharField(max_length=10)
+    hour = models.PositiveSmallIntegerField()
+    visit_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    duration_seconds = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'user_type', 'hour']
+        ordering = ['date', 'hour']
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00 {self.user_type} ({self.visit_count})"
+
+
+class HeatmapCell(models.Model):
+    """
+    Arrivals and people on site per (date, local hour), the cells of the
+    weekday by hour occupancy heatmap. A visit is on site in every hour from
+    its check-in to its check-out. Maintained with DailyAttendanceRollup (see
+    attendance.rollups); all 24 cells of a date are created together.
+    """
+    date = models.DateField()
+    hour = models.PositiveSmallIntegerField()
+    arrivals = models.PositiveIntegerField(default=0)
+    on_site = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['date', 'hour']
+        ordering = ['date', 'hour']
+
+    def __str__(self):
+        return f"{self.date} {self.hour}:00 ({self.arrivals} arrived, {self.on_site} on site)"
+
+
+class DataVersion(models.Model):
+    """
+    Version numbers of the analytics data, bumped in the transaction of
+    every AttendanceRecord write, so every process sees a bump exactly when
+    it sees the data behind it. See attendance.caching.
+    """
+    scope = models.CharField(max_length=16, primary_key=True)
+    version = models.PositiveBigIntegerField()
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response to an API request sent with an Idempotency-Key header,
+    replayed to retries of that request until `expires_at`. `status` is None
+    while the first request is still being handled. See attendance.idempotency.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    body = models.TextField(blank=True, default="")
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.status or 'in flight'})"
+
+
+class ArchivedAttendanceRecord(PurposeOfVisitMixin, models.Model):
+    """
+    AttendanceRecord rows older than the archive horizon, moved here by the
+    `archive_attendance` management command so the live table (and its
+    indexes) only hold recent visits. Records keep their live id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_attendance_records')
+    check_in_time = models.DateTimeField(null=True, blank=True)
+    check_out_time = models.DateTimeField(null=True, blank=True)
+    date = models.DateField()
+    purpose = models.ForeignKey(Purpose, on_delete=models.PROTECT, null=True, blank=True,
+                                related_name='archived_attendance_records')
+    comments = models.TextField(blank=True, default="")
+
+    class Meta:
+        unique_together = ['user', 'date']
+        ordering = ['-date', '-check_in_time']
+        indexes = [
+            models.Index(fields=['date', 'check_in_time', 'check_out_time'], name='archive_date_times_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.date} (archived)"
+
+
+class AttendanceHistory(PurposeOfVisitMixin, models.Model):
+    """
+    Read-only view over both tiers: the live AttendanceRecord table UNION ALL
+    ArchivedAttendanceRecord. Query it through attendance.archive, which only
+    uses it when a date range reaches into the archive.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name='+')
+    check_in_time = models.DateTimeField(null=True, blank=True)
+    check_out_time = models.DateTimeField(null=True, blank=True)
+    date = models.DateField()
+    purpose = models.ForeignKey(Purpose, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='+')
+    comments = models.TextField(blank=True, default="")
+
+    class Meta:
+        managed = False
+        db_table = 'attendance_history'
+        ordering = ['-date', '-check_in_time']
+
+    def __str__(self):
+        return f"{self.user.email} - {self.date}"
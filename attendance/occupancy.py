@@ -0,0 +1,171 @@
+"""
+Live occupancy: how many people are on site today, and who.
+
+Two cache entries per day are kept up to date by every check-in and
+check-out (after the write commits):
+
+* the occupancy count, a plain integer moved with cache.incr() and
+  cache.decr(), so a tap costs one atomic cache operation and a headcount
+  one cache read;
+* the "currently on site" set, keyed by user id. It is read-modified-written
+  under a short cache.add() lock; an update that cannot get the lock within
+  LOCK_WAIT seconds is left to the next reconcile rather than dropping the
+  entries, so polls keep being served from the cache during a burst.
+
+Writes whose effect is unknown (an admin edit, a deletion) drop the entries
+and the next read rebuilds them from the open visits, which the partial
+attendance_open_visits_idx index covers. Reads also rebuild entries older
+than OCCUPANCY_RECONCILE_INTERVAL seconds, which corrects any drift: a set
+update given up on, or a tap racing with a rebuild.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AttendanceRecord
+
+LOCK_TIMEOUT = 5
+# How long a set update waits for the lock, polling every LOCK_POLL seconds
+LOCK_WAIT = 0.05
+LOCK_POLL = 0.005
+# Entries outlive their day a little so late check-outs still find them
+ENTRY_TIMEOUT = 2 * 24 * 60 * 60
+
+
+def _cache():
+    return caches[getattr(settings, 'OCCUPANCY_CACHE_ALIAS', 'default')]
+
+
+def _reconcile_interval():
+    return getattr(settings, 'OCCUPANCY_RECONCILE_INTERVAL', 60)
+
+
+def _keys(day):
+    key = f"attendance:occupancy:{day.isoformat()}"
+    return f"{key}:count", f"{key}:on_site", f"{key}:reconciled_at", f"{key}:lock"
+
+
+def _entry(record, user):
+    return {
+        'name': f"{user.first_name} {user.last_name}".strip() or user.email,
+        'user_type': user.user_type,
+        'check_in_time': record.check_in_time.isoformat(),
+    }
+
+
+def reconcile(day=None):
+    """Rebuild the cached count and set for `day` (default today) from the DB"""
+    day = day or timezone.localdate()
+    open_visits = AttendanceRecord.objects.filter(
+        date=day, check_in_time__isnull=False, check_out_time__isnull=True,
+    ).select_related('user').only(
+        'check_in_time', 'user__email', 'user__first_name', 'user__last_name', 'user__user_type',
+    )
+    on_site = {record.user_id: _entry(record, record.user) for record in open_visits}
+    reconciled_at = time.time()
+    count_key, on_site_key, reconciled_key, _ = _keys(day)
+    _cache().set_many({
+        count_key: len(on_site),
+        on_site_key: (on_site, reconciled_at),
+        reconciled_key: reconciled_at,
+    }, ENTRY_TIMEOUT)
+    return on_site, reconciled_at
+
+
+def _fresh(reconciled_at):
+    return reconciled_at is not None and time.time() - reconciled_at < _reconcile_interval()
+
+
+def occupancy_count(day=None):
+    """Number of people checked in and not yet out on `day` (default today)"""
+    day = day or timezone.localdate()
+    count_key, _, reconciled_key, _ = _keys(day)
+    entries = _cache().get_many([count_key, reconciled_key])
+    if count_key in entries and _fresh(entries.get(reconciled_key)):
+        # A check-out racing with a rebuild can take it one below the truth
+        # until the next one
+        return max(entries[count_key], 0)
+    return len(reconcile(day)[0])
+
+
+def on_site(day=None):
+    """({user_id: {name, user_type, check_in_time}}, reconciled_at) for `day`"""
+    day = day or timezone.localdate()
+    entry = _cache().get(_keys(day)[1])
+    if entry is not None and _fresh(entry[1]):
+        return entry
+    return reconcile(day)
+
+
+def _count(day, delta):
+    cache = _cache()
+    try:
+        cache.incr(_keys(day)[0], delta)
+    except ValueError:
+        # Nothing cached yet, the next read builds it
+        pass
+
+
+def _lock(cache, lock_key):
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(LOCK_POLL)
+    return True
+
+
+def _update_on_site(day, change):
+    cache = _cache()
+    _, on_site_key, _, lock_key = _keys(day)
+    if not _lock(cache, lock_key):
+        # Still contended: the next reconcile picks the change up
+        return
+    try:
+        entry = cache.get(on_site_key)
+        if entry is None:
+            return
+        users, reconciled_at = entry
+        change(users)
+        cache.set(on_site_key, (users, reconciled_at), ENTRY_TIMEOUT)
+    finally:
+        cache.delete(lock_key)
+
+
+def _checked_in(day, user_id, entry):
+    _count(day, 1)
+    _update_on_site(day, lambda users: users.__setitem__(user_id, entry))
+
+
+def _checked_out(day, user_id):
+    _count(day, -1)
+    _update_on_site(day, lambda users: users.pop(user_id, None))
+
+
+def checked_in(record, user):
+    """Add `user` to the occupancy of the record's day once the write commits"""
+    entry = _entry(record, user)
+    transaction.on_commit(lambda: _checked_in(record.date, user.id, entry))
+
+
+def checked_out(record, user):
+    """Remove `user` from the occupancy of the record's day once the write commits"""
+    transaction.on_commit(lambda: _checked_out(record.date, user.id))
+
+
+def invalidate(day):
+    """Drop the cached occupancy for `day`; the next read rebuilds it"""
+    invalidate_many([day])
+
+
+def invalidate_on_commit(dates):
+    """Drop the cached occupancy of `dates` once the surrounding transaction commits"""
+    dates = set(dates)
+    transaction.on_commit(lambda: invalidate_many(dates))
+
+
+def invalidate_many(dates):
+    _cache().delete_many([key for day in dates for key in _keys(day)[:3]])
@@ -0,0 +1,133 @@
+"""
+Keyset (cursor) pagination for attendance record listings.
+
+Pages are ordered by (-date, -id) and the cursor carries the key of the last
+row served, so fetching page N costs the same as fetching page 1: the next
+page is an index range scan starting after that key instead of an OFFSET.
+
+The admin changelist keeps Django's numbered pages but counts them with
+EstimatedCountPaginator, which never runs an exact COUNT(*) over the table.
+"""
+import base64
+from datetime import date as date_type
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import ArchivedAttendanceRecord, AttendanceRecord
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Filtered admin changelists count at most this many rows
+COUNT_LIMIT = 10000
+
+
+class InvalidPageRequest(ValueError):
+    """Raised when a client sends a malformed cursor or limit"""
+
+
+def encode_cursor(record_date, record_id):
+    raw = f"{record_date.isoformat()}:{record_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        record_date, record_id = raw.split(':')
+        return date_type.fromisoformat(record_date), int(record_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidPageRequest('Invalid cursor')
+
+
+def parse_limit(value):
+    """Parse the `limit` query parameter, clamped to MAX_PAGE_SIZE"""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidPageRequest('limit must be an integer')
+    if limit < 1:
+        raise InvalidPageRequest('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def _page_query(queryset, cursor, limit):
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        after_date, after_id = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(date__lt=after_date) | Q(date=after_date, id__lt=after_id)
+        )
+    # Fetch one extra row to learn whether another page exists
+    return queryset[:limit + 1]
+
+
+def _split_page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if isinstance(last, dict):
+            # A values() queryset
+            next_cursor = encode_cursor(last['date'], last['id'])
+        else:
+            next_cursor = encode_cursor(last.date, last.id)
+    return rows, next_cursor
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return ``(rows, next_cursor)`` for the page of `queryset` (models or
+    values() including date and id) that follows `cursor`. `next_cursor` is
+    None on the last page.
+    """
+    return _split_page(list(_page_query(queryset, cursor, limit)), limit)
+
+
+async def akeyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Async version of keyset_page()"""
+    rows = [row async for row in _page_query(queryset, cursor, limit)]
+    return _split_page(rows, limit)
+
+
+def estimated_count(queryset):
+    """
+    The number of rows of an unfiltered `queryset`, estimated from the span of
+    its ids: two primary key index lookups (min() and max() in one query
+    would scan the table on SQLite). Ids are never reused, so the estimate
+    overcounts the rows gone from the middle of the table. For attendance
+    records those are mostly archived ones: imports give old dates new, high
+    ids, and archiving then moves them out from between newer records. The
+    archive keeps their ids, so they are counted by a range scan of its
+    primary key over the span and subtracted. That range is empty when
+    records are archived in id order, and rows deleted outright are still
+    overcounted.
+    """
+    ids = queryset.order_by().values_list('id', flat=True)
+    first, last = ids.order_by('id').first(), ids.order_by('-id').first()
+    if first is None:
+        return 0
+    span = last - first + 1
+    if queryset.model is AttendanceRecord:
+        span -= ArchivedAttendanceRecord.objects.filter(id__gt=first, id__lt=last).count()
+    return max(span, 1)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists of tables too big to COUNT(*) on every
+    page view. Unfiltered listings use estimated_count(); filtered ones
+    count their matches up to COUNT_LIMIT, so pages past the limit are not
+    linked.
+    """
+    count_limit = COUNT_LIMIT
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            return estimated_count(self.object_list)
+        return self.object_list[:self.count_limit].count()
@@ -0,0 +1,68 @@
+"""
+The purpose-of-visit catalog.
+
+Records reference a Purpose instead of carrying the free text, so purpose
+breakdowns group on a small integer column and the records tables do not
+repeat the same strings. Free text is canonicalized and interned when a
+record is written: whitespace is collapsed, and spellings that only differ in
+case share one Purpose, named after the first spelling seen.
+"""
+from django.db.models import Q
+
+from .models import Purpose
+
+MAX_LENGTH = Purpose._meta.get_field('name').max_length
+
+
+def canonical(text):
+    """`text` with surrounding whitespace stripped and inner runs collapsed"""
+    return ' '.join(str(text or '').split())[:MAX_LENGTH]
+
+
+def purpose_key(text):
+    """What spellings of the same purpose are matched on"""
+    return canonical(text).casefold()
+
+
+def intern(text):
+    """The Purpose for free-text `text`, created if new; None when blank"""
+    key = purpose_key(text)
+    if not key:
+        return None
+    purpose, _ = Purpose.objects.get_or_create(key=key, defaults={'name': canonical(text)})
+    return purpose
+
+
+async def aintern(text):
+    """Async intern()"""
+    key = purpose_key(text)
+    if not key:
+        return None
+    purpose, _ = await Purpose.objects.aget_or_create(key=key, defaults={'name': canonical(text)})
+    return purpose
+
+
+def intern_many(texts):
+    """
+    ``{text: Purpose or None}`` for an iterable of free texts, creating the
+    new purposes with one bulk insert and reading them all back in one query.
+    """
+    texts = list(texts)
+    names = {}
+    for text in texts:
+        names.setdefault(purpose_key(text), canonical(text))
+    names.pop('', None)
+    if names:
+        Purpose.objects.bulk_create(
+            [Purpose(key=key, name=name) for key, name in names.items()], ignore_conflicts=True,
+        )
+    by_key = {purpose.key: purpose for purpose in Purpose.objects.filter(key__in=names)} if names else {}
+    return {text: by_key.get(purpose_key(text)) for text in texts}
+
+
+def matching_purposes(text):
+    """Subquery of the ids of purposes whose name contains every word of `text`"""
+    matches = Q()
+    for word in canonical(text).split():
+        matches &= Q(name__icontains=word)
+    return Purpose.objects.filter(matches).values('id')
@@ -0,0 +1,62 @@
+"""
+Lean JSON rows for the attendance list APIs.
+
+AttendanceRecordSerializer builds a nested UserSerializer and a tree of field
+objects for every record, which dominates the cost of large listings. The
+list endpoints instead read the columns they need with values(), the user
+and purpose joined in the same query, and format them the way the serializer
+does. The JSON is identical, no model instances or serializer fields are
+created, and REST framework is not needed at all.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+# Columns of one row; user__* and purpose__* come from joins
+RECORD_VALUES = (
+    'id', 'user_id', 'date', 'check_in_time', 'check_out_time', 'purpose__name', 'comments',
+    'user__email', 'user__first_name', 'user__last_name', 'user__user_type',
+)
+
+
+def format_datetime(value, tz):
+    """`value` as REST framework renders it: ISO 8601 in `tz`, 'Z' for UTC"""
+    if value is None:
+        return None
+    if tz is not None:
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def record_values(queryset):
+    """`queryset` of AttendanceRecord as dicts of RECORD_VALUES"""
+    return queryset.values(*RECORD_VALUES)
+
+
+def record_row(values, tz):
+    """One row of record_values() in AttendanceRecordSerializer's shape"""
+    return {
+        'id': values['id'],
+        'user': values['user_id'],
+        'user_details': {
+            'id': values['user_id'],
+            'email': values['user__email'],
+            'first_name': values['user__first_name'],
+            'last_name': values['user__last_name'],
+            'user_type': values['user__user_type'],
+        },
+        'date': values['date'].isoformat(),
+        'check_in_time': format_datetime(values['check_in_time'], tz),
+        'check_out_time': format_datetime(values['check_out_time'], tz),
+        'purpose_of_visit': values['purpose__name'] or '',
+        'comments': values['comments'],
+    }
+
+
+def record_rows(rows):
+    """Serializer-shaped dicts for rows of record_values()"""
+    # Looked up once: the current time zone is a thread/context local
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    return [record_row(values, tz) for values in rows]
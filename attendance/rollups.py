@@ -0,0 +1,249 @@
+"""
+Incremental maintenance of the DailyAttendanceRollup and HeatmapCell tables.
+
+Every check-in adds one visit to the (date, user_type, hour) bucket of the
+check-in time, and every check-out adds the visit duration to that same
+bucket. The check-in/check-out services and batches run these inside the
+transaction that writes the AttendanceRecord. Other saves and deletes of a
+record (the admin, the shell) go through signals.py, which takes the
+record's previous state back out and counts the new one in. Deleting an
+archived record, directly or through its user, takes it back out the same
+way, and saving a user with a new user_type moves all of that user's visits
+to the buckets of the new type. Writes that bypass model signals (seeding,
+imports, queryset.update() of users' types) call rebuild_rollups() for
+their dates.
+
+The heatmap cells follow the same events: a check-in counts one arrival and
+one person on site in its hour, and the check-out adds the person to the
+remaining hours of the visit, up to the hour of the check-out.
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from .caching import bump_data_version
+from .archive import records_between
+from .models import DailyAttendanceRollup, HeatmapCell
+
+HOURS = range(24)
+
+
+def _bucket(record, user_type=None):
+    """Return the rollup key for a record that has been checked in"""
+    if user_type is None:
+        user_type = record.user.user_type
+    return {
+        'date': record.date,
+        'user_type': user_type,
+        'hour': timezone.localtime(record.check_in_time).hour,
+    }
+
+
+def _bump(key, **deltas):
+    """Add `deltas` to the rollup row for `key`, creating the row if needed"""
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if DailyAttendanceRollup.objects.filter(**key).update(**increments) or _removal(deltas):
+        return
+    try:
+        with transaction.atomic():
+            DailyAttendanceRollup.objects.create(**key, **deltas)
+    except IntegrityError:
+        # Another request created the bucket between our UPDATE and INSERT
+        DailyAttendanceRollup.objects.filter(**key).update(**increments)
+
+
+def _removal(deltas):
+    # Taking a visit back out of a bucket that was never built (records
+    # bulk-inserted without a rebuild) must not create negative rows
+    return min(deltas.values()) < 0
+
+
+def _span(record):
+    """(date, first hour, last hour) of the local hours a checked-in visit spans"""
+    first = last = timezone.localtime(record.check_in_time).hour
+    if record.check_out_time and record.check_out_time > record.check_in_time:
+        check_out = timezone.localtime(record.check_out_time)
+        # Visits running past midnight stay on their check-in date
+        last = check_out.hour if check_out.date() <= record.date else HOURS[-1]
+    return record.date, first, last
+
+
+def _bump_hours(day, first, last, **deltas):
+    """Add `deltas` to the heatmap cells of `day` from hour `first` to `last`"""
+    cells = HeatmapCell.objects.filter(date=day, hour__gte=first, hour__lte=last)
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if cells.update(**increments) or _removal(deltas):
+        return
+    # First visit of the day: lay out all of its cells (concurrent requests
+    # doing the same are ignored) and count again
+    HeatmapCell.objects.bulk_create([HeatmapCell(date=day, hour=hour) for hour in HOURS], ignore_conflicts=True)
+    cells.update(**increments)
+
+
+def visit_seconds(record):
+    """Duration of a completed visit in whole seconds, or 0 if not countable"""
+    if not record.check_in_time or not record.check_out_time:
+        return 0
+    return max(int((record.check_out_time - record.check_in_time).total_seconds()), 0)
+
+
+def record_check_in(record, user_type=None):
+    """Count a new check-in in the rollup"""
+    if record.check_in_time:
+        _bump(_bucket(record, user_type), visit_count=1)
+        day, hour, _ = _span(record)
+        _bump_hours(day, hour, hour, arrivals=1, on_site=1)
+
+
+def record_check_out(record, user_type=None):
+    """Add a completed visit's duration to the rollup"""
+    seconds = visit_seconds(record)
+    if seconds > 0:
+        _bump(_bucket(record, user_type), completed_count=1, duration_seconds=seconds)
+        day, first, last = _span(record)
+        if last > first:
+            _bump_hours(day, first + 1, last, on_site=1)
+
+
+class RollupBatch:
+    """
+    Accumulates rollup increments for many check-ins/check-outs so that a
+    batch of writes costs one UPDATE (or INSERT) per touched bucket rather
+    than one per event. Call `apply()` inside the writing transaction.
+    """
+
+    def __init__(self):
+        self._deltas = defaultdict(Counter)
+        self._cells = defaultdict(Counter)
+
+    @staticmethod
+    def _key(bucket):
+        return (bucket['date'], bucket['user_type'], bucket['hour'])
+
+    def check_in(self, record, user_type=None, sign=1):
+        if record.check_in_time:
+            self._deltas[self._key(_bucket(record, user_type))]['visit_count'] += sign
+            day, hour, _ = _span(record)
+            self._cells[day, hour].update(arrivals=sign, on_site=sign)
+
+    def check_out(self, record, user_type=None, sign=1):
+        seconds = visit_seconds(record)
+        if seconds > 0:
+            deltas = self._deltas[self._key(_bucket(record, user_type))]
+            deltas['completed_count'] += sign
+            deltas['duration_seconds'] += sign * seconds
+            day, first, last = _span(record)
+            for hour in range(first + 1, last + 1):
+                self._cells[day, hour]['on_site'] += sign
+
+    def add(self, record, user_type=None):
+        """Count everything `record` holds so far: its check-in and check-out"""
+        self.check_in(record, user_type)
+        self.check_out(record, user_type)
+
+    def remove(self, record, user_type=None):
+        """Take back what add() counted for `record`"""
+        self.check_in(record, user_type, sign=-1)
+        self.check_out(record, user_type, sign=-1)
+
+    def apply(self):
+        # Increments that cancel out (an edit that moved nothing) are skipped
+        for (date, user_type, hour), deltas in self._deltas.items():
+            deltas = {field: value for field, value in deltas.items() if value}
+            if deltas:
+                _bump({'date': date, 'user_type': user_type, 'hour': hour}, **deltas)
+        for (date, hour), deltas in self._cells.items():
+            deltas = {field: value for field, value in deltas.items() if value}
+            if deltas:
+                _bump_hours(date, hour, hour, **deltas)
+        self._deltas.clear()
+        self._cells.clear()
+
+
+def rebuild_rollups(date_from=None, date_to=None):
+    """
+    Recompute rollup rows (and heatmap cells, see rebuild_heatmap()) from
+    the live and archived records for the given date range (inclusive,
+    open-ended when a bound is None). Returns the number of rollup rows
+    written.
+    """
+    records = records_between(date_from, date_to).filter(check_in_time__isnull=False)
+    rollups = DailyAttendanceRollup.objects.all()
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+
+    completed = Q(check_out_time__gt=F('check_in_time'))
+    grouped = records.annotate(
+        hour=ExtractHour('check_in_time')
+    ).values(
+        'date', 'user__user_type', 'hour'
+    ).annotate(
+        visits=Count('id'),
+        completed=Count('id', filter=completed),
+        duration=Sum(F('check_out_time') - F('check_in_time'), filter=completed),
+    ).order_by()
+
+    rows = [
+        DailyAttendanceRollup(
+            date=entry['date'],
+            user_type=entry['user__user_type'],
+            hour=entry['hour'],
+            visit_count=entry['visits'],
+            completed_count=entry['completed'],
+            duration_seconds=int(entry['duration'].total_seconds()) if entry['duration'] else 0,
+        )
+        for entry in grouped
+    ]
+
+    with transaction.atomic():
+        rollups.delete()
+        DailyAttendanceRollup.objects.bulk_create(rows, batch_size=1000)
+        rebuild_heatmap(date_from, date_to)
+        bump_data_version()
+    return len(rows)
+
+
+def rebuild_heatmap(date_from=None, date_to=None):
+    """
+    Recompute the heatmap cells from the live and archived records for the
+    given date range (inclusive, open-ended when a bound is None), from one
+    query grouping the visits by date and first and last hour on site.
+    Returns the number of cells written.
+    """
+    completed = Q(check_out_time__gt=F('check_in_time'))
+    # The SQL counterpart of _span()
+    spans = records_between(date_from, date_to).filter(check_in_time__isnull=False).values(
+        'date',
+        first=ExtractHour('check_in_time'),
+        last=Case(
+            When(completed & Q(check_out_time__date__gt=F('date')), then=Value(HOURS[-1])),
+            When(completed, then=ExtractHour('check_out_time')),
+            default=ExtractHour('check_in_time'),
+        ),
+    ).annotate(visits=Count('id')).order_by()
+
+    arrivals, on_site = defaultdict(Counter), defaultdict(Counter)
+    for span in spans:
+        arrivals[span['date']][span['first']] += span['visits']
+        for hour in range(span['first'], span['last'] + 1):
+            on_site[span['date']][hour] += span['visits']
+
+    cells = [
+        HeatmapCell(date=day, hour=hour, arrivals=arrivals[day][hour], on_site=on_site[day][hour])
+        for day in sorted(arrivals)
+        for hour in HOURS
+    ]
+    stale = HeatmapCell.objects.all()
+    if date_from:
+        stale = stale.filter(date__gte=date_from)
+    if date_to:
+        stale = stale.filter(date__lte=date_to)
+    with transaction.atomic():
+        stale.delete()
+        HeatmapCell.objects.bulk_create(cells, batch_size=1000)
+    return len(cells)
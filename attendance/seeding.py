@@ -0,0 +1,85 @@
+"""
+Deterministic generation of realistic attendance data for benchmarks.
+
+Users are spread across every USER_TYPE_CHOICES value and each day gets a
+weekday-weighted share of visitors arriving mostly in the morning. Rows are
+written with bulk_create and passwords are set to a single precomputed
+unusable hash, so seeding millions of records takes seconds, not hours.
+"""
+import random
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from users.models import User
+from .caching import bump_data_version
+from .models import AttendanceRecord
+from .purposes import intern_many
+
+PURPOSES = [
+    'Meeting', 'Work', 'Training', 'Workshop', 'Interview', 'Hackathon',
+    'Mentorship', 'Networking', 'Event', 'Library', 'Delivery', 'Other',
+]
+
+# Share of users who visit on a given weekday (Monday first)
+WEEKDAY_TURNOUT = [0.45, 0.5, 0.5, 0.45, 0.35, 0.1, 0.05]
+
+
+def seed_users(count, prefix='seed', batch_size=5000):
+    """Create `count` users spread across every user type and return them"""
+    user_types = [choice for choice, _ in User.USER_TYPE_CHOICES]
+    password = make_password(None)
+    users = [
+        User(
+            email=f"{prefix}{i}@example.com",
+            user_type=user_types[i % len(user_types)],
+            first_name=f"User{i}",
+            last_name=prefix.capitalize(),
+            phone_number=f"07{i:08d}"[-15:],
+            password=password,
+        )
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=batch_size)
+    return list(User.objects.filter(email__startswith=prefix).only('id', 'user_type'))
+
+
+def _visit(rng, user, day, purposes):
+    arrival = time(hour=min(int(rng.triangular(7, 17, 9)), 23), minute=rng.randrange(60))
+    check_in = timezone.make_aware(datetime.combine(day, arrival))
+    check_out = None
+    # Roughly one visit in ten never checks out
+    if rng.random() > 0.1:
+        check_out = check_in + timedelta(minutes=int(rng.triangular(15, 600, 180)))
+    return AttendanceRecord(
+        user_id=user.id,
+        date=day,
+        check_in_time=check_in,
+        check_out_time=check_out,
+        purpose=rng.choice(purposes),
+    )
+
+
+def seed_attendance(users, days, end_date=None, seed=0, batch_size=5000):
+    """
+    Create attendance records for `users` over the `days` days ending at
+    `end_date` (default today). Returns the number of records created.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or timezone.now().date()
+    catalog = intern_many(PURPOSES)
+    purposes = [catalog[text] for text in PURPOSES]
+    created = 0
+    pending = []
+    for offset in range(days - 1, -1, -1):
+        day = end_date - timedelta(days=offset)
+        turnout = WEEKDAY_TURNOUT[day.weekday()]
+        pending.extend(_visit(rng, user, day, purposes) for user in users if rng.random() < turnout)
+        if len(pending) >= batch_size:
+            AttendanceRecord.objects.bulk_create(pending, batch_size=batch_size)
+            created += len(pending)
+            pending = []
+    AttendanceRecord.objects.bulk_create(pending, batch_size=batch_size)
+    bump_data_version()
+    return created + len(pending)
@@ -11,9 +11,10 @@ class UserSerializer(serializers.ModelSerializer):
 
 class AttendanceRecordSerializer(serializers.ModelSerializer):
     user_details = UserSerializer(source='user', read_only=True)
+    purpose_of_visit = serializers.CharField(read_only=True)
 
     class Meta:
         model = AttendanceRecord
         fields = ['id', 'user', 'user_details', 'date', 'check_in_time', 'check_out_time',
-                  'temperature', 'purpose_of_visit', 'comments']
+                  'purpose_of_visit', 'comments']
         read_only_fields = ['date', 'check_in_time', 'check_out_time']
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+Race-free check-in and check-out.
+
+Both operations are a single conditional write against the (user, date) row:
+
+* check-in is an upsert that only touches an existing row while its
+  check_in_time IS NULL, so two simultaneous taps cannot both succeed and the
+  unique constraint never surfaces as an IntegrityError;
+* check-out is an UPDATE guarded by check_out_time IS NULL.
+
+On SQLite and PostgreSQL the write returns the row with RETURNING, which makes
+the common case one round trip. Other backends fall back to guarded ORM
+updates with the same exactly-once semantics.
+
+Writes that find the database locked (SQLite under a burst of check-ins) are
+retried a bounded number of times with jittered exponential backoff, see
+retry_on_lock().
+
+acheck_in() and acheck_out() are the async counterparts for the ASGI views.
+They keep the exactly-once guarantees using the async ORM (aget_or_create
+plus guarded aupdate calls), but as async code cannot hold a transaction,
+the rollup update follows the record write instead of sharing its
+transaction.
+"""
+import asyncio
+import random
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .caching import bump_data_version
+from .models import AttendanceRecord
+from . import events, occupancy, purposes, rollups
+
+
+class CheckInError(Exception):
+    """Base class for check-in/check-out outcomes that are not a write"""
+
+    def __init__(self, message, record=None):
+        super().__init__(message)
+        self.record = record
+
+
+class AlreadyCheckedIn(CheckInError):
+    pass
+
+
+class AlreadyCheckedOut(CheckInError):
+    pass
+
+
+class NotCheckedIn(CheckInError):
+    pass
+
+
+def _supports_returning():
+    return connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert
+
+
+def _field(name):
+    return AttendanceRecord._meta.get_field(name)
+
+
+def _column(name):
+    return connection.ops.quote_name(_field(name).column)
+
+
+def _prep(name, value):
+    return _field(name).get_db_prep_value(value, connection)
+
+
+def _from_db(name, value):
+    """Convert a raw column value returned by RETURNING to its Python value"""
+    field = _field(name)
+    expression = field.get_col(AttendanceRecord._meta.db_table)
+    for converter in connection.ops.get_db_converters(expression) + field.get_db_converters(connection):
+        value = converter(value, expression, connection)
+    return value
+
+
+def _locked(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def _retry_delays():
+    """Sleeps between attempts: full jitter over an exponentially growing cap"""
+    attempts = getattr(settings, 'CHECK_IN_RETRY_ATTEMPTS', 5)
+    backoff = getattr(settings, 'CHECK_IN_RETRY_BACKOFF', 0.05)
+    return [random.uniform(0, backoff * 2 ** attempt) for attempt in range(attempts - 1)]
+
+
+def retry_on_lock(operation):
+    """
+    Return `operation()`, running it again after a short sleep when the
+    database reports it is locked. Inside an outer transaction the lock error
+    is raised as is, since only the caller can retry the whole transaction.
+    """
+    if connection.in_atomic_block:
+        return operation()
+    for delay in _retry_delays():
+        try:
+            return operation()
+        except OperationalError as e:
+            if not _locked(e):
+                raise
+        time.sleep(delay)
+    return operation()
+
+
+async def aretry_on_lock(operation):
+    """Async retry_on_lock() for a coroutine function `operation`"""
+    for delay in _retry_delays():
+        try:
+            return await operation()
+        except OperationalError as e:
+            if not _locked(e):
+                raise
+        await asyncio.sleep(delay)
+    return await operation()
+
+
+def check_out_comment(comments):
+    return f"\nCheck-out comments: {comments}" if comments else ''
+
+
+def check_in(user, purpose_of_visit='', comments='', when=None):
+    """
+    Check `user` in for today and return the record. `purpose_of_visit` is
+    free text, interned into the purpose catalog. Raises AlreadyCheckedIn
+    (carrying the existing record) if they already checked in today.
+    """
+    when = when or timezone.now()
+    return retry_on_lock(lambda: _check_in(user, purpose_of_visit, comments, when))
+
+
+def _check_in(user, purpose_of_visit, comments, when):
+    record = AttendanceRecord(
+        user=user,
+        date=timezone.localdate(when),
+        check_in_time=when,
+        purpose=purposes.intern(purpose_of_visit),
+        comments=comments or '',
+    )
+    with transaction.atomic():
+        if _supports_returning():
+            record.id = _upsert_check_in(record)
+        else:
+            record.id = _guarded_check_in(record)
+        if record.id is None:
+            raise AlreadyCheckedIn('Already checked in', _existing(user, record.date))
+        rollups.record_check_in(record, user.user_type)
+        bump_data_version([record.date])
+        occupancy.checked_in(record, user)
+        events.checked_in(record, user)
+    return record
+
+
+def _upsert_check_in(record):
+    table = connection.ops.quote_name(AttendanceRecord._meta.db_table)
+    user_id, date, check_in_time, purpose, comments = (
+        _column(name) for name in ('user', 'date', 'check_in_time', 'purpose', 'comments')
+    )
+    sql = (
+        f"INSERT INTO {table} ({user_id}, {date}, {check_in_time}, {purpose}, {comments}) "
+        f"VALUES (%s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({user_id}, {date}) DO UPDATE SET "
+        f"{check_in_time} = excluded.{check_in_time}, "
+        f"{purpose} = excluded.{purpose}, "
+        f"{comments} = excluded.{comments} "
+        f"WHERE {table}.{check_in_time} IS NULL "
+        f"RETURNING {_column('id')}"
+    )
+    params = [
+        record.user_id,
+        _prep('date', record.date),
+        _prep('check_in_time', record.check_in_time),
+        record.purpose_id,
+        record.comments,
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _guarded_check_in(record):
+    pending = AttendanceRecord.objects.filter(user=record.user, date=record.date, check_in_time__isnull=True)
+    values = {
+        'check_in_time': record.check_in_time,
+        'purpose': record.purpose,
+        'comments': record.comments,
+    }
+    if not pending.update(**values):
+        try:
+            with transaction.atomic():
+                # Not save(): the caller counts the check-in in the rollup,
+                # which signals.update_rollups() would count a second time
+                AttendanceRecord.objects.bulk_create([record])
+        except IntegrityError:
+            # Someone inserted the row first; we only win if it is still pending
+            if not pending.update(**values):
+                return None
+    return AttendanceRecord.objects.filter(user=record.user, date=record.date).values_list('id', flat=True).get()
+
+
+def check_out(user, comments='', when=None):
+    """
+    Check `user` out for today and return the record. Raises NotCheckedIn or
+    AlreadyCheckedOut (carrying the existing record) when there is nothing to
+    close.
+    """
+    when = when or timezone.now()
+    return retry_on_lock(lambda: _check_out(user, comments, when))
+
+
+def _check_out(user, comments, when):
+    today = timezone.localdate(when)
+    with transaction.atomic():
+        if _supports_returning():
+            record = _returning_check_out(user, today, when, check_out_comment(comments))
+        else:
+            record = _guarded_check_out(user, today, when, check_out_comment(comments))
+        if record is None:
+            existing = _existing(user, today)
+            if existing is None or existing.check_in_time is None:
+                raise NotCheckedIn('No check-in record found for today', existing)
+            raise AlreadyCheckedOut('Already checked out', existing)
+        rollups.record_check_out(record, user.user_type)
+        bump_data_version([today])
+        occupancy.checked_out(record, user)
+        events.checked_out(record, user)
+    return record
+
+
+def _returning_check_out(user, today, when, comment):
+    table = connection.ops.quote_name(AttendanceRecord._meta.db_table)
+    user_id, date, check_in_time, check_out_time, comments = (
+        _column(name) for name in ('user', 'date', 'check_in_time', 'check_out_time', 'comments')
+    )
+    returned = ('id', 'check_in_time', 'purpose', 'comments')
+    sql = (
+        f"UPDATE {table} SET {check_out_time} = %s, {comments} = {comments} || %s "
+        f"WHERE {user_id} = %s AND {date} = %s "
+        f"AND {check_in_time} IS NOT NULL AND {check_out_time} IS NULL "
+        f"RETURNING {', '.join(_column(name) for name in returned)}"
+    )
+    params = [_prep('check_out_time', when), comment, user.id, _prep('date', today)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    values = {_field(name).attname: _from_db(name, value) for name, value in zip(returned, row)}
+    return AttendanceRecord(user=user, date=today, check_out_time=when, **values)
+
+
+def _guarded_check_out(user, today, when, comment):
+    open_visit = AttendanceRecord.objects.filter(
+        user=user, date=today, check_in_time__isnull=False, check_out_time__isnull=True
+    )
+    if not open_visit.update(check_out_time=when, comments=Concat('comments', Value(comment))):
+        return None
+    return AttendanceRecord.objects.select_related('user').get(user=user, date=today)
+
+
+def _existing(user, day):
+    return AttendanceRecord.objects.filter(user=user, date=day).first()
+
+
+def _record_side_effects(record, user, check_in, counted=False):
+    # `counted`: signals.update_rollups() already counted the record, which
+    # it does for rows inserted with save()
+    with transaction.atomic():
+        if check_in:
+            if not counted:
+                rollups.record_check_in(record, user.user_type)
+            occupancy.checked_in(record, user)
+            events.checked_in(record, user)
+        else:
+            rollups.record_check_out(record, user.user_type)
+            occupancy.checked_out(record, user)
+            events.checked_out(record, user)
+        bump_data_version([record.date])
+
+
+_arecord_side_effects = sync_to_async(_record_side_effects)
+
+
+async def _aexisting(user, day):
+    record = await AttendanceRecord.objects.select_related('purpose').filter(user=user, date=day).afirst()
+    if record is not None:
+        # Serializers read record.user and record.purpose, which async code
+        # cannot lazy-load
+        record.user = user
+    return record
+
+
+async def acheck_in(user, purpose_of_visit='', comments='', when=None):
+    """Async check_in()"""
+    when = when or timezone.now()
+    values = {
+        'check_in_time': when,
+        'purpose': await aretry_on_lock(lambda: purposes.aintern(purpose_of_visit)),
+        'comments': comments or '',
+    }
+    # Each statement commits on its own, so each is retried on its own
+    record, created = await aretry_on_lock(lambda: AttendanceRecord.objects.aget_or_create(
+        user=user, date=timezone.localdate(when), defaults=values,
+    ))
+    if not created:
+        # The row exists: claim it only while nobody has checked in on it
+        if record.check_in_time or not await aretry_on_lock(lambda: AttendanceRecord.objects.filter(
+            pk=record.pk, check_in_time__isnull=True
+        ).aupdate(**values)):
+            raise AlreadyCheckedIn('Already checked in', await _aexisting(user, record.date))
+        for name, value in values.items():
+            setattr(record, name, value)
+        record.user = user
+    await aretry_on_lock(lambda: _arecord_side_effects(record, user, True, counted=created))
+    return record
+
+
+async def acheck_out(user, comments='', when=None):
+    """Async check_out()"""
+    when = when or timezone.now()
+    today = timezone.localdate(when)
+    closed = await aretry_on_lock(lambda: AttendanceRecord.objects.filter(
+        user=user, date=today, check_in_time__isnull=False, check_out_time__isnull=True
+    ).aupdate(check_out_time=when, comments=Concat('comments', Value(check_out_comment(comments)))))
+    record = await _aexisting(user, today)
+    if not closed:
+        if record is None or record.check_in_time is None:
+            raise NotCheckedIn('No check-in record found for today', record)
+        raise AlreadyCheckedOut('Already checked out', record)
+    await aretry_on_lock(lambda: _arecord_side_effects(record, user, False))
+    return record
@@ -0,0 +1,81 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from users.models import User
+from . import events, occupancy
+from .archive import user_records
+from .caching import bump_data_version
+from .models import ArchivedAttendanceRecord, AttendanceRecord
+from .rollups import RollupBatch
+
+
+def _changed(dates):
+    bump_data_version(dates)
+    occupancy.invalidate_on_commit(dates)
+    events.counters_changed(dates)
+
+
+@receiver(pre_save, sender=AttendanceRecord)
+def remember_saved_record(sender, instance, raw=False, **kwargs):
+    """Keep the stored version of a record about to be saved, for update_rollups()"""
+    instance._saved_record = None
+    if instance.pk and not raw:
+        instance._saved_record = AttendanceRecord.objects.select_related('user').filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=AttendanceRecord)
+def update_rollups(sender, instance, raw=False, **kwargs):
+    """
+    Move a record saved outside the check-in/check-out services (the admin,
+    the shell) from its previous rollup and heatmap buckets to its new ones
+    """
+    previous = getattr(instance, '_saved_record', None)
+    batch = RollupBatch()
+    if previous is not None:
+        batch.remove(previous)
+    if not raw:
+        batch.add(instance)
+    with transaction.atomic():
+        batch.apply()
+    _changed({instance.date} | ({previous.date} if previous else set()))
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+@receiver(post_delete, sender=ArchivedAttendanceRecord)
+def remove_from_rollups(sender, instance, **kwargs):
+    batch = RollupBatch()
+    batch.remove(instance)
+    with transaction.atomic():
+        batch.apply()
+    _changed([instance.date])
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_user_type(sender, instance, **kwargs):
+    """Keep the user type as loaded so a changed type can be moved after saving"""
+    instance._loaded_user_type = instance.__dict__.get('user_type')
+
+
+@receiver(post_save, sender=User)
+def move_user_type(sender, instance, raw=False, **kwargs):
+    """
+    Move the visits of a user whose type changed, live and archived, from
+    the rollup buckets of the old type to those of the new one
+    """
+    previous = getattr(instance, '_loaded_user_type', None)
+    instance._loaded_user_type = instance.__dict__.get('user_type')
+    if raw or previous is None or previous == instance._loaded_user_type:
+        return
+    batch = RollupBatch()
+    dates = set()
+    for record in user_records(instance).filter(check_in_time__isnull=False).only(
+        'date', 'check_in_time', 'check_out_time',
+    ).iterator():
+        batch.remove(record, previous)
+        batch.add(record, instance.user_type)
+        dates.add(record.date)
+    if dates:
+        with transaction.atomic():
+            batch.apply()
+        _changed(dates)
@@ -0,0 +1,17 @@
+from copy import copy
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+
+register = template.Library()
+
+
+@register.inclusion_tag('admin/date_hierarchy.html')
+def hierarchy_from_dates(cl):
+    """
+    Django's date_hierarchy, listing the years, months and days of the model
+    admin's get_hierarchy_dates() instead of distinct dates of the records
+    """
+    dated = copy(cl)
+    dated.queryset = cl.model_admin.get_hierarchy_dates(cl.params)
+    return date_hierarchy(dated)
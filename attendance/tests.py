@@ -1,11 +1,38 @@
-from django.test import TestCase, Client
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.template.loader import get_template
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient
+from users.cache import user_lookup_cache
 from users.models import User
-from .models import AttendanceRecord
+from .models import (
+    ArchivedAttendanceRecord, AttendanceHistory, AttendanceRecord, DailyAttendanceRollup, HeatmapCell, IdempotencyKey,
+    Purpose,
+)
+from config import metrics
+from . import (
+    analytics, archive, batch, caching, events, idempotency, importing, occupancy, pagination, purposes, representation,
+    rollups, services,
+)
 import datetime
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 import json
+import math
+import random
 
 class AttendanceTests(TestCase):
     def setUp(self):
@@ -58,8 +85,7 @@ class AttendanceTests(TestCase):
             user=self.user,
             date=timezone.now().date(),
             check_in_time=timezone.now(),
-            temperature=36.5,
-            purpose_of_visit='Testing'
+            purpose=purposes.intern('Testing')
         )
         
         # Test check-out
@@ -95,7 +121,7 @@ class AttendanceTests(TestCase):
         # Verify record created
         self.assertTrue(AttendanceRecord.objects.filter(
             user=self.user, 
-            purpose_of_visit='API Testing'
+            purpose__name='API Testing'
         ).exists())
     
     def test_api_check_out(self):
@@ -104,8 +130,7 @@ class AttendanceTests(TestCase):
             user=self.user,
             date=timezone.now().date(),
             check_in_time=timezone.now(),
-            temperature=36.5,
-            purpose_of_visit='API Testing'
+            purpose=purposes.intern('API Testing')
         )
         
         # Test API check-out
@@ -167,8 +192,7 @@ class AnalyticsDashboardTests(TestCase):
             user=self.user,
             date=today,
             check_in_time=timezone.now(),
-            temperature=36.5,
-            purpose_of_visit="Meeting"
+            purpose=purposes.intern("Meeting")
         )
         
         # Create a record for staff user
@@ -176,8 +200,7 @@ class AnalyticsDashboardTests(TestCase):
             user=self.staff_user,
             date=today,
             check_in_time=timezone.now() - timezone.timedelta(hours=3),
-            temperature=36.2,
-            purpose_of_visit="Work"
+            purpose=purposes.intern("Work")
         )
         # Add checkout time
         record.check_out_time = timezone.now()
@@ -189,8 +212,7 @@ class AnalyticsDashboardTests(TestCase):
             date=yesterday,
             check_in_time=timezone.now() - timezone.timedelta(days=1),
             check_out_time=timezone.now() - timezone.timedelta(days=1, hours=-2),
-            temperature=36.8,
-            purpose_of_visit="Training"
+            purpose=purposes.intern("Training")
         )
         
         self.client = Client()
@@ -245,3 +267,1707 @@ class AnalyticsDashboardTests(TestCase):
         
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context['total_records'], 1)  # Only yesterday's record
+
+    def test_analytics_dashboard_charts_read_rollup(self):
+        """Test that chart series are served from the rollup table"""
+        self.client.login(email='staff@example.com', password='staffpassword')
+        rollups.rebuild_rollups()
+        
+        response = self.client.get(reverse('analytics_dashboard'))
+        chart_data = response.context['chart_data']
+        self.assertEqual(sum(chart_data['daily_counts']), 3)
+        self.assertEqual(sorted(chart_data['user_type_labels']), ['member', 'staff'])
+
+
+class AttendanceRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="test@example.com",
+            user_type="member",
+            first_name="Test",
+            last_name="User",
+            phone_number="1234567890"
+        )
+        self.api_client = APIClient()
+
+    def test_check_in_and_out_update_rollup(self):
+        """Test that the API keeps the rollup in step with check-in/check-out"""
+        self.api_client.post(
+            reverse('api_check_in'),
+            data=json.dumps({'user_id': self.user.id, 'purpose_of_visit': 'Meeting'}),
+            content_type='application/json'
+        )
+        rollup = DailyAttendanceRollup.objects.get()
+        self.assertEqual(rollup.user_type, 'member')
+        self.assertEqual(rollup.visit_count, 1)
+        self.assertEqual(rollup.completed_count, 0)
+
+        # Push the check-in back an hour so the visit has a measurable duration
+        record = AttendanceRecord.objects.get(user=self.user)
+        AttendanceRecord.objects.filter(pk=record.pk).update(
+            check_in_time=record.check_in_time - timezone.timedelta(hours=1)
+        )
+        rollups.rebuild_rollups()
+        self.api_client.post(
+            reverse('api_check_out'),
+            data=json.dumps({'user_id': self.user.id}),
+            content_type='application/json'
+        )
+        rollup = DailyAttendanceRollup.objects.get()
+        self.assertEqual(rollup.completed_count, 1)
+        self.assertGreaterEqual(rollup.duration_seconds, 3600)
+
+    def test_saves_and_deletes_outside_services_update_rollup(self):
+        """Test that admin-style edits and deletes keep the rollup and heatmap equal to a rebuild"""
+        def counted():
+            return (
+                sorted(row for row in DailyAttendanceRollup.objects.values_list(
+                    'date', 'user_type', 'hour', 'visit_count', 'completed_count', 'duration_seconds'
+                ) if any(row[3:])),
+                sorted(cell for cell in HeatmapCell.objects.values_list('date', 'hour', 'arrivals', 'on_site')
+                       if any(cell[2:])),
+            )
+
+        def assert_matches_rebuild():
+            before = counted()
+            rollups.rebuild_rollups()
+            self.assertEqual(before, counted())
+
+        day = timezone.localdate() - datetime.timedelta(days=1)
+        at = lambda hour, minute=0: timezone.make_aware(datetime.datetime.combine(day, datetime.time(hour, minute)))
+        other = User.objects.create(email='other@example.com', user_type='student')
+        record = AttendanceRecord.objects.create(user=self.user, date=day, check_in_time=at(9))
+        AttendanceRecord.objects.create(user=other, date=day, check_in_time=at(10), check_out_time=at(12))
+        assert_matches_rebuild()
+
+        record.check_out_time = at(11, 30)
+        record.save()
+        assert_matches_rebuild()
+        record.check_in_time, record.user = at(8), other
+        record.date = day - datetime.timedelta(days=1)
+        record.save()
+        assert_matches_rebuild()
+        other.user_type = 'visitor'
+        other.save()
+        assert_matches_rebuild()
+        record.delete()
+        assert_matches_rebuild()
+        AttendanceRecord.objects.all().delete()
+        self.assertEqual(counted(), ([], []))
+
+    def test_rebuild_command_backfills_rollup(self):
+        """Test that the backfill command aggregates existing records"""
+        now = timezone.now()
+        AttendanceRecord.objects.create(
+            user=self.user,
+            date=now.date(),
+            check_in_time=now - timezone.timedelta(hours=2),
+            check_out_time=now,
+        )
+        call_command('rebuild_attendance_rollups', stdout=io.StringIO())
+
+        rollup = DailyAttendanceRollup.objects.get()
+        self.assertEqual(rollup.visit_count, 1)
+        self.assertEqual(rollup.completed_count, 1)
+        self.assertEqual(rollup.duration_seconds, 7200)
+
+
+class HeatmapTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(email="member@example.com", user_type="member")
+        self.visitor = User.objects.create(email="visitor@example.com", user_type="visitor")
+        today = timezone.localdate()
+        self.monday = today - datetime.timedelta(days=today.weekday() + 7)
+
+    def at(self, hour, minute=0, days=0):
+        return timezone.make_aware(datetime.datetime.combine(
+            self.monday + datetime.timedelta(days=days), datetime.time(hour, minute)
+        ))
+
+    def cells(self):
+        return {
+            hour: (arrivals, on_site)
+            for hour, arrivals, on_site in HeatmapCell.objects.filter(date=self.monday).values_list(
+                'hour', 'arrivals', 'on_site'
+            )
+            if arrivals or on_site
+        }
+
+    def test_check_in_and_out_fill_heatmap(self):
+        """Test that check-ins count arrivals and check-outs fill the hours on site"""
+        services.check_in(self.member, when=self.at(9, 30))
+        services.check_out(self.member, when=self.at(12, 15))
+        batch.apply_batch([
+            {'action': 'check_in', 'user_id': self.visitor.id, 'timestamp': self.at(11).isoformat()},
+        ])
+
+        self.assertEqual(HeatmapCell.objects.count(), 24)
+        expected = {9: (1, 1), 10: (0, 1), 11: (1, 2), 12: (0, 1)}
+        self.assertEqual(self.cells(), expected)
+
+        # The backfill computes the same cells from the records
+        self.assertEqual(rollups.rebuild_heatmap(), 24)
+        self.assertEqual(self.cells(), expected)
+
+    def test_rebuild_command_backfills_heatmap(self):
+        """Test that the backfill command spreads visits over their hours"""
+        AttendanceRecord.objects.create(
+            user=self.member, date=self.monday, check_in_time=self.at(22), check_out_time=self.at(1, days=1),
+        )
+        # Check-out before check-in (bad data) counts only the check-in hour
+        AttendanceRecord.objects.create(
+            user=self.visitor, date=self.monday, check_in_time=self.at(8), check_out_time=self.at(7),
+        )
+        call_command('rebuild_attendance_heatmap', stdout=io.StringIO())
+
+        self.assertEqual(self.cells(), {8: (1, 1), 22: (1, 1), 23: (0, 1)})
+
+    def test_heatmap_endpoint(self):
+        """Test that staff get the weekday by hour matrices of the range"""
+        services.check_in(self.member, when=self.at(9, 30))
+        services.check_out(self.member, when=self.at(10, 15))
+        staff = User.objects.create_user(email="staff@example.com", password="staffpassword", is_staff=True)
+        params = {'date_from': self.monday.isoformat(),
+                  'date_to': (self.monday + datetime.timedelta(days=13)).isoformat()}
+
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(reverse('attendance_heatmap'), params).status_code, 302)
+
+        self.client.force_login(staff)
+        with self.assertNumQueries(1):
+            heatmap = analytics.heatmap(self.monday, self.monday + datetime.timedelta(days=13))
+        response = self.client.get(reverse('attendance_heatmap'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), heatmap)
+        self.assertEqual(heatmap['days'], [2] * 7)
+        self.assertEqual(heatmap['on_site'][0][9:11], [1, 1])
+        self.assertEqual(heatmap['avg_on_site'][0][9:12], [0.5, 0.5, 0])
+        self.assertEqual(heatmap['avg_arrivals'][0][9], 0.5)
+        self.assertEqual(sum(map(sum, heatmap['arrivals'][1:])), 0)
+
+        response = self.client.get(reverse('attendance_heatmap'), {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PurposeCatalogTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(email=f"visitor{i}@example.com", user_type="visitor") for i in range(4)]
+        self.api_client = APIClient()
+
+    def test_spellings_share_one_purpose(self):
+        """Test that case and whitespace variants are interned as the first spelling seen"""
+        self.api_client.post(reverse('api_check_in'), data=json.dumps({
+            'user_id': self.users[0].id, 'purpose_of_visit': ' Team   Meeting ',
+        }), content_type='application/json')
+        self.client.post(reverse('check_in', args=[self.users[1].id]), {'purpose_of_visit': 'team meeting'})
+        services.check_in(self.users[2], purpose_of_visit='')
+
+        purpose = Purpose.objects.get()
+        self.assertEqual((purpose.key, purpose.name), ('team meeting', 'Team Meeting'))
+        self.assertEqual(AttendanceRecord.objects.filter(purpose=purpose).count(), 2)
+        self.assertEqual(AttendanceRecord.objects.get(user=self.users[2]).purpose_of_visit, '')
+
+        response = self.api_client.get(reverse('api_attendance_records'))
+        self.assertEqual(
+            sorted(row['purpose_of_visit'] for row in response.json()['results']), ['', 'Team Meeting', 'Team Meeting']
+        )
+
+    def test_intern_many(self):
+        """Test that a batch of texts is interned with one insert and one read"""
+        purposes.intern('Work')
+        texts = ['work', 'Training', ' training', '', 'Work']
+        with self.assertNumQueries(2):
+            catalog = purposes.intern_many(texts)
+        self.assertEqual({text: purpose and purpose.name for text, purpose in catalog.items()},
+                         {'work': 'Work', 'Training': 'Training', ' training': 'Training', '': None, 'Work': 'Work'})
+        self.assertEqual(Purpose.objects.count(), 2)
+
+    def test_top_purposes_merge_variants(self):
+        """Test that the purpose breakdown counts variants together"""
+        today = timezone.localdate()
+        batch.apply_batch([
+            {'action': 'check_in', 'user_id': user.id, 'purpose_of_visit': text}
+            for user, text in zip(self.users, ['Work', 'WORK', 'work ', 'Training'])
+        ])
+        summary = analytics.range_summary(today, today)
+        self.assertEqual(summary['purpose_counts'], [
+            {'purpose_of_visit': 'Work', 'count': 3},
+            {'purpose_of_visit': 'Training', 'count': 1},
+        ])
+
+
+class DurationStatsTests(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(email="member@example.com", user_type="member")
+        self.visitor = User.objects.create(email="visitor@example.com", user_type="visitor")
+        start = timezone.now() - timezone.timedelta(days=20)
+        # Member visits last 10..100 minutes, the visitor one visit of 30 minutes
+        for day in range(10):
+            check_in = start + timezone.timedelta(days=day)
+            AttendanceRecord.objects.create(
+                user=self.member,
+                date=check_in.date(),
+                check_in_time=check_in,
+                check_out_time=check_in + timezone.timedelta(minutes=10 * (day + 1)),
+            )
+        AttendanceRecord.objects.create(
+            user=self.visitor,
+            date=start.date(),
+            check_in_time=start,
+            check_out_time=start + timezone.timedelta(minutes=30),
+        )
+        # Negative duration (bad data) and an open visit are both ignored
+        AttendanceRecord.objects.create(
+            user=self.visitor,
+            date=(start + timezone.timedelta(days=1)).date(),
+            check_in_time=start,
+            check_out_time=start - timezone.timedelta(minutes=5),
+        )
+        AttendanceRecord.objects.create(
+            user=self.visitor,
+            date=(start + timezone.timedelta(days=2)).date(),
+            check_in_time=start,
+        )
+
+    def test_duration_stats_single_query(self):
+        """Test that duration statistics come from a single aggregate query"""
+        with self.assertNumQueries(1):
+            stats = analytics.duration_stats(AttendanceRecord.objects.all())
+
+        self.assertEqual(stats['overall'], {'count': 11, 'avg': 53, 'median': 50, 'p90': 90, 'max': 100})
+        self.assertEqual(stats['by_user_type']['member'], {'count': 10, 'avg': 55, 'median': 50, 'p90': 90, 'max': 100})
+        self.assertEqual(stats['by_user_type']['visitor'], {'count': 1, 'avg': 30, 'median': 30, 'p90': 30, 'max': 30})
+
+    def test_duration_stats_empty(self):
+        """Test that an empty range reports zeros"""
+        stats = analytics.duration_stats(AttendanceRecord.objects.none())
+        self.assertEqual(stats['overall']['count'], 0)
+        self.assertEqual(stats['by_user_type'], {})
+
+    def test_histogram_matches_sorted_durations(self):
+        """Test that statistics read off the minute histogram equal those of the sorted durations"""
+        rng = random.Random(7)
+        seconds = [rng.uniform(1, 12 * 3600) for _ in range(1001)]
+        histogram = analytics.DurationHistogram()
+        for value in seconds:
+            histogram.add(value)
+
+        ordered = sorted(seconds)
+        expected = {
+            'count': len(ordered),
+            'avg': round(sum(ordered) / len(ordered) / 60),
+            'median': round(ordered[math.ceil(len(ordered) * 0.5) - 1] / 60),
+            'p90': round(ordered[math.ceil(len(ordered) * 0.9) - 1] / 60),
+            'max': round(ordered[-1] / 60),
+        }
+        self.assertEqual(histogram.stats(), expected)
+        self.assertLessEqual(len(histogram.minutes), 12 * 60 + 1)
+
+    def test_summaries_query_budget(self):
+        """Test that today's counters take one query and a range summary four"""
+        rollups.rebuild_rollups()
+        today = timezone.localdate()
+        with self.assertNumQueries(1):
+            analytics.today_summary(today)
+        # Archive tier probe, purpose counts, duration histograms and rollup read
+        with self.assertNumQueries(4):
+            summary = analytics.range_summary(today - timezone.timedelta(days=30), today)
+
+        self.assertEqual(summary['total_records'], 13)
+        self.assertEqual(summary['duration_stats']['count'], 11)
+        self.assertEqual(sum(summary['chart_data']['daily_counts']), 13)
+        self.assertEqual(dict(zip(summary['chart_data']['user_type_labels'],
+                                  summary['chart_data']['user_type_counts'])), {'member': 10, 'visitor': 3})
+
+
+class AttendancePaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="test@example.com", user_type="member")
+        today = timezone.now().date()
+        for day in range(7):
+            AttendanceRecord.objects.create(
+                user=self.user,
+                date=today - timezone.timedelta(days=day),
+                check_in_time=timezone.now() - timezone.timedelta(days=day),
+            )
+        self.api_client = APIClient()
+
+    def test_user_attendance_pages_with_cursor(self):
+        """Test that following `next` walks the whole history exactly once"""
+        url = reverse('api_user_attendance', args=[self.user.id])
+        seen = []
+        params = {'limit': 3}
+        while True:
+            response = self.api_client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(row['date'] for row in response.data['results'])
+            if not response.data['next']:
+                break
+            params['cursor'] = response.data['next']
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_invalid_cursor_and_limit(self):
+        """Test that malformed paging parameters are rejected"""
+        url = reverse('api_user_attendance', args=[self.user.id])
+        self.assertEqual(self.api_client.get(url, {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.api_client.get(url, {'limit': 'ten'}).status_code, 400)
+        self.assertEqual(self.api_client.get(reverse('api_attendance_records'), {'limit': 0}).status_code, 400)
+
+    def test_records_endpoint_is_bounded(self):
+        """Test that the records endpoint returns a page, not the whole day"""
+        other = User.objects.create(email="other@example.com", user_type="visitor")
+        AttendanceRecord.objects.create(user=other, date=timezone.now().date(), check_in_time=timezone.now())
+
+        response = self.api_client.get(reverse('api_attendance_records'), {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.api_client.get(
+            reverse('api_attendance_records'), {'limit': 1, 'cursor': response.data['next']}
+        )
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+
+class RecordRepresentationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            email="test@example.com", first_name="Test", last_name="User", user_type="member",
+        )
+        now = timezone.now().replace(microsecond=123456)
+        AttendanceRecord.objects.create(
+            user=self.user, date=timezone.now().date(), check_in_time=now,
+            check_out_time=now + timezone.timedelta(hours=2), purpose=purposes.intern("Meeting"), comments="Hi",
+        )
+        AttendanceRecord.objects.create(
+            user=self.user, date=timezone.now().date() - timezone.timedelta(days=1), check_in_time=now,
+        )
+        self.api_client = APIClient()
+
+    def test_same_json_as_serializer(self):
+        """Test that values() rows match AttendanceRecordSerializer exactly"""
+        from .serializers import AttendanceRecordSerializer
+
+        records = AttendanceRecord.objects.order_by('-date', '-id')
+        expected = AttendanceRecordSerializer(records, many=True).data
+        response = self.api_client.get(reverse('api_user_attendance', args=[self.user.id]))
+        self.assertEqual(response.json()['results'], json.loads(json.dumps(expected)))
+        self.assertIsNone(response.json()['results'][1]['check_out_time'])
+
+        with timezone.override('America/New_York'):
+            expected = AttendanceRecordSerializer(records, many=True).data
+            rows = representation.record_rows(representation.record_values(records))
+        self.assertEqual(rows, json.loads(json.dumps(expected)))
+
+    def test_fields_follow_the_model(self):
+        """Test that rows and the serializer list the same fields, in order, and only current model fields"""
+        from .serializers import AttendanceRecordSerializer
+
+        fields = AttendanceRecordSerializer.Meta.fields
+        row = representation.record_rows(representation.record_values(AttendanceRecord.objects.all()))[0]
+        self.assertEqual(list(row), fields)
+        self.assertEqual(list(AttendanceRecordSerializer(AttendanceRecord.objects.first()).data), fields)
+        model_fields = {field.name for field in AttendanceRecord._meta.get_fields()}
+        self.assertLessEqual(set(fields) - {'user_details', 'purpose_of_visit'}, model_fields)
+        self.assertNotIn('temperature', model_fields)
+
+    def test_works_without_rest_framework(self):
+        """Test that the list endpoints do not depend on REST framework"""
+        with mock.patch('attendance.views.REST_FRAMEWORK_AVAILABLE', False):
+            response = self.client.get(reverse('api_attendance_records'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['results'][0]['user_details']['email'], 'test@example.com')
+            response = self.client.get(reverse('api_user_attendance', args=[self.user.id]), {'limit': 1})
+            self.assertEqual(len(response.json()['results']), 1)
+            self.assertIsNotNone(response.json()['next'])
+
+
+class BatchAttendanceTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(email=f"kiosk{i}@example.com", user_type="member")
+            for i in range(20)
+        ]
+        self.api_client = APIClient()
+
+    def post_batch(self, events):
+        return self.api_client.post(
+            reverse('api_batch_attendance'),
+            data=json.dumps({'events': events}),
+            content_type='application/json'
+        )
+
+    def test_batch_check_in_and_out(self):
+        """Test replaying a queue of check-ins and check-outs"""
+        now = timezone.now().replace(microsecond=0)
+        events = [
+            {'action': 'check_in', 'user_id': user.id, 'timestamp': (now - timezone.timedelta(hours=2)).isoformat(),
+             'purpose_of_visit': 'Work'}
+            for user in self.users
+        ]
+        events.append({'action': 'check_out', 'email': self.users[0].email, 'timestamp': now.isoformat(),
+                       'comments': 'Done'})
+        response = self.post_batch(events)
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [201] * 20 + [200])
+        self.assertEqual(AttendanceRecord.objects.filter(check_in_time__isnull=False).count(), 20)
+        record = AttendanceRecord.objects.get(user=self.users[0])
+        self.assertEqual(record.check_out_time, now)
+        self.assertIn('Done', record.comments)
+        self.assertEqual(sum(DailyAttendanceRollup.objects.values_list('visit_count', flat=True)), 20)
+
+    def test_batch_keeps_per_item_semantics(self):
+        """Test that each item reports the same errors as the single-item APIs"""
+        AttendanceRecord.objects.create(user=self.users[0], date=timezone.now().date(), check_in_time=timezone.now())
+        response = self.post_batch([
+            {'action': 'check_in', 'user_id': self.users[0].id},
+            {'action': 'check_out', 'user_id': self.users[1].id},
+            {'action': 'check_in', 'email': 'nobody@example.com'},
+            {'action': 'dance', 'user_id': self.users[2].id},
+            {'action': 'check_in', 'user_id': self.users[3].id},
+            {'action': 'check_in', 'user_id': self.users[3].id},
+        ])
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [400, 400, 404, 400, 201, 400])
+        self.assertEqual(results[0]['error'], 'Already checked in')
+        self.assertEqual(results[1]['error'], 'No check-in record found for today')
+        self.assertEqual(results[5]['error'], 'Already checked in')
+
+    def test_batch_query_count_is_constant(self):
+        """Test that users and records are resolved with bulk queries"""
+        timestamp = timezone.now().isoformat()
+        events = [{'action': 'check_in', 'user_id': user.id, 'timestamp': timestamp} for user in self.users]
+        # users, records, bulk insert, rollup update + insert inside a savepoint,
+        # heatmap update + the day's cells + update again, data version update
+        # + insert inside a savepoint (the first write), and the surrounding
+        # savepoint statements
+        with self.assertNumQueries(16):
+            self.post_batch(events)
+
+    def test_batch_sees_concurrent_check_out(self):
+        """Test that a check-out landing while a batch runs is neither overwritten nor counted twice"""
+        user = self.users[0]
+        services.check_in(user, when=timezone.now() - timezone.timedelta(hours=2))
+        intern_many = purposes.intern_many
+
+        def single_tap_meanwhile(texts):
+            services.check_out(user, comments='single tap')
+            return intern_many(texts)
+
+        with mock.patch.object(purposes, 'intern_many', side_effect=single_tap_meanwhile):
+            response = self.post_batch([
+                {'action': 'check_out', 'user_id': user.id, 'comments': 'batch'},
+                {'action': 'check_in', 'user_id': self.users[1].id},
+            ])
+
+        results = response.data['results']
+        self.assertEqual([result['status'] for result in results], [400, 201])
+        self.assertEqual(results[0]['error'], 'Already checked out')
+        record = AttendanceRecord.objects.get(user=user)
+        self.assertIn('Check-out comments: single tap', record.comments)
+        self.assertNotIn('batch', record.comments)
+        self.assertEqual(
+            DailyAttendanceRollup.objects.filter(user_type=user.user_type).aggregate(
+                completed=Sum('completed_count'))['completed'],
+            1,
+        )
+
+    def test_batch_rejects_oversized_payload(self):
+        """Test that batches are bounded"""
+        response = self.post_batch([{'action': 'check_in', 'user_id': 1}] * 501)
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Each listing view has a fixed query budget: rendering 1 or 30 rows must
+    issue exactly the same number of queries.
+    """
+    ROW_COUNTS = (1, 30)
+
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            email="admin@example.com", password="adminpassword", is_staff=True
+        )
+        self.api_client = APIClient()
+
+    def add_visitors(self, total):
+        now = timezone.now()
+        for i in range(AttendanceRecord.objects.count(), total):
+            user = User.objects.create(email=f"visitor{i}@example.com", user_type="visitor",
+                                       first_name="Visitor", last_name=str(i))
+            AttendanceRecord.objects.create(
+                user=user,
+                date=now.date(),
+                check_in_time=now,
+                check_out_time=now if i % 2 else None,
+                purpose=purposes.intern("Meeting"),
+            )
+
+    def assertQueryBudget(self, get, budget):
+        for rows in self.ROW_COUNTS:
+            self.add_visitors(rows)
+            with self.assertNumQueries(budget, msg=f"with {rows} rows"):
+                response = get()
+            self.assertEqual(response.status_code, 200)
+
+    def test_attendance_list_budget(self):
+        self.assertQueryBudget(lambda: self.client.get(reverse('attendance_list')), 1)
+
+    def test_attendance_dashboard_budget(self):
+        self.assertQueryBudget(lambda: self.client.get(reverse('attendance_dashboard')), 1)
+
+    def test_api_attendance_records_budget(self):
+        self.assertQueryBudget(
+            lambda: self.api_client.get(reverse('api_attendance_records'), {'limit': 100}), 1
+        )
+
+    def test_admin_changelist_budget(self):
+        # Session, user, the two ends of the id range and the archived ids
+        # within it, the page, and the archive bound and two heatmap reads of
+        # the date hierarchy
+        self.client.force_login(self.admin_user)
+        self.assertQueryBudget(
+            lambda: self.client.get(reverse('admin:attendance_attendancerecord_changelist')), 9
+        )
+
+    def test_admin_search_uses_index(self):
+        """Test that record search goes through the users index and the purpose catalog"""
+        self.add_visitors(3)
+        User.objects.filter(email="visitor1@example.com").update(first_name="Zelda")
+        AttendanceRecord.objects.filter(user__email="visitor2@example.com").update(purpose=purposes.intern("Workshop"))
+        self.client.force_login(self.admin_user)
+        url = reverse('admin:attendance_attendancerecord_changelist')
+
+        for term, expected in (('zel', ['visitor1@example.com']), ('workshop', ['visitor2@example.com']),
+                               ('visitor', ['visitor0@example.com', 'visitor1@example.com', 'visitor2@example.com'])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'q': term})
+            self.assertEqual(sorted(record.user.email for record in response.context['cl'].result_list), expected)
+            self.assertNotIn('"users_user"."email" LIKE', ' '.join(query['sql'] for query in queries))
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            email="admin@example.com", password="adminpassword", is_staff=True
+        )
+        self.client.force_login(self.admin_user)
+        self.url = reverse('admin:attendance_attendancerecord_changelist')
+        self.today = timezone.localdate()
+        for i in range(5):
+            user = User.objects.create(email=f"visitor{i}@example.com", user_type="visitor")
+            day = self.today - datetime.timedelta(days=40 * i)
+            services.check_in(user, when=timezone.make_aware(datetime.datetime.combine(day, datetime.time(9))))
+
+    def changelist(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl'], [query['sql'] for query in queries]
+
+    def test_changelist_is_not_counted(self):
+        """Test that the unfiltered changelist estimates its size instead of counting the table"""
+        cl, queries = self.changelist()
+        self.assertEqual(cl.result_count, 5)
+        self.assertIsNone(cl.full_result_count)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql and '"attendance_attendancerecord"' in sql])
+
+    def test_filtered_count_is_bounded(self):
+        """Test that filtered changelists count at most COUNT_LIMIT matches"""
+        with mock.patch.object(pagination.EstimatedCountPaginator, 'count_limit', 2):
+            cl, queries = self.changelist({'user__user_type__exact': 'visitor'})
+        self.assertEqual(cl.result_count, 2)
+        self.assertIn('LIMIT 2', ' '.join(sql for sql in queries if 'COUNT(' in sql))
+
+    def test_estimated_count(self):
+        """Test that the estimate follows the id range of the table"""
+        records = AttendanceRecord.objects.all()
+        self.assertEqual(pagination.estimated_count(records), 5)
+        records.order_by('id').last().delete()
+        records.order_by('id').first().delete()
+        self.assertEqual(pagination.estimated_count(records), 3)
+        records.delete()
+        self.assertEqual(pagination.estimated_count(records), 0)
+
+    def test_estimated_count_skips_archived_imports(self):
+        """Test that old records imported after newer ones and then archived are not counted"""
+        at = lambda day: timezone.make_aware(datetime.datetime.combine(day, datetime.time(9)))
+        old, new = (User.objects.create(email=f"{name}@example.com") for name in ('old', 'new'))
+        AttendanceRecord.objects.create(user=old, date=self.today - datetime.timedelta(days=400),
+                                        check_in_time=at(self.today - datetime.timedelta(days=400)))
+        services.check_in(new, when=at(self.today))
+        archive.archive_records(self.today - datetime.timedelta(days=300))
+        records = AttendanceRecord.objects.all()
+        self.assertEqual(pagination.estimated_count(records), records.count())
+
+    def test_date_hierarchy_reads_heatmap(self):
+        """Test that the date hierarchy drills down through the heatmap's dates, not the records"""
+        params = {'date__year': str(self.today.year)}
+        days = list(AttendanceRecord.objects.filter(date__year=self.today.year).dates('date', 'day'))
+        cl, queries = self.changelist(params)
+        self.assertFalse([sql for sql in queries if 'DISTINCT' in sql and 'attendance_attendancerecord' in sql])
+        self.assertEqual(list(cl.model_admin.get_hierarchy_dates(params).dates('date', 'day')), days)
+        self.assertContains(self.client.get(self.url, params), f'date__month={days[0].month}')
+
+    def test_date_hierarchy_skips_archived_dates(self):
+        """Test that dates moved to the archive are not offered by the date hierarchy"""
+        archive.archive_records(self.today - datetime.timedelta(days=100))
+        cl, _ = self.changelist()
+        dates = list(cl.model_admin.get_hierarchy_dates({}).dates('date', 'day'))
+        self.assertEqual(dates, list(AttendanceRecord.objects.dates('date', 'day')))
+        self.assertEqual(len(dates), 3)
+
+
+class ConcurrentCheckInTests(TransactionTestCase):
+    """Double taps racing each other must produce exactly one check-in/check-out"""
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create(email="racer@example.com", user_type="member")
+
+    def race(self, operation):
+        barrier = threading.Barrier(self.THREADS)
+        outcomes = []
+
+        def tap():
+            barrier.wait()
+            try:
+                # The shared-cache in-memory test database reports contention
+                # as "table is locked"; retry like a kiosk would
+                for _ in range(100):
+                    try:
+                        operation(self.user)
+                        outcomes.append('ok')
+                        break
+                    except OperationalError:
+                        time.sleep(0.01)
+                else:
+                    outcomes.append('gave up')
+            except services.CheckInError as e:
+                outcomes.append(type(e).__name__)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=tap) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_check_in_and_out_happen_once(self):
+        outcomes = self.race(lambda user: services.check_in(user, purpose_of_visit='Race'))
+        self.assertEqual(sorted(outcomes), ['AlreadyCheckedIn'] * (self.THREADS - 1) + ['ok'])
+
+        outcomes = self.race(lambda user: services.check_out(user, comments='bye'))
+        self.assertEqual(sorted(outcomes), ['AlreadyCheckedOut'] * (self.THREADS - 1) + ['ok'])
+
+        record = AttendanceRecord.objects.get(user=self.user)
+        self.assertIsNotNone(record.check_out_time)
+        self.assertEqual(record.comments.count('bye'), 1)
+        self.assertEqual(DailyAttendanceRollup.objects.get().visit_count, 1)
+
+
+class CheckInBurstTests(SimpleTestCase):
+    def test_retries_locked_writes(self):
+        """Test that a locked database is retried a bounded number of times"""
+        operation = mock.Mock(side_effect=[OperationalError('database is locked')] * 2 + ['ok'])
+        with override_settings(CHECK_IN_RETRY_ATTEMPTS=3, CHECK_IN_RETRY_BACKOFF=0):
+            self.assertEqual(services.retry_on_lock(operation), 'ok')
+
+            operation = mock.Mock(side_effect=OperationalError('database is locked'))
+            with self.assertRaises(OperationalError):
+                services.retry_on_lock(operation)
+            self.assertEqual(operation.call_count, 3)
+
+            operation = mock.Mock(side_effect=OperationalError('no such table'))
+            with self.assertRaises(OperationalError):
+                services.retry_on_lock(operation)
+            self.assertEqual(operation.call_count, 1)
+
+    def test_multi_process_burst_loses_no_check_ins(self):
+        """Test that check-ins from several worker processes at once all land"""
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'burst_check_in', '--json',
+             '--processes', '4', '--requests', '120', '--rate', '200'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = json.loads(result.stdout)
+        self.assertEqual(report['journal_mode'], 'wal')
+        for phase in ('check_in', 'check_out'):
+            self.assertEqual(report[phase]['errors'], 0)
+            self.assertEqual(report[phase]['lost'], 0)
+
+
+class CheckInServiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="member@example.com", user_type="member")
+
+    def test_check_in_is_one_write(self):
+        """Test that a first check-in touches the attendance table once"""
+        with CaptureQueriesContext(connection) as queries:
+            record = services.check_in(self.user, purpose_of_visit='Work')
+        attendance_writes = [q for q in queries if 'attendance_attendancerecord' in q['sql']]
+        self.assertEqual(len(attendance_writes), 1)
+        self.assertEqual(AttendanceRecord.objects.get().id, record.id)
+
+        with self.assertRaises(services.AlreadyCheckedIn) as raised:
+            services.check_in(self.user)
+        self.assertEqual(raised.exception.record.purpose_of_visit, 'Work')
+
+    def test_check_in_completes_pending_record(self):
+        """Test that a row created without a check-in time is checked in in place"""
+        pending = AttendanceRecord.objects.create(user=self.user, date=timezone.now().date())
+        record = services.check_in(self.user, purpose_of_visit='Work')
+        self.assertEqual(record.id, pending.id)
+        pending.refresh_from_db()
+        self.assertIsNotNone(pending.check_in_time)
+
+    def test_check_out_requires_check_in(self):
+        with self.assertRaises(services.NotCheckedIn):
+            services.check_out(self.user)
+        services.check_in(self.user)
+        record = services.check_out(self.user, comments='Done')
+        self.assertIn('Check-out comments: Done', record.comments)
+        with self.assertRaises(services.AlreadyCheckedOut):
+            services.check_out(self.user)
+
+    def test_fallback_without_returning(self):
+        """Test the guarded-UPDATE path used by backends without RETURNING"""
+        with mock.patch.object(services, '_supports_returning', return_value=False):
+            record = services.check_in(self.user, purpose_of_visit='Work')
+            with self.assertRaises(services.AlreadyCheckedIn):
+                services.check_in(self.user)
+            checked_out = services.check_out(self.user, comments='Done')
+            with self.assertRaises(services.AlreadyCheckedOut):
+                services.check_out(self.user)
+        self.assertEqual(checked_out.id, record.id)
+        self.assertIn('Check-out comments: Done', checked_out.comments)
+        self.assertEqual(DailyAttendanceRollup.objects.get().visit_count, 1)
+
+
+class SignAttendanceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="visitor@example.com", user_type="visitor",
+                                        first_name="Visiting", last_name="User")
+        user_lookup_cache.clear()
+
+    def test_sign_in_flow_uses_lookup_cache(self):
+        """Test that the form post after the email post is served from the cache"""
+        url = reverse('sign_attendance')
+        response = self.client.post(url, {'email': 'visitor@example.com'})
+        self.assertEqual(response.context['action'], 'check_in')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {
+                'email': 'visitor@example.com',
+                'check_in': '1',
+                'purpose_of_visit': 'Tour',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in queries if 'FROM "users_user"' in q['sql']])
+        self.assertEqual(user_lookup_cache.stats()['hits'], 1)
+        self.assertTrue(AttendanceRecord.objects.filter(user=self.user, check_in_time__isnull=False).exists())
+
+
+class StaleUserLookupTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="visitor@example.com", user_type="visitor")
+        user_lookup_cache.clear()
+        self.addCleanup(user_lookup_cache.clear)
+
+    def test_user_deleted_behind_cache(self):
+        """Test that signing in as a user deleted by another process does not fail"""
+        url = reverse('sign_attendance')
+        self.client.post(url, {'email': 'visitor@example.com'})
+        # Deleted by another worker: its signals do not reach this process's cache
+        User.objects.filter(pk=self.user.pk)._raw_delete(connection.alias)
+        self.assertIsNotNone(user_lookup_cache.get('visitor@example.com'))
+
+        response = self.client.post(url, {'email': 'visitor@example.com', 'check_in': '1', 'purpose_of_visit': 'Tour'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'No user found with that email.')
+        self.assertIsNone(user_lookup_cache.get('visitor@example.com'))
+        self.assertFalse(AttendanceRecord.objects.exists())
+
+
+class AnalyticsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(email="member@example.com", user_type="member")
+        self.today = timezone.now().date()
+        self.last_week = self.today - timezone.timedelta(days=7)
+        AttendanceRecord.objects.create(user=self.user, date=self.last_week,
+                                        check_in_time=timezone.now() - timezone.timedelta(days=7))
+
+    def test_summary_is_cached_until_a_write(self):
+        """Test that a cached range is reused and a write invalidates it"""
+        first = caching.range_summary(self.last_week, self.today, self.today)
+        # Only the data versions are read
+        with self.assertNumQueries(1):
+            self.assertEqual(caching.range_summary(self.last_week, self.today, self.today), first)
+
+        services.check_in(self.user)
+        summary = caching.range_summary(self.last_week, self.today, self.today)
+        self.assertEqual(summary['total_records'], first['total_records'] + 1)
+
+    def test_past_range_survives_todays_writes(self):
+        """Test that writes to today leave past-only ranges cached"""
+        caching.range_summary(self.last_week, self.last_week, self.today)
+        services.check_in(self.user)
+        with self.assertNumQueries(1):
+            summary = caching.range_summary(self.last_week, self.last_week, self.today)
+        self.assertEqual(summary['total_records'], 1)
+
+        # Editing a past record does invalidate it
+        AttendanceRecord.objects.filter(date=self.last_week).get().delete()
+        self.assertEqual(caching.range_summary(self.last_week, self.last_week, self.today)['total_records'], 0)
+
+    def test_stale_summary_served_while_refreshing(self):
+        """Test that only one request recomputes a stale live range"""
+        first = caching.range_summary(self.last_week, self.today, self.today)
+        services.check_in(self.user)
+
+        # Another request is already recomputing: serve the stale summary
+        key = f"attendance:analytics:live:{self.last_week}:{self.today}:{self.today}"
+        cache.add(f"{key}:refresh", 1, 30)
+        with self.assertNumQueries(1):
+            self.assertEqual(caching.range_summary(self.last_week, self.today, self.today), first)
+
+        cache.delete(f"{key}:refresh")
+        self.assertNotEqual(caching.range_summary(self.last_week, self.today, self.today), first)
+
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'worker': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker'},
+        'command': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'command'},
+    })
+    def test_bump_reaches_other_processes(self):
+        """Test that a write made with another process's cache invalidates this one's summaries"""
+        with override_settings(ANALYTICS_CACHE_ALIAS='worker'):
+            self.assertEqual(caching.range_summary(self.last_week, self.last_week, self.today)['total_records'], 1)
+        # A management command (its own process, so its own local-memory cache)
+        with override_settings(ANALYTICS_CACHE_ALIAS='command'):
+            AttendanceRecord.objects.filter(date=self.last_week).delete()
+        with override_settings(ANALYTICS_CACHE_ALIAS='worker'):
+            self.assertEqual(caching.range_summary(self.last_week, self.last_week, self.today)['total_records'], 0)
+
+
+class SeedingTests(TestCase):
+    def test_seed_attendance_command(self):
+        """Test that the seed command creates users, records and rollups"""
+        out = io.StringIO()
+        call_command('seed_attendance', users=20, days=7, stdout=out)
+
+        self.assertEqual(User.objects.filter(email__startswith='seed').count(), 20)
+        self.assertTrue(AttendanceRecord.objects.exists())
+        self.assertEqual(
+            sum(DailyAttendanceRollup.objects.values_list('visit_count', flat=True)),
+            AttendanceRecord.objects.count(),
+        )
+
+    def test_every_endpoint_has_a_benchmark(self):
+        """Test that the endpoint benchmark covers every named route"""
+        from .management.commands.benchmark_endpoints import REQUEST_SPECS, benchmarked_url_names
+
+        self.assertIn('api_check_in', benchmarked_url_names())
+        self.assertEqual(set(benchmarked_url_names()) - set(REQUEST_SPECS), set())
+
+
+class AttendanceExportTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.staff = User.objects.create_user(email='staff@example.com', password='testpass123', is_staff=True)
+        self.user = User.objects.create_user(
+            email='test@example.com', password='testpass123', first_name='Test', last_name='User',
+        )
+        self.client.login(email='staff@example.com', password='testpass123')
+        self.today = timezone.now().date()
+        for offset in range(3):
+            AttendanceRecord.objects.create(
+                user=self.user,
+                date=self.today - datetime.timedelta(days=offset),
+                check_in_time=timezone.now(),
+                purpose=purposes.intern('Meeting, with "quotes"'),
+            )
+
+    def test_csv_export(self):
+        """Test that a date range streams as CSV with joined user columns"""
+        response = self.client.get(reverse('attendance_export'), {
+            'date_from': (self.today - datetime.timedelta(days=1)).isoformat(),
+            'date_to': self.today.isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+        import csv
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['date'], (self.today - datetime.timedelta(days=1)).isoformat())
+        self.assertEqual(rows[0]['email'], 'test@example.com')
+        self.assertEqual(rows[0]['purpose_of_visit'], 'Meeting, with "quotes"')
+        self.assertEqual(rows[0]['check_out_time'], '')
+
+    def test_ndjson_export_joins_users(self):
+        """Test that NDJSON rows carry user fields without per-row queries"""
+        # Session and user lookups, the archive horizon, then the single
+        # joined export query
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('attendance_export'), {
+                'format': 'ndjson',
+                'date_from': (self.today - datetime.timedelta(days=7)).isoformat(),
+            })
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['user_type'], self.user.user_type)
+
+    def test_export_requires_staff_and_valid_params(self):
+        """Test that export is staff-only and rejects bad parameters"""
+        self.assertEqual(self.client.get(reverse('attendance_export'), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('attendance_export'), {'date_from': 'soon'}).status_code, 400)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('attendance_export')).status_code, 302)
+
+    def test_admin_export_action(self):
+        """Test that the admin action streams the selected records"""
+        self.staff.is_superuser = True
+        self.staff.save()
+        selected = AttendanceRecord.objects.order_by('id')[:2]
+        response = self.client.post(reverse('admin:attendance_attendancerecord_changelist'), {
+            'action': 'export_csv',
+            '_selected_action': [record.pk for record in selected],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+
+class ImportAttendanceTests(TestCase):
+    CSV_ROWS = (
+        'email,date,check_in,check_out,purpose,comments\n'
+        'known@example.com,2024-03-04,09:00,17:30,Work,"Two\nlines"\n'
+        'New.Person@Example.com,2024-03-04,10:15,,Meeting,\n'
+        'known@example.com,2024-03-05,2024-03-05T08:00:00,,Training,\n'
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='known@example.com', password='testpass123')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_attendance', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import(self):
+        """Test that rows are imported in bulk, creating missing users"""
+        out, _ = self.run_import(self.write('sheet.csv', self.CSV_ROWS))
+        self.assertIn('3 created', out)
+        self.assertIn('1 new users', out)
+
+        record = AttendanceRecord.objects.get(user=self.user, date=datetime.date(2024, 3, 4))
+        self.assertEqual(timezone.localtime(record.check_in_time).time(), datetime.time(9, 0))
+        self.assertEqual(timezone.localtime(record.check_out_time).time(), datetime.time(17, 30))
+        self.assertEqual(record.comments, 'Two\nlines')
+
+        new_user = User.objects.get(email='New.Person@example.com')
+        self.assertFalse(new_user.has_usable_password())
+        self.assertEqual(
+            sum(DailyAttendanceRollup.objects.values_list('visit_count', flat=True)), 3
+        )
+
+    def test_conflict_modes(self):
+        """Test skip, update and fail handling of existing (user, date) records"""
+        AttendanceRecord.objects.create(user=self.user, date=datetime.date(2024, 3, 4), purpose=purposes.intern('Old'))
+        path = self.write('sheet.csv', self.CSV_ROWS)
+
+        out, _ = self.run_import(path, conflict='skip')
+        self.assertIn('2 created', out)
+        self.assertIn('1 skipped', out)
+        self.assertEqual(AttendanceRecord.objects.get(user=self.user, date='2024-03-04').purpose_of_visit, 'Old')
+
+        AttendanceRecord.objects.filter(date='2024-03-05').delete()
+        with self.assertRaises(CommandError):
+            self.run_import(path, conflict='fail')
+        self.assertFalse(AttendanceRecord.objects.filter(date='2024-03-05').exists())
+
+        out, _ = self.run_import(path, conflict='update')
+        self.assertIn('2 updated', out)
+        self.assertEqual(AttendanceRecord.objects.get(user=self.user, date='2024-03-04').purpose_of_visit, 'Work')
+        self.assertEqual(AttendanceRecord.objects.count(), 3)
+
+    def test_concurrent_inserts_count_as_skipped(self):
+        """Test that records inserted after the conflict check are not counted as created"""
+        path = self.write('sheet.csv', self.CSV_ROWS)
+        archived_filter = ArchivedAttendanceRecord.objects.filter
+
+        def insert_meanwhile(**lookups):
+            # Another writer commits the same (user, date) after the live records were read
+            AttendanceRecord.objects.create(user=self.user, date=datetime.date(2024, 3, 4))
+            return archived_filter(**lookups)
+
+        with mock.patch.object(ArchivedAttendanceRecord.objects, 'filter', side_effect=insert_meanwhile):
+            out, _ = self.run_import(path, conflict='skip')
+        self.assertIn('2 created', out)
+        self.assertIn('1 skipped', out)
+        self.assertEqual(AttendanceRecord.objects.count(), 3)
+
+    def test_resume_from_offset(self):
+        """Test that an import resumes after the last committed batch"""
+        path = self.write('sheet.csv', self.CSV_ROWS)
+        offsets = []
+        with open(path, 'rb') as f:
+            importing.import_records(f, batch_size=1, on_batch=lambda stats: offsets.append(stats.offset))
+        AttendanceRecord.objects.all().delete()
+
+        # Resume after the first committed row (which spans two lines)
+        out, _ = self.run_import(path, offset=offsets[0])
+        self.assertIn('Imported 2 rows', out)
+        self.assertFalse(AttendanceRecord.objects.filter(user=self.user, date='2024-03-04').exists())
+        self.assertEqual(AttendanceRecord.objects.count(), 2)
+
+    def test_jsonl_import_reports_invalid_rows(self):
+        """Test JSON Lines input, with bad rows skipped and reported"""
+        path = self.write('sheet.jsonl', '\n'.join([
+            json.dumps({'email': 'known@example.com', 'check_in_time': '2024-03-04T09:00:00+00:00'}),
+            'not json',
+            json.dumps({'email': 'known@example.com', 'date': '2024-13-01'}),
+            json.dumps({'email': 'known@example.com', 'date': '2024-03-06', 'check_in': '09:00',
+                        'check_out': '08:00'}),
+        ]))
+        out, err = self.run_import(path)
+        self.assertIn('1 created', out)
+        self.assertIn('3 invalid', out)
+        self.assertIn('Row is not a JSON object', err)
+        self.assertIn("Invalid date '2024-13-01'", err)
+        self.assertIn('check-out is before check-in', err)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='test@example.com', password='testpass123', is_staff=True)
+        self.today = timezone.localdate()
+        self.records = [
+            AttendanceRecord.objects.create(
+                user=self.user, date=self.today - datetime.timedelta(days=days),
+                check_in_time=timezone.now() - datetime.timedelta(days=days),
+                check_out_time=timezone.now() - datetime.timedelta(days=days) + datetime.timedelta(hours=days % 5 + 1),
+                purpose=purposes.intern('Meeting'),
+            )
+            for days in (0, 10, 400, 500)
+        ]
+        rollups.rebuild_rollups()
+
+    def run_archive(self, **options):
+        out = io.StringIO()
+        call_command('archive_attendance', stdout=out, stderr=io.StringIO(), **options)
+        return out.getvalue()
+
+    def test_user_changes_reach_archived_rollups(self):
+        """Test that a user's new type and deletion reach the rollups of their archived visits"""
+        def counted():
+            return sorted(row for row in DailyAttendanceRollup.objects.values_list(
+                'date', 'user_type', 'hour', 'visit_count', 'completed_count', 'duration_seconds'
+            ) if any(row[3:]))
+
+        self.run_archive(days=365)
+        self.user.user_type = 'visitor'
+        self.user.save()
+        moved = counted()
+        self.assertEqual({row[1] for row in moved}, {'visitor'})
+        self.assertEqual(sum(row[3] for row in moved), 4)
+        rollups.rebuild_rollups()
+        self.assertEqual(counted(), moved)
+
+        self.user.delete()
+        self.assertEqual(counted(), [])
+        self.assertFalse(HeatmapCell.objects.exclude(arrivals=0, on_site=0).exists())
+
+    def test_moves_old_records_in_batches(self):
+        """Test that records past the horizon move to the archive, keeping their ids"""
+        self.assertIn('2 records', self.run_archive(days=365, dry_run=True))
+        self.assertIn('Archived 2 records', self.run_archive(days=365, batch_size=1))
+
+        self.assertEqual(
+            sorted(AttendanceRecord.objects.values_list('id', flat=True)),
+            [self.records[0].id, self.records[1].id],
+        )
+        self.assertEqual(
+            sorted(ArchivedAttendanceRecord.objects.values_list('id', flat=True)),
+            [self.records[2].id, self.records[3].id],
+        )
+        self.assertIn('Archived 0 records', self.run_archive(days=365))
+        with self.assertRaises(CommandError):
+            self.run_archive(days=0)
+
+    def test_reads_span_both_tiers(self):
+        """Test that history, exports, analytics and rollups see archived records"""
+        before = analytics.range_summary(self.today - datetime.timedelta(days=600), self.today)
+        self.run_archive(days=365)
+
+        url = reverse('api_user_attendance', args=[self.user.id])
+        page = self.client.get(url, {'limit': 3}).json()
+        rest = self.client.get(url, {'limit': 3, 'cursor': page['next']}).json()
+        self.assertEqual([row['id'] for row in page['results'] + rest['results']],
+                         [record.id for record in self.records])
+
+        old_day = self.records[2].date.isoformat()
+        response = self.client.get(reverse('api_attendance_records'), {'date': old_day})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.records[2].id])
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('attendance_export'), {
+            'format': 'ndjson', 'date_from': (self.today - datetime.timedelta(days=600)).isoformat(),
+        })
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+
+        after = analytics.range_summary(self.today - datetime.timedelta(days=600), self.today)
+        self.assertEqual(after, before)
+        self.assertEqual(after['total_records'], 4)
+
+        rollups.rebuild_rollups()
+        self.assertEqual(sum(DailyAttendanceRollup.objects.values_list('visit_count', flat=True)), 4)
+
+    def test_ranges_read_only_the_tiers_they_need(self):
+        """Test that only ranges straddling the horizon read through the union view"""
+        self.run_archive(days=365)
+        with self.assertNumQueries(0):
+            self.assertIs(archive.records_between(self.today, self.today).model, AttendanceRecord)
+        self.assertIs(archive.records_between(self.today - datetime.timedelta(days=30)).model, AttendanceRecord)
+        self.assertIs(
+            archive.records_between(self.records[3].date, self.records[2].date).model, ArchivedAttendanceRecord,
+        )
+        self.assertIs(archive.records_between(self.records[3].date).model, AttendanceHistory)
+
+    def test_import_respects_archived_records(self):
+        """Test that importing an archived person and day skips or updates the archived row"""
+        self.run_archive(days=365)
+        day = self.records[2].date
+        content = f'email,date,check_in,check_out,purpose\ntest@example.com,{day},08:00,09:00,Training\n'
+        stats = importing.import_records(io.BytesIO(content.encode()), conflict=importing.SKIP)
+        self.assertEqual((stats.created, stats.skipped), (0, 1))
+
+        stats = importing.import_records(io.BytesIO(content.encode()), conflict=importing.UPDATE)
+        self.assertEqual((stats.created, stats.updated), (0, 1))
+        self.assertFalse(AttendanceRecord.objects.filter(date=day).exists())
+        self.assertEqual(ArchivedAttendanceRecord.objects.get(date=day).purpose_of_visit, 'Training')
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="kiosk@example.com", user_type="member")
+        self.api_client = APIClient()
+
+    def post(self, name, payload, key='retry-1'):
+        return self.api_client.post(
+            reverse(name), data=json.dumps(payload), content_type='application/json', HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retries_replay_first_response(self):
+        """Test that a retried check-in/check-out is answered from one indexed lookup"""
+        payload = {'user_id': self.user.id, 'purpose_of_visit': 'Work'}
+        first = self.post('api_check_in', payload)
+        self.assertEqual(first.status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.post('api_check_in', payload)
+        self.assertEqual(len(queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}")
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('SEARCH attendance_idempotencykey USING INDEX', plan)
+        self.assertEqual((retry.status_code, retry.content), (201, first.content))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+        checkout = {'user_id': self.user.id, 'comments': 'Bye'}
+        first = self.post('api_check_out', checkout, key='retry-2')
+        with self.assertNumQueries(1):
+            retry = self.post('api_check_out', checkout, key='retry-2')
+        self.assertEqual((retry.status_code, retry.content), (200, first.content))
+
+        record = AttendanceRecord.objects.get(user=self.user)
+        self.assertEqual(record.comments.count('Check-out comments: Bye'), 1)
+        self.assertEqual(DailyAttendanceRollup.objects.get(date=timezone.localdate()).visit_count, 1)
+
+    def test_failures_are_not_stored(self):
+        """Test that an error response releases its key so the retry runs again"""
+        checkout = {'user_id': self.user.id}
+        self.assertEqual(self.post('api_check_out', checkout).status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        services.check_in(self.user)
+        self.assertEqual(self.post('api_check_out', checkout).status_code, 200)
+
+    def test_conflicting_requests(self):
+        """Test reusing a key for another request, and retrying one still in flight"""
+        self.post('api_check_in', {'user_id': self.user.id})
+        response = self.post('api_check_out', {'user_id': self.user.id})
+        self.assertEqual(response.status_code, 422)
+        self.assertIsNone(AttendanceRecord.objects.get(user=self.user).check_out_time)
+
+        payload = {'user_id': self.user.id}
+        request = RequestFactory().post(reverse('api_check_out'), data=json.dumps(payload),
+                                        content_type='application/json')
+        idempotency.claim('in-flight', idempotency.fingerprint(request))
+        self.assertEqual(self.post('api_check_out', payload, key='in-flight').status_code, 409)
+
+        response = self.post('api_check_out', payload, key='k' * (idempotency.MAX_KEY_LENGTH + 1))
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_keys_are_evicted(self):
+        """Test that stored responses expire and are deleted by the next claim"""
+        payload = {'user_id': self.user.id}
+        with override_settings(IDEMPOTENCY_KEY_TTL=-1):
+            self.post('api_check_in', payload)
+        self.assertIsNone(idempotency.lookup('retry-1'))
+
+        response = self.post('api_check_in', payload, key='retry-2')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Already checked in')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self.post('api_check_in', payload).status_code, 400)
+
+    def test_without_key(self):
+        """Test that requests without the header are handled and not stored"""
+        response = self.api_client.post(reverse('api_check_in'), {'user_id': self.user.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    async def test_async_retries(self):
+        """Test that the async endpoints replay stored responses too"""
+        payload = json.dumps({'user_id': self.user.id})
+        responses = [
+            await self.async_client.post(reverse('api_check_in_async'), data=payload,
+                                         content_type='application/json', headers={'Idempotency-Key': 'async'})
+            for _ in range(2)
+        ]
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[0].content, responses[1].content)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(await AttendanceRecord.objects.filter(user=self.user).acount(), 1)
+
+
+class AsyncApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com', password='testpass123', first_name='Test', last_name='User',
+        )
+
+    async def post(self, name, payload):
+        response = await self.async_client.post(
+            reverse(name), data=json.dumps(payload), content_type='application/json'
+        )
+        return response.status_code, json.loads(response.content)
+
+    async def test_check_in_and_out(self):
+        """Test the async check-in/check-out flow and its error cases"""
+        code, data = await self.post('api_check_in_async', {'user_id': self.user.id, 'purpose_of_visit': 'Work'})
+        self.assertEqual(code, 201)
+        self.assertEqual(data['purpose_of_visit'], 'Work')
+        self.assertEqual(data['user_details']['email'], 'test@example.com')
+
+        code, data = await self.post('api_check_in_async', {'user_id': self.user.id})
+        self.assertEqual(code, 400)
+        self.assertEqual(data['error'], 'Already checked in')
+
+        code, data = await self.post('api_check_out_async', {'user_id': self.user.id, 'comments': 'Bye'})
+        self.assertEqual(code, 200)
+        self.assertIsNotNone(data['check_out_time'])
+        self.assertIn('Check-out comments: Bye', data['comments'])
+
+        code, data = await self.post('api_check_out_async', {'user_id': self.user.id})
+        self.assertEqual(code, 400)
+        self.assertEqual(data['error'], 'Already checked out')
+
+        rollup = await DailyAttendanceRollup.objects.aget(date=timezone.localdate())
+        self.assertEqual(rollup.visit_count, 1)
+
+    async def test_errors(self):
+        """Test async API responses for bad input"""
+        code, data = await self.post('api_check_out_async', {'user_id': self.user.id})
+        self.assertEqual((code, data['error']), (400, 'No check-in record found for today'))
+
+        code, data = await self.post('api_check_in_async', {'user_id': 999999})
+        self.assertEqual((code, data['error']), (400, 'No User matches the given query.'))
+
+        response = await self.async_client.get(reverse('api_check_in_async'))
+        self.assertEqual(response.status_code, 405)
+
+    async def test_records_for_past_dates(self):
+        """Test that async listings of past dates read the archive tier without sync queries"""
+        today = timezone.localdate()
+        old_day, recent_day = today - datetime.timedelta(days=400), today - datetime.timedelta(days=3)
+        for day in (old_day, recent_day):
+            await AttendanceRecord.objects.acreate(
+                user=self.user, date=day,
+                check_in_time=timezone.make_aware(datetime.datetime.combine(day, datetime.time(9))),
+            )
+        await sync_to_async(archive.archive_records)(archive.archive_horizon())
+
+        for day, expected in ((old_day, 1), (recent_day, 1), (datetime.date(2020, 1, 1), 0)):
+            response = await self.async_client.get(reverse('api_attendance_records_async'), {'date': day.isoformat()})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), expected)
+            sync_page = await sync_to_async(self.client.get)(reverse('api_attendance_records'), {'date': day.isoformat()})
+            self.assertEqual(response.json(), sync_page.json())
+
+    def test_same_json_as_sync_api(self):
+        """Test that the async endpoints match the sync ones"""
+        other = User.objects.create_user(email='other@example.com', password='testpass123')
+        sync_response = APIClient().post(reverse('api_check_in'), {'user_id': self.user.id}, format='json')
+        async_response = self.client.post(
+            reverse('api_check_in_async'), data=json.dumps({'user_id': other.id}), content_type='application/json'
+        )
+        self.assertEqual(set(sync_response.json()), set(async_response.json()))
+
+        sync_page = self.client.get(reverse('api_attendance_records'), {'limit': 1}).json()
+        async_page = self.client.get(reverse('api_attendance_records_async'), {'limit': 1}).json()
+        self.assertEqual(sync_page, async_page)
+        self.assertIsNotNone(async_page['next'])
+
+        next_page = self.client.get(reverse('api_attendance_records_async'), {'cursor': async_page['next']}).json()
+        self.assertEqual(len(next_page['results']), 1)
+        self.assertEqual(
+            self.client.get(reverse('api_attendance_records_async'), {'date': 'nope'}).status_code, 400
+        )
+
+
+class OccupancyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='test@example.com', password='testpass123', first_name='Test', last_name='User',
+        )
+        self.other = User.objects.create_user(email='other@example.com', password='testpass123')
+
+    def status(self, **params):
+        return self.client.get(reverse('api_occupancy'), params).json()
+
+    def test_check_ins_and_outs_update_cached_occupancy(self):
+        """Test that polling is served from the cache as people come and go"""
+        self.assertEqual(self.status()['count'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.check_in(self.user)
+            services.check_in(self.other)
+        with self.assertNumQueries(0):
+            data = self.status()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['on_site'][0]['name'], 'Test User')
+        self.assertEqual(data['on_site'][1]['name'], 'other@example.com')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.check_out(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.status(count_only=1)['count'], 1)
+        self.assertEqual([entry['user_id'] for entry in self.status()['on_site']], [self.other.id])
+
+    def test_contended_updates_keep_cache(self):
+        """Test that taps during a burst still count and never drop the cached occupancy"""
+        self.assertEqual(occupancy.occupancy_count(), 0)
+        lock_key = occupancy._keys(timezone.localdate())[-1]
+        cache.add(lock_key, 1, 30)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.check_in(self.user)
+            services.check_in(self.other)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.status(count_only=1)['count'], 2)
+
+        # The set updates gave up on the lock; reconciling brings them in
+        with override_settings(OCCUPANCY_RECONCILE_INTERVAL=0):
+            self.assertEqual(len(self.status()['on_site']), 2)
+        cache.delete(lock_key)
+
+    def test_reconciles_with_database(self):
+        """Test that writes the counter cannot see are picked up periodically"""
+        self.assertEqual(occupancy.occupancy_count(), 0)
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(user=self.user, date=timezone.localdate(), check_in_time=timezone.now()),
+        ])
+        self.assertEqual(occupancy.occupancy_count(), 0)
+
+        with override_settings(OCCUPANCY_RECONCILE_INTERVAL=0):
+            self.assertEqual(occupancy.occupancy_count(), 1)
+
+    def test_edits_invalidate_occupancy(self):
+        """Test that saving or deleting a record drops the cached occupancy"""
+        with self.captureOnCommitCallbacks(execute=True):
+            record = services.check_in(self.user)
+        self.assertEqual(occupancy.occupancy_count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            AttendanceRecord.objects.get(pk=record.pk).delete()
+        self.assertEqual(occupancy.occupancy_count(), 0)
+
+
+class LiveEventsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email='test@example.com', password='testpass123', first_name='Test', last_name='User',
+        )
+        # A fresh publisher flushed by hand instead of by its thread
+        publisher = events.Publisher()
+        publisher.threaded = False
+        patcher = mock.patch.object(events, 'publisher', publisher)
+        self.publisher = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def parse(message):
+        lines = dict(line.split(': ', 1) for line in message.decode().strip().split('\n'))
+        return lines['event'], json.loads(lines['data'])
+
+    def write(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            action(self.user)
+        self.publisher.flush()
+
+    async def test_stream_pushes_check_ins_and_outs(self):
+        """Test that a connected dashboard receives events with counters"""
+        response = await self.async_client.get(reverse('attendance_events'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        event, data = self.parse(await anext(stream))
+        self.assertEqual(event, 'counters')
+        self.assertEqual(data['counters']['today_count'], 0)
+        self.assertEqual(self.publisher.subscriber_count, 1)
+
+        await sync_to_async(self.write)(services.check_in)
+        event, data = self.parse(await anext(stream))
+        self.assertEqual((event, data['name']), ('check_in', 'Test User'))
+        self.assertEqual(data['counters']['today_checked_in'], 1)
+        self.assertEqual(data['counters']['on_site'], 1)
+
+        await sync_to_async(self.write)(services.check_out)
+        event, data = self.parse(await anext(stream))
+        self.assertEqual(event, 'check_out')
+        self.assertEqual(data['counters']['today_checked_out'], 1)
+        self.assertEqual(data['counters']['on_site'], 0)
+
+    def test_wsgi_dashboards_poll(self):
+        """Test that WSGI requests are not streamed and the dashboards poll instead"""
+        response = self.client.get(reverse('attendance_events'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.publisher.subscriber_count, 0)
+
+        response = self.client.get(reverse('attendance_dashboard'))
+        self.assertFalse(response.context['live_events'])
+        self.assertContains(response, 'count_only=1&counters=1')
+        self.assertNotContains(response, 'new EventSource')
+
+        services.check_in(self.user)
+        data = self.client.get(reverse('api_occupancy'), {'count_only': 1, 'counters': 1}).json()
+        self.assertEqual((data['count'], data['counters']['today_checked_in']), (1, 1))
+
+    def test_idle_publisher_refreshes_counters(self):
+        """Test that dashboards get fresh counters when their process handles no writes"""
+        subscriber = events.Subscriber()
+        self.publisher.subscribe(subscriber)
+        # A check-in handled by another worker process: nothing is published here
+        AttendanceRecord.objects.create(user=self.user, date=timezone.localdate(), check_in_time=timezone.now())
+        with mock.patch.object(events, 'HEARTBEAT_INTERVAL', 0.01):
+            self.publisher.step()
+            self.publisher.step()
+        event, data = self.parse(subscriber.get(0))
+        self.assertEqual((event, data['counters']['today_checked_in']), ('counters', 1))
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'other': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other'},
+    })
+    def test_counters_trail_other_processes_within_bound(self):
+        """Test how long counters lag a write made by a process with its own caches"""
+        subscriber = events.Subscriber()
+        self.publisher.subscribe(subscriber)
+        self.assertEqual(events.counters()['today_checked_in'], 0)
+        self.assertEqual(events.counters()['on_site'], 0)
+
+        # Another worker process: its own caches and its own publisher
+        with override_settings(ANALYTICS_CACHE_ALIAS='other', OCCUPANCY_CACHE_ALIAS='other'), \
+                mock.patch.object(events, 'publisher', events.Publisher()):
+            with self.captureOnCommitCallbacks(execute=True):
+                services.check_in(self.user)
+
+        def heartbeat():
+            with mock.patch.object(events, 'HEARTBEAT_INTERVAL', 0.01):
+                self.publisher.step()
+                self.publisher.step()
+            return self.parse(subscriber.get(0))[1]['counters']
+
+        # The next heartbeat carries the new counts; on-site waits for the reconcile
+        data = heartbeat()
+        self.assertEqual((data['today_checked_in'], data['on_site']), (1, 0))
+        with override_settings(OCCUPANCY_RECONCILE_INTERVAL=0):
+            self.assertEqual(heartbeat()['on_site'], 1)
+
+    def test_fan_out_cost_does_not_grow_with_clients(self):
+        """Test that counters are computed once per batch, not once per client"""
+        def publish_to(count):
+            subscribers = [events.Subscriber() for _ in range(count)]
+            for subscriber in subscribers:
+                self.publisher.subscribe(subscriber)
+            self.publisher.publish(events.COUNTERS)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.publisher.flush()
+            for subscriber in subscribers:
+                self.publisher.unsubscribe(subscriber)
+            return len(queries), {subscriber.get(0) for subscriber in subscribers}
+
+        one_client, _ = publish_to(1)
+        fifty_clients, messages = publish_to(50)
+        self.assertEqual(one_client, fifty_clients)
+        self.assertEqual(len(messages), 1)
+
+    def test_publish_without_subscribers_is_free(self):
+        """Test that nothing is queued when no dashboard is connected"""
+        self.publisher.publish(events.COUNTERS)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.publisher.flush(), 0)
+
+    def test_slow_client_is_dropped(self):
+        """Test that a client that stops reading is disconnected"""
+        subscriber = events.Subscriber()
+        for _ in range(events.SUBSCRIBER_QUEUE_SIZE + 1):
+            subscriber.deliver(b'event: counters\n\n')
+        self.assertTrue(subscriber.dropped)
+        self.assertEqual(subscriber.get(0), b'event: counters\n\n')
+
+    async def test_async_stream(self):
+        """Test the stream served to ASGI clients"""
+        stream = events.astream(b'initial')
+        self.assertEqual(await anext(stream), b'initial')
+        self.assertEqual(self.publisher.subscriber_count, 1)
+
+        self.publisher.publish(events.COUNTERS)
+        await sync_to_async(self.publisher.flush)()
+        event, data = self.parse(await anext(stream))
+        self.assertEqual(event, 'counters')
+
+        await stream.aclose()
+        self.assertEqual(self.publisher.subscriber_count, 0)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        user = User.objects.create_user(email='test@example.com', password='testpass123')
+        AttendanceRecord.objects.create(user=user, date=timezone.localdate(), check_in_time=timezone.now())
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_records_per_view_metrics(self):
+        """Test latency, queries, template time and size are recorded per URL name"""
+        self.client.get(reverse('attendance_list'))
+        self.client.get(reverse('attendance_list'))
+        self.client.get('/no-such-page/')
+        samples = self.scrape()
+
+        view = 'view="attendance_list"'
+        self.assertEqual(samples[f'http_requests_total{{{view},method="GET",status="200"}}'], 2)
+        self.assertEqual(samples[f'http_request_duration_seconds_count{{{view},method="GET"}}'], 2)
+        self.assertEqual(samples[f'http_request_duration_seconds_bucket{{{view},method="GET",le="+Inf"}}'], 2)
+        self.assertGreater(samples[f'http_request_duration_seconds_sum{{{view},method="GET"}}'], 0)
+        self.assertGreater(samples[f'db_queries_per_request_sum{{{view}}}'], 0)
+        self.assertGreater(samples[f'db_query_duration_seconds_total{{{view}}}'], 0)
+        self.assertGreater(samples[f'template_render_duration_seconds_total{{{view}}}'], 0)
+        self.assertGreater(samples[f'http_response_size_bytes_sum{{{view}}}'], 0)
+        self.assertEqual(
+            samples['http_requests_total{view="<unresolved>",method="GET",status="404"}'], 1,
+        )
+
+    def test_aggregates_worker_processes(self):
+        """Test that /metrics adds up the totals every worker wrote to METRICS_DIR"""
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+
+        other = metrics.Registry()
+        other.inc('http_requests_total', (('view', 'attendance_list'), ('method', 'GET'), ('status', 200)), 5)
+        other.observe('http_request_duration_seconds', (('view', 'attendance_list'), ('method', 'GET')), 0.02)
+        with open(os.path.join(directory, 'metrics-1.json'), 'w') as f:
+            json.dump(other.snapshot(), f)
+
+        with override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('attendance_list'))
+            samples = self.scrape()
+        view = 'view="attendance_list",method="GET"'
+        self.assertEqual(samples[f'http_requests_total{{{view},status="200"}}'], 6)
+        self.assertEqual(samples[f'http_request_duration_seconds_count{{{view}}}'], 2)
+        self.assertGreaterEqual(samples[f'http_request_duration_seconds_bucket{{{view},le="0.025"}}'], 1)
+
+    def test_reused_pid_keeps_exited_workers_totals(self):
+        """Test that a worker reusing an exited worker's pid does not overwrite its file"""
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        labels = (('view', 'attendance_list'), ('method', 'GET'), ('status', 200))
+        with override_settings(METRICS_DIR=directory):
+            exited = metrics.Registry()
+            exited.inc('http_requests_total', labels, 5)
+            exited.flush(force=True)
+            # Same pid, as a new worker forked after the first one exited
+            self.registry.inc('http_requests_total', labels, 2)
+            counters, _ = metrics.collect()
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertEqual(counters['http_requests_total', labels], 7)
+
+    def test_exited_workers_are_retired(self):
+        """Test that scrapes fold the files of exited workers into one retained file"""
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        labels = (('view', 'attendance_list'), ('method', 'GET'), ('status', 200))
+        for value in (3, 4):
+            worker = subprocess.Popen([sys.executable, '-c', ''])
+            worker.wait()
+            exited = metrics.Registry()
+            exited.inc('http_requests_total', labels, value)
+            with open(os.path.join(directory, f"metrics-{worker.pid}-{value}.json"), 'w') as f:
+                json.dump(exited.snapshot(), f)
+
+        with override_settings(METRICS_DIR=directory):
+            for _ in range(2):
+                counters, _ = metrics.collect()
+                self.assertEqual(counters['http_requests_total', labels], 7)
+        self.assertEqual(
+            sorted(os.listdir(directory)), sorted([metrics.RETIRED_FILE, self.registry.filename]),
+        )
+
+    def test_stock_template_backend_is_not_patched(self):
+        """Test that template timing is opt-in through the TimedDjangoTemplates backend"""
+        from django.template.backends.django import Template
+        self.assertEqual(Template.render.__module__, 'django.template.backends.django')
+        self.assertIsInstance(get_template('attendance/list.html'), metrics.TimedTemplate)
+
+    def test_forked_worker_starts_empty(self):
+        """Test that a worker does not report samples inherited from its parent"""
+        self.registry.inc('http_requests_total', (('view', 'x'),))
+        self.registry.pid = -1
+        self.assertEqual(self.registry.snapshot(), {'counters': [], 'histograms': []})
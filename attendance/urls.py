@@ -10,10 +10,20 @@ urlpatterns = [
     path('success/', views.attendance_success, name='attendance_success'),
     path('list/', views.attendance_list, name='attendance_list'),
     path('analytics/', views.analytics_dashboard, name='analytics_dashboard'),
+    path('events/', views.live_events, name='attendance_events'),
+    path('export/', views.export_attendance, name='attendance_export'),
+    path('analytics/heatmap/', views.attendance_heatmap, name='attendance_heatmap'),
     
     # API endpoints
     path('api/check-in/', views.api_check_in, name='api_check_in'),
     path('api/check-out/', views.api_check_out, name='api_check_out'),
+    path('api/batch/', views.api_batch_attendance, name='api_batch_attendance'),
+    path('api/occupancy/', views.occupancy_status, name='api_occupancy'),
     path('api/records/', views.api_attendance_records, name='api_attendance_records'),
     path('api/user/<int:user_id>/attendance/', views.api_user_attendance, name='api_user_attendance'),
+    
+    # Async variants of the API endpoints, for ASGI deployments
+    path('api/async/check-in/', views.api_check_in_async, name='api_check_in_async'),
+    path('api/async/check-out/', views.api_check_out_async, name='api_check_out_async'),
+    path('api/async/records/', views.api_attendance_records_async, name='api_attendance_records_async'),
 ]
@@ -1,14 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Count, Avg, F, Q
-from django.db.models.functions import TruncWeek, TruncMonth, ExtractHour
+from django.views.decorators.http import require_GET, require_POST
+from django.db import IntegrityError
 import json
+from users.cache import user_lookup_cache
 from users.models import User
 from .models import AttendanceRecord
 from .forms import CheckInForm, CheckOutForm
+from . import analytics, archive, caching, events, export, occupancy, services
+from .idempotency import idempotent
+from .representation import record_rows, record_values
+from .batch import BatchError, apply_batch
+from .pagination import InvalidPageRequest, akeyset_page, keyset_page, parse_limit
 from django.contrib import messages
 import calendar
 from datetime import timedelta, datetime
@@ -37,6 +43,7 @@ except ImportError:
         HTTP_201_CREATED = 201
         HTTP_400_BAD_REQUEST = 400
         HTTP_404_NOT_FOUND = 404
+        HTTP_409_CONFLICT = 409
 
 # Import serializers only if REST Framework is available
 if REST_FRAMEWORK_AVAILABLE:
@@ -52,20 +59,21 @@ def check_in(request, user_id):
     user = get_object_or_404(User, id=user_id)
     today = timezone.now().date()
     
-    attendance, created = AttendanceRecord.objects.get_or_create(
-        user=user,
-        date=today,
-    )
-    
-    if attendance.check_in_time and not created:
+    attendance = AttendanceRecord.objects.filter(user=user, date=today).first()
+    if attendance and attendance.check_in_time:
         return render(request, 'attendance/already_checked_in.html', {'attendance': attendance})
     
     if request.method == 'POST':
-        form = CheckInForm(request.POST, instance=attendance)
+        form = CheckInForm(request.POST)
         if form.is_valid():
-            attendance = form.save(commit=False)
-            attendance.check_in_time = timezone.now()
-            attendance.save()
+            try:
+                services.check_in(
+                    user,
+                    purpose_of_visit=form.cleaned_data['purpose_of_visit'],
+                    comments=form.cleaned_data['comments'],
+                )
+            except services.AlreadyCheckedIn as e:
+                return render(request, 'attendance/already_checked_in.html', {'attendance': e.record})
             return redirect('attendance_success')
     else:
         form = CheckInForm(instance=attendance)
@@ -79,12 +87,8 @@ def check_out(request, user_id):
     user = get_object_or_404(User, id=user_id)
     today = timezone.now().date()
     
-    try:
-        attendance = AttendanceRecord.objects.get(
-            user=user,
-            date=today,
-        )
-    except AttendanceRecord.DoesNotExist:
+    attendance = AttendanceRecord.objects.filter(user=user, date=today).first()
+    if attendance is None:
         return render(request, 'attendance/not_checked_in.html', {'user': user})
     
     if attendance.check_out_time:
@@ -93,10 +97,12 @@ def check_out(request, user_id):
     if request.method == 'POST':
         form = CheckOutForm(request.POST)
         if form.is_valid():
-            attendance.check_out_time = timezone.now()
-            if form.cleaned_data['comments']:
-                attendance.comments += f"\nCheck-out comments: {form.cleaned_data['comments']}"
-            attendance.save()
+            try:
+                services.check_out(user, comments=form.cleaned_data['comments'])
+            except services.NotCheckedIn:
+                return render(request, 'attendance/not_checked_in.html', {'user': user})
+            except services.AlreadyCheckedOut as e:
+                return render(request, 'attendance/already_checked_out.html', {'attendance': e.record})
             return redirect('attendance_success')
     else:
         form = CheckOutForm()
@@ -110,23 +116,79 @@ def check_out(request, user_id):
 def attendance_success(request):
     return render(request, 'attendance/success.html')
 
-def attendance_list(request):
+# Columns the record tables render; user and purpose are joined rather than fetched per row
+RECORD_TABLE_FIELDS = (
+    'id', 'date', 'check_in_time', 'check_out_time', 'purpose__name',
+    'user__id', 'user__first_name', 'user__last_name', 'user__user_type',
+)
+
+def todays_records():
+    """Today's records with their users and purposes joined, newest check-in first"""
     today = timezone.now().date()
-    records = AttendanceRecord.objects.filter(date=today).order_by('-check_in_time')
-    return render(request, 'attendance/list.html', {'records': records})
+    return AttendanceRecord.objects.filter(
+        date=today
+    ).select_related('user', 'purpose').only(*RECORD_TABLE_FIELDS).order_by('-check_in_time')
+
+def attendance_list(request):
+    return render(request, 'attendance/list.html', {'records': todays_records()})
 
 def attendance_dashboard(request):
     """Dashboard view for the attendance app"""
     today = timezone.now().date()
-    records = AttendanceRecord.objects.filter(date=today).order_by('-check_in_time')
+    records = list(todays_records())
     
     context = {
         'records': records,
+        'open_records': [record for record in records if not record.check_out_time],
+        'today_count': len(records),
         'today': today,
+        **events.live_update_context(request),
     }
     
     return render(request, 'attendance/dashboard.html', context)
 
+def occupancy_status(request):
+    """
+    Live headcount for wall displays: today's occupancy count and who is on
+    site, served from the occupancy cache. `count_only=1` skips the list, and
+    `counters=1` adds the dashboards' headline counters (what live_events
+    pushes), for dashboards polling instead of streaming.
+    """
+    today = timezone.localdate()
+    flag = lambda name: request.GET.get(name) in ('1', 'true')
+    if flag('count_only'):
+        data = {'date': today, 'count': occupancy.occupancy_count(today)}
+    else:
+        users, _ = occupancy.on_site(today)
+        on_site = sorted(
+            ({'user_id': user_id, **entry} for user_id, entry in users.items()),
+            key=lambda entry: entry['check_in_time'],
+        )
+        data = {'date': today, 'count': len(on_site), 'on_site': on_site}
+    if flag('counters'):
+        data['counters'] = events.counters()
+    return JsonResponse(data)
+
+def live_events(request):
+    """
+    Server-Sent Events feed for the dashboards: `check_in`, `check_out` and
+    `counters` events, each carrying today's headline counters. Fanned out
+    by attendance.events.publisher, so open dashboards cost no queries.
+
+    Only served under ASGI. A WSGI worker would be held by every open
+    dashboard for as long as it stays open, so WSGI requests get 204, which
+    tells EventSource not to reconnect; the dashboards poll
+    occupancy_status there instead (see events.streams_available()).
+    """
+    if not events.streams_available(request):
+        return HttpResponse(status=204)
+    initial = events.encode(events.COUNTERS, {'counters': events.counters()})
+    response = StreamingHttpResponse(events.astream(initial), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def sign_attendance(request):
     """
     Public page for signing attendance (check-in or check-out).
@@ -148,30 +210,50 @@ def sign_attendance(request):
             messages.error(request, "Please enter your email.")
             return render(request, 'attendance/sign_attendance.html', context)
 
-        try:
-            # Rename user to attendance_user to avoid template confusion
-            attendance_user = User.objects.get(email=email)
-            context['attendance_user'] = attendance_user
-        except User.DoesNotExist:
+        # Rename user to attendance_user to avoid template confusion. The
+        # lookup cache spares the users table the two lookups per visitor.
+        attendance_user = user_lookup_cache.get(email)
+        if attendance_user is None:
             messages.error(request, "No user found with that email.")
             context['email'] = email
             return render(request, 'attendance/sign_attendance.html', context)
+        context['attendance_user'] = attendance_user
 
         today = timezone.now().date()
-        attendance, created = AttendanceRecord.objects.get_or_create(user=attendance_user, date=today)
+        attendance = AttendanceRecord.objects.filter(user=attendance_user, date=today).first()
         context['attendance'] = attendance
-        context['created_new'] = created
+        context['created_new'] = attendance is None
         context['email'] = email
 
         # Handle check-in
-        if not attendance.check_in_time:
+        if attendance is None or not attendance.check_in_time:
             context['action'] = 'check_in'
             if 'check_in' in request.POST:
-                form = CheckInForm(request.POST, instance=attendance)
+                form = CheckInForm(request.POST)
                 if form.is_valid():
-                    record = form.save(commit=False)
-                    record.check_in_time = timezone.now()
-                    record.save()
+                    try:
+                        record = services.check_in(
+                            attendance_user,
+                            purpose_of_visit=form.cleaned_data['purpose_of_visit'],
+                            comments=form.cleaned_data['comments'],
+                        )
+                    except services.AlreadyCheckedIn as e:
+                        # Another tap checked this user in first; offer the check-out instead
+                        messages.info(request, "You are already checked in.")
+                        context.update(attendance=e.record, action='check_out', form=CheckOutForm())
+                        return render(request, 'attendance/sign_attendance.html', context)
+                    except IntegrityError:
+                        # The cached user was deleted (by another process, whose
+                        # signals never reach this cache): look the email up again
+                        user_lookup_cache.invalidate(email)
+                        attendance_user = user_lookup_cache.get(email)
+                        if attendance_user is None:
+                            messages.error(request, "No user found with that email.")
+                            del context['attendance_user']
+                            return render(request, 'attendance/sign_attendance.html', context)
+                        messages.info(request, "Please confirm your check-in.")
+                        context.update(attendance_user=attendance_user, attendance=None, form=form)
+                        return render(request, 'attendance/sign_attendance.html', context)
                     messages.success(request, f"Successfully checked in at {record.check_in_time.strftime('%H:%M:%S')}")
                     return redirect('attendance_success')
             else:
@@ -185,11 +267,13 @@ def sign_attendance(request):
             if 'check_out' in request.POST:
                 form = CheckOutForm(request.POST)
                 if form.is_valid():
-                    attendance.check_out_time = timezone.now()
-                    if form.cleaned_data.get('comments'):
-                        attendance.comments += f"\nCheck-out comments: {form.cleaned_data['comments']}"
-                    attendance.save()
-                    messages.success(request, f"Successfully checked out at {attendance.check_out_time.strftime('%H:%M:%S')}")
+                    try:
+                        record = services.check_out(attendance_user, comments=form.cleaned_data.get('comments'))
+                    except services.CheckInError as e:
+                        context.update(attendance=e.record, already_done=True)
+                        context.pop('action')
+                        return render(request, 'attendance/sign_attendance.html', context)
+                    messages.success(request, f"Successfully checked out at {record.check_out_time.strftime('%H:%M:%S')}")
                     return redirect('attendance_success')
             else:
                 form = CheckOutForm()
@@ -206,9 +290,13 @@ def sign_attendance(request):
 
 # API Endpoints
 @csrf_exempt
+@idempotent
 @api_view(['POST'])
 def api_check_in(request):
-    """API endpoint for user check-in"""
+    """
+    API endpoint for user check-in. Retries sent with the same
+    Idempotency-Key header get the first response (see attendance.idempotency).
+    """
     if not REST_FRAMEWORK_AVAILABLE:
         return JsonResponse({
             'error': 'Django REST Framework is not installed. Please install it first.'
@@ -218,36 +306,29 @@ def api_check_in(request):
         data = request.data
         user_id = data.get('user_id')
         user = get_object_or_404(User, id=user_id)
-        today = timezone.now().date()
         
-        # Check if already checked in
-        existing = AttendanceRecord.objects.filter(user=user, date=today).first()
-        if existing and existing.check_in_time:
+        try:
+            attendance = services.check_in(
+                user,
+                purpose_of_visit=data.get('purpose_of_visit', ''),
+                comments=data.get('comments', ''),
+            )
+        except services.AlreadyCheckedIn as e:
             return Response({
                 'error': 'Already checked in',
-                'check_in_time': existing.check_in_time
+                'check_in_time': e.record.check_in_time
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create new record or update existing
-        if existing:
-            attendance = existing
-        else:
-            attendance = AttendanceRecord(user=user, date=today)
-        
-        attendance.check_in_time = timezone.now()
-        attendance.purpose_of_visit = data.get('purpose_of_visit', '')
-        attendance.comments = data.get('comments', '')
-        attendance.save()
-        
         serializer = AttendanceRecordSerializer(attendance)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 @csrf_exempt
+@idempotent
 @api_view(['POST'])
 def api_check_out(request):
-    """API endpoint for user check-out"""
+    """API endpoint for user check-out, idempotent like api_check_in"""
     if not REST_FRAMEWORK_AVAILABLE:
         return JsonResponse({
             'error': 'Django REST Framework is not installed. Please install it first.'
@@ -257,79 +338,220 @@ def api_check_out(request):
         data = request.data
         user_id = data.get('user_id')
         user = get_object_or_404(User, id=user_id)
-        today = timezone.now().date()
         
-        # Get today's record
         try:
-            attendance = AttendanceRecord.objects.get(user=user, date=today)
-        except AttendanceRecord.DoesNotExist:
+            attendance = services.check_out(user, comments=data.get('comments'))
+        except services.NotCheckedIn:
             return Response({'error': 'No check-in record found for today'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Check if already checked out
-        if attendance.check_out_time:
+        except services.AlreadyCheckedOut as e:
             return Response({
                 'error': 'Already checked out',
-                'check_out_time': attendance.check_out_time
+                'check_out_time': e.record.check_out_time
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Update check-out time and comments
-        attendance.check_out_time = timezone.now()
-        if 'comments' in data and data['comments']:
-            attendance.comments += f"\nCheck-out comments: {data['comments']}"
-        attendance.save()
-        
         serializer = AttendanceRecordSerializer(attendance)
         return Response(serializer.data, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['GET'])
-def api_attendance_records(request):
-    """API endpoint to get attendance records"""
+@csrf_exempt
+@api_view(['POST'])
+def api_batch_attendance(request):
+    """
+    API endpoint for kiosks replaying queued check-ins/check-outs.
+    Expects {"events": [{"action": "check_in" | "check_out", "user_id" or
+    "email", "timestamp", "purpose_of_visit", "comments"}, ...]} and returns
+    one result per event, in order, applied in a single transaction.
+    """
     if not REST_FRAMEWORK_AVAILABLE:
         return JsonResponse({
             'error': 'Django REST Framework is not installed. Please install it first.'
         }, status=400)
-        
-    date_param = request.query_params.get('date')
-    user_id = request.query_params.get('user_id')
-    
-    # Filter records
-    records = AttendanceRecord.objects.all()
     
+    try:
+        results = apply_batch(request.data.get('events'))
+    except BatchError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError:
+        # A concurrent request wrote one of the same records; the whole batch
+        # was rolled back and can be replayed safely
+        return Response({'error': 'Conflicting concurrent check-in, retry the batch'},
+                        status=status.HTTP_409_CONFLICT)
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+def _records_day(params):
+    """The `date` query parameter (default today); ValueError if malformed"""
+    date_param = params.get('date')
     if date_param:
-        try:
-            date = timezone.datetime.strptime(date_param, '%Y-%m-%d').date()
-            records = records.filter(date=date)
-        except ValueError:
-            return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, 
-                            status=status.HTTP_400_BAD_REQUEST)
-    else:
-        # Default to today if no date provided
-        today = timezone.now().date()
-        records = records.filter(date=today)
-    
+        return timezone.datetime.strptime(date_param, '%Y-%m-%d').date()
+    # Default to today if no date provided
+    return timezone.now().date()
+
+def _for_user(records, params):
+    user_id = params.get('user_id')
     if user_id:
         records = records.filter(user_id=user_id)
+    return records
+
+def filtered_records(params):
+    """
+    Records for the `date` (default today) and optional `user_id` query
+    parameters, archived ones included. Raises ValueError for a malformed
+    date.
+    """
+    day = _records_day(params)
+    return _for_user(archive.records_between(day, day), params)
+
+async def afiltered_records(params):
+    """Async filtered_records()"""
+    day = _records_day(params)
+    return _for_user(await archive.arecords_between(day, day), params)
+
+@api_view(['GET'])
+def api_attendance_records(request):
+    """
+    API endpoint to get attendance records for one date (default today).
+    Accepts `limit` and `cursor` query parameters; follow `next` for more.
+    Rows are built from values() (see attendance.representation), so this
+    also works without REST framework.
+    """
+    try:
+        records = filtered_records(request.GET)
+    except ValueError:
+        return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, 
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        page, next_cursor = keyset_page(
+            record_values(records),
+            cursor=request.GET.get('cursor'),
+            limit=parse_limit(request.GET.get('limit')),
+        )
+    except InvalidPageRequest as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = AttendanceRecordSerializer(records, many=True)
-    return Response(serializer.data)
+    return Response({'results': record_rows(page), 'next': next_cursor})
 
 @api_view(['GET'])
 def api_user_attendance(request, user_id):
-    """API endpoint to get a specific user's attendance history"""
-    if not REST_FRAMEWORK_AVAILABLE:
-        return JsonResponse({
-            'error': 'Django REST Framework is not installed. Please install it first.'
-        }, status=400)
-        
+    """
+    API endpoint to get a specific user's attendance history, newest first,
+    archived records included. Accepts `limit` and `cursor` query
+    parameters; follow `next` for more.
+    """
     try:
         user = User.objects.get(id=user_id)
-        records = AttendanceRecord.objects.filter(user=user).order_by('-date')
-        serializer = AttendanceRecordSerializer(records, many=True)
-        return Response(serializer.data)
+        page, next_cursor = keyset_page(
+            record_values(archive.user_records(user)),
+            cursor=request.GET.get('cursor'),
+            limit=parse_limit(request.GET.get('limit')),
+        )
+        return Response({'results': record_rows(page), 'next': next_cursor})
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except InvalidPageRequest as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+# Async API endpoints
+#
+# Native async counterparts of api_check_in, api_check_out and
+# api_attendance_records for deployments served by ASGI (config.asgi). They
+# accept the same input and return the same JSON, but use the async ORM
+# instead of running in the sync-to-async thread pool. REST framework views
+# are sync-only, so these are plain Django views that parse JSON themselves.
+
+def _request_data(request):
+    """The JSON body of an async API request, or its form data"""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or b'{}')
+        if not isinstance(data, dict):
+            raise ValueError('Expected a JSON object')
+        return data
+    return request.POST
+
+def _rest_framework_missing():
+    return JsonResponse({
+        'error': 'Django REST Framework is not installed. Please install it first.'
+    }, status=400)
+
+async def _aget_user(user_id):
+    try:
+        return await User.objects.aget(id=user_id)
+    except (User.DoesNotExist, ValueError):
+        # Same message as get_object_or_404() gives the sync views
+        raise ValueError('No User matches the given query.')
+
+@csrf_exempt
+@require_POST
+@idempotent
+async def api_check_in_async(request):
+    """Async API endpoint for user check-in"""
+    if not REST_FRAMEWORK_AVAILABLE:
+        return _rest_framework_missing()
+    
+    try:
+        data = _request_data(request)
+        user = await _aget_user(data.get('user_id'))
+        attendance = await services.acheck_in(
+            user,
+            purpose_of_visit=data.get('purpose_of_visit', ''),
+            comments=data.get('comments', ''),
+        )
+    except services.AlreadyCheckedIn as e:
+        return JsonResponse({
+            'error': 'Already checked in',
+            'check_in_time': e.record.check_in_time
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = AttendanceRecordSerializer(attendance)
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+@csrf_exempt
+@require_POST
+@idempotent
+async def api_check_out_async(request):
+    """Async API endpoint for user check-out"""
+    if not REST_FRAMEWORK_AVAILABLE:
+        return _rest_framework_missing()
+    
+    try:
+        data = _request_data(request)
+        user = await _aget_user(data.get('user_id'))
+        attendance = await services.acheck_out(user, comments=data.get('comments'))
+    except services.NotCheckedIn:
+        return JsonResponse({'error': 'No check-in record found for today'}, status=status.HTTP_400_BAD_REQUEST)
+    except services.AlreadyCheckedOut as e:
+        return JsonResponse({
+            'error': 'Already checked out',
+            'check_out_time': e.record.check_out_time
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = AttendanceRecordSerializer(attendance)
+    return JsonResponse(serializer.data, status=status.HTTP_200_OK)
+
+@require_GET
+async def api_attendance_records_async(request):
+    """Async API endpoint to get attendance records, see api_attendance_records"""
+    try:
+        records = await afiltered_records(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date format. Use YYYY-MM-DD'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        page, next_cursor = await akeyset_page(
+            record_values(records),
+            cursor=request.GET.get('cursor'),
+            limit=parse_limit(request.GET.get('limit')),
+        )
+    except InvalidPageRequest as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return JsonResponse({'results': record_rows(page), 'next': next_cursor})
 
 def is_staff(user):
     """Check if user is staff"""
@@ -358,120 +580,55 @@ def analytics_dashboard(request):
         filter_start = today - timedelta(days=30)
         filter_end = today
     
-    # Base queryset with date filter
-    base_qs = AttendanceRecord.objects.filter(
-        date__gte=filter_start,
-        date__lte=filter_end
-    )
-    
-    # Today's stats
-    today_count = AttendanceRecord.objects.filter(date=today).count()
-    today_checked_in = AttendanceRecord.objects.filter(date=today, check_in_time__isnull=False).count()
-    today_checked_out = AttendanceRecord.objects.filter(date=today, check_out_time__isnull=False).count()
-    
-    # Date range stats
-    total_records = base_qs.count()
-    
-    # Visits by user type
-    user_type_counts = base_qs.values(
-        'user__user_type'
-    ).annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Daily attendance trend
-    daily_counts = base_qs.values(
-        'date'
-    ).annotate(
-        count=Count('id')
-    ).order_by('date')
-    
-    # Popular check-in hours
-    hour_distribution = base_qs.filter(
-        check_in_time__isnull=False
-    ).annotate(
-        hour=ExtractHour('check_in_time')
-    ).values(
-        'hour'
-    ).annotate(
-        count=Count('id')
-    ).order_by('hour')
-    
-    # Purpose of visit analysis
-    purpose_counts = base_qs.exclude(
-        purpose_of_visit=''
-    ).values(
-        'purpose_of_visit'
-    ).annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]  # Top 10 purposes
-    
-    # Average visit duration
-    visit_durations = base_qs.filter(
-        check_in_time__isnull=False,
-        check_out_time__isnull=False
-    ).annotate(
-        duration=F('check_out_time') - F('check_in_time')
-    )
-    
-    # This is a bit more complex as we need to calculate the average ourselves
-    total_seconds = 0
-    valid_records = 0
-    for record in visit_durations:
-        # Convert duration to seconds
-        seconds = record.duration.total_seconds()
-        if seconds > 0:  # Filter out negative durations (data errors)
-            total_seconds += seconds
-            valid_records += 1
-    
-    avg_duration_minutes = 0
-    if valid_records > 0:
-        avg_duration_minutes = round(total_seconds / valid_records / 60)
-    
-    # Weekly trends
-    weekly_counts = base_qs.annotate(
-        week=TruncWeek('date')
-    ).values(
-        'week'
-    ).annotate(
-        count=Count('id')
-    ).order_by('week')
-    
-    # Monthly trends
-    monthly_counts = base_qs.annotate(
-        month=TruncMonth('date')
-    ).values(
-        'month'
-    ).annotate(
-        count=Count('id')
-    ).order_by('month')
-    
-    # Prepare data for charts
-    chart_data = {
-        'daily_labels': [entry['date'].strftime('%Y-%m-%d') for entry in daily_counts],
-        'daily_counts': [entry['count'] for entry in daily_counts],
-        'user_type_labels': [entry['user__user_type'] for entry in user_type_counts],
-        'user_type_counts': [entry['count'] for entry in user_type_counts],
-        'hour_labels': [f"{entry['hour']}:00" for entry in hour_distribution],
-        'hour_counts': [entry['count'] for entry in hour_distribution],
-        'purpose_labels': [entry['purpose_of_visit'] for entry in purpose_counts],
-        'purpose_counts': [entry['count'] for entry in purpose_counts],
-        'weekly_labels': [entry['week'].strftime('%Y-%m-%d') for entry in weekly_counts],
-        'weekly_counts': [entry['count'] for entry in weekly_counts],
-        'monthly_labels': [entry['month'].strftime('%Y-%m') for entry in monthly_counts],
-        'monthly_counts': [entry['count'] for entry in monthly_counts],
-    }
-    
+    # Both summaries are cached under data-version keys, see attendance.caching
     context = {
-        'today_count': today_count,
-        'today_checked_in': today_checked_in,
-        'today_checked_out': today_checked_out,
-        'total_records': total_records,
-        'avg_duration_minutes': avg_duration_minutes,
-        'purpose_counts': purpose_counts,
-        'chart_data': chart_data,
+        **caching.today_summary(today),
+        **caching.range_summary(filter_start, filter_end, today),
         'date_from': date_from,
         'date_to': date_to,
+        **events.live_update_context(request),
     }
     
     return render(request, 'attendance/analytics_dashboard.html', context)
+
+@login_required
+@user_passes_test(is_staff)
+def attendance_heatmap(request):
+    """
+    Staff-only weekday by hour heatmap of arrivals and people on site
+    between `date_from` and `date_to` (inclusive, default the last 30 days),
+    as JSON for the analytics dashboard. Read from the precomputed heatmap
+    cells, so the range does not matter much.
+    """
+    today = timezone.now().date()
+    try:
+        date_from = datetime.strptime(
+            request.GET.get('date_from', (today - timedelta(days=30)).isoformat()), '%Y-%m-%d'
+        ).date()
+        date_to = datetime.strptime(request.GET.get('date_to', today.isoformat()), '%Y-%m-%d').date()
+    except ValueError:
+        return HttpResponseBadRequest('Invalid date format. Use YYYY-MM-DD')
+    
+    return JsonResponse(analytics.heatmap(date_from, date_to))
+
+@login_required
+@user_passes_test(is_staff)
+def export_attendance(request):
+    """
+    Staff-only download of the records between `date_from` and `date_to`
+    (inclusive, default today) as `format=csv` (default) or `format=ndjson`,
+    streamed so that any range can be exported.
+    """
+    today = timezone.now().date()
+    export_format = request.GET.get('format', export.CSV)
+    if export_format not in export.FORMATS:
+        return HttpResponseBadRequest(f"Unknown format, use one of: {', '.join(export.FORMATS)}")
+    
+    try:
+        date_from = datetime.strptime(request.GET.get('date_from', today.isoformat()), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.GET.get('date_to', today.isoformat()), '%Y-%m-%d').date()
+    except ValueError:
+        return HttpResponseBadRequest('Invalid date format. Use YYYY-MM-DD')
+    
+    records = archive.records_between(date_from, date_to)
+    return export.stream_export(records, export_format, f"attendance-{date_from}-{date_to}")
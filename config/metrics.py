@@ -0,0 +1,395 @@
+"""
+Per-request performance metrics, exposed at /metrics in the Prometheus text
+format.
+
+MetricsMiddleware records for every request, labelled with its URL name:
+
+* http_requests_total and the http_request_duration_seconds histogram;
+* the http_response_size_bytes histogram;
+* the db_queries_per_request histogram and db_query_duration_seconds_total;
+* template_render_duration_seconds_total.
+
+Queries are timed by an execute wrapper installed on every database
+connection, and templates by the TimedDjangoTemplates backend (name it as
+the BACKEND of TEMPLATES; with the stock backend template time is not
+recorded). Both attribute their time to the current request through a
+context variable, so they cost nothing outside requests and also work for
+async views.
+
+Samples are aggregated in memory. With METRICS_DIR set to a directory
+shared by the worker processes, each process also writes its totals to its
+own file there (at most every METRICS_FLUSH_INTERVAL seconds) and /metrics
+adds up the files of all processes, so a pre-forking WSGI server reports
+the whole server rather than whichever worker answered the scrape. File
+names carry the process id and a random token, so a new worker that
+reuses the id of one that has exited starts its own file. A scrape folds
+the files of workers that have exited into one retained totals file
+(RETIRED_FILE), so counters never go backwards and a server that recycles
+its workers keeps reading one file per live worker plus one.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# name: (type, help, buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests served, by view, method and status', None),
+    'http_request_duration_seconds': ('histogram', 'Request latency in seconds', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('histogram', 'Response body size in bytes', SIZE_BUCKETS),
+    'db_queries_per_request': ('histogram', 'Database queries per request', QUERY_BUCKETS),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in database queries', None),
+    'template_render_duration_seconds_total': ('counter', 'Time spent rendering templates', None),
+}
+
+UNRESOLVED = '<unresolved>'
+RETIRED_FILE = 'metrics-retired.json'
+RETIRED_LOCK = 'metrics-retired.lock'
+# A merge lock older than this was left by a process that died holding it
+RETIRED_LOCK_TIMEOUT = 60
+
+
+class RequestSample:
+    """Database and template time of the request being served"""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.rendering = False
+
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.query_seconds += time.perf_counter() - start
+
+
+def _install_query_timer(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_timer)
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        sample = _current.get()
+        # Nested renders (render_to_string() in a tag) are part of the outer one
+        if sample is None or sample.rendering:
+            return super().render(*args, **kwargs)
+        sample.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            sample.rendering = False
+            sample.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates whose renders count towards template_render_duration_seconds_total"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class Registry:
+    """Counters and histograms of this process, keyed by (name, labels)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # Process ids are reused; the token keeps a new process from
+        # overwriting the totals an exited one left behind
+        self.filename = f"metrics-{self.pid}-{uuid.uuid4().hex}.json"
+        self.counters = defaultdict(float)
+        # Per-bucket (non-cumulative) counts, then sum and count
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def _check_fork(self):
+        # A forked worker starts from an empty registry, not its parent's
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._check_fork()
+            self.counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            series = self.histograms.get((name, labels))
+            if series is None:
+                series = self.histograms[name, labels] = [0] * (len(buckets) + 3)
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return _snapshot(self.counters, self.histograms)
+
+    def flush(self, force=False):
+        """Write this process's totals to METRICS_DIR, if configured"""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+        now = time.monotonic()
+        if not directory or (not force and now - self.flushed_at < interval):
+            return
+        self.flushed_at = now
+        os.makedirs(directory, exist_ok=True)
+        snapshot = self.snapshot()
+        _write(os.path.join(directory, self.filename), snapshot)
+
+
+registry = Registry()
+
+
+def _pid(filename):
+    """The process id in a worker's file name, None for other files"""
+    try:
+        return int(filename[len('metrics-'):-len('.json')].split('-')[0])
+    except ValueError:
+        return None
+
+
+def _exited(pid):
+    if pid is None or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # Alive, run by another user
+        pass
+    return False
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write(path, snapshot):
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _lock(directory):
+    """Take the retired file's merge lock; False if another scrape holds it"""
+    path = os.path.join(directory, RETIRED_LOCK)
+    try:
+        if time.time() - os.path.getmtime(path) > RETIRED_LOCK_TIMEOUT:
+            os.remove(path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def retire_exited(directory):
+    """Fold the files of exited workers into RETIRED_FILE"""
+    exited = [
+        filename for filename in os.listdir(directory)
+        if filename.startswith('metrics-') and filename.endswith('.json') and _exited(_pid(filename))
+    ]
+    if not exited or not _lock(directory):
+        return
+    try:
+        retired_path = os.path.join(directory, RETIRED_FILE)
+        snapshots = [_read(retired_path)] if os.path.exists(retired_path) else []
+        for filename in exited:
+            try:
+                snapshots.append(_read(os.path.join(directory, filename)))
+            except (OSError, ValueError):
+                continue
+        _write(retired_path, _snapshot(*_merge(snapshots)))
+        # A crash before these are gone would count them twice; the window is
+        # a few unlink() calls
+        for filename in exited:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                pass
+    finally:
+        os.remove(os.path.join(directory, RETIRED_LOCK))
+
+
+def _merge(snapshots):
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name, tuple(map(tuple, labels))] += value
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], series)]
+            else:
+                histograms[key] = series
+    return counters, histograms
+
+
+def _snapshot(counters, histograms):
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), list(series)] for (name, labels), series in histograms.items()],
+    }
+
+
+def collect():
+    """Totals over every process writing to METRICS_DIR (or just this one)"""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        registry.flush(force=True)
+        retire_exited(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if filename.startswith('metrics-') and filename.endswith('.json'):
+                try:
+                    snapshots.append(_read(os.path.join(directory, filename)))
+                except (OSError, ValueError):
+                    # Being replaced right now; its totals are in the next scrape
+                    continue
+    else:
+        snapshots = [registry.snapshot()]
+    return _merge(snapshots)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render():
+    """The collected metrics in the Prometheus text exposition format"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            continue
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], series):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(series[-2])}")
+            lines.append(f"{name}_count{_labels(labels)} {series[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.url_name else UNRESOLVED
+
+
+def record(request, response, sample, seconds):
+    view = (('view', _view_name(request)),)
+    registry.inc('http_requests_total', view + (('method', request.method), ('status', response.status_code)))
+    registry.observe('http_request_duration_seconds', view + (('method', request.method),), seconds)
+    if not response.streaming:
+        registry.observe('http_response_size_bytes', view, len(response.content))
+    registry.observe('db_queries_per_request', view, sample.queries)
+    registry.inc('db_query_duration_seconds_total', view, sample.query_seconds)
+    registry.inc('template_render_duration_seconds_total', view, sample.template_seconds)
+    registry.flush()
+
+
+class MetricsMiddleware:
+    """Records the metrics above for every request; put it first in MIDDLEWARE"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = RequestSample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, sample, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        sample = RequestSample()
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, sample, time.perf_counter() - start)
+        return response
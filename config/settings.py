@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack
+    'config.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +59,8 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that records template time in the request metrics
+        'BACKEND': 'config.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,10 +80,25 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite tuned for bursts of concurrent check-ins from several workers:
+# - WAL journaling lets readers run while a write commits;
+# - writers wait up to `timeout` seconds for the write lock instead of
+#   failing with "database is locked";
+# - IMMEDIATE transactions take the write lock when they begin, so the wait
+#   happens there and never as a deadlock halfway through a transaction.
+# Connections are kept for CONN_MAX_AGE seconds so the pragmas run once per
+# connection rather than once per request.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -124,3 +143,52 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Email -> user lookup cache used by the public sign-in page (users.cache).
+# Set USER_LOOKUP_CACHE_ALIAS to a configured cache (e.g. 'default') to share
+# entries between worker processes.
+USER_LOOKUP_CACHE_SIZE = 2048
+USER_LOOKUP_CACHE_TIMEOUT = 300
+USER_LOOKUP_CACHE_ALIAS = None
+
+# Caches. The analytics dashboard cache (attendance.caching) only needs the
+# basic cache API and keeps its invalidation versions in the database, so
+# each worker process can use its own local-memory cache; a FileBasedCache
+# works as well when the workers should share computed summaries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+ANALYTICS_CACHE_ALIAS = 'default'
+# Ranges ending before today only change through imports and edits
+ANALYTICS_CACHE_PAST_TTL = 24 * 60 * 60
+# Ranges including today: fresh for this long, then served stale while one
+# request recomputes them
+ANALYTICS_CACHE_LIVE_TTL = 60
+ANALYTICS_CACHE_STALE_TTL = 300
+
+# Live occupancy (attendance.occupancy): updated on every check-in/check-out
+# and rebuilt from the database when older than the reconcile interval
+OCCUPANCY_CACHE_ALIAS = 'default'
+OCCUPANCY_RECONCILE_INTERVAL = 60
+
+# Request metrics (config.metrics), served at /metrics. Under a pre-forking
+# server set METRICS_DIR to a directory shared by the workers (and emptied
+# when the server starts) so /metrics reports all of them; each worker
+# writes its totals there at most every METRICS_FLUSH_INTERVAL seconds, and
+# scrapes fold the files of exited workers into one.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 5
+
+# Check-in/check-out writes that still find the database locked are retried
+# this many times, with jittered exponential backoff starting at
+# CHECK_IN_RETRY_BACKOFF seconds (attendance.services)
+CHECK_IN_RETRY_ATTEMPTS = 5
+CHECK_IN_RETRY_BACKOFF = 0.05
+
+# Records older than this many days are moved to the archive table by the
+# archive_attendance command; reads reaching back that far use both tables
+# (attendance.archive)
+ATTENDANCE_ARCHIVE_AFTER_DAYS = 365
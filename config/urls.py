@@ -18,10 +18,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('attendance/', include('attendance.urls')),
+    path('metrics', metrics_view, name='metrics'),
     # Add this line to redirect root URL to the attendance dashboard
     path('', RedirectView.as_view(url='/attendance/', permanent=False)),
 ]
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+from . import search
 from .models import User
 
 
@@ -25,5 +26,11 @@ class UserAdmin(BaseUserAdmin):
     ordering = ('email',)
     filter_horizontal = ('user_permissions',)  # removed 'groups'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Look users up in the full-text index instead of LIKE scans"""
+        if not search.words(search_term):
+            return queryset, False
+        return queryset.filter(id__in=search.user_ids(search_term)), False
+
 
 admin.site.register(User, UserAdmin)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+Cache mapping a normalized email address to the user it belongs to.
+
+The public sign-in page resolves an email on every POST, and each visitor
+posts twice. Lookups go through a size-bounded in-process LRU first and,
+when USER_LOOKUP_CACHE_ALIAS names a configured Django cache, a shared cache
+second, so most sign-ins never touch the users table.
+
+Entries hold only the few fields the attendance pages need, and are dropped
+by the post_save/post_delete handlers in users.signals. Local entries also
+expire after USER_LOOKUP_CACHE_TIMEOUT seconds, which bounds how long another
+worker process, or a queryset.update() that bypasses signals, can leave a
+stale entry behind.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import User
+
+CACHED_FIELDS = ('id', 'email', 'first_name', 'last_name', 'user_type')
+
+
+def normalize_email(email):
+    return User.objects.normalize_email((email or '').strip())
+
+
+class UserLookupCache:
+    def __init__(self, max_size=None, timeout=None, cache_alias=None):
+        self.max_size = max_size or getattr(settings, 'USER_LOOKUP_CACHE_SIZE', 2048)
+        self.timeout = timeout or getattr(settings, 'USER_LOOKUP_CACHE_TIMEOUT', 300)
+        self.cache_alias = cache_alias or getattr(settings, 'USER_LOOKUP_CACHE_ALIAS', None)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(('hits', 'shared_hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    @staticmethod
+    def _shared_key(email):
+        return f"users:lookup:{email}"
+
+    @staticmethod
+    def _to_user(values):
+        """Build a User carrying only the cached fields; the rest stay deferred"""
+        return User.from_db(DEFAULT_DB_ALIAS, list(CACHED_FIELDS), [values[name] for name in CACHED_FIELDS])
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def get(self, email):
+        """Return the User for `email` (with only CACHED_FIELDS loaded) or None"""
+        key = normalize_email(email)
+        if not key:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return self._to_user(entry[1])
+
+        values = self.shared.get(self._shared_key(key)) if self.shared else None
+        if values is not None:
+            self._count('shared_hits')
+        else:
+            self._count('misses')
+            values = User.objects.filter(email=key).values(*CACHED_FIELDS).first()
+            if values is None:
+                return None
+            if self.shared:
+                self.shared.set(self._shared_key(key), values, self.timeout)
+
+        self._store(key, values)
+        return self._to_user(values)
+
+    def _store(self, key, values):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, email):
+        key = normalize_email(email)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._counters['invalidations'] += 1
+        if self.shared:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), max_size=self.max_size)
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['shared_hits']) / lookups, 4) if lookups else 0
+        return stats
+
+
+user_lookup_cache = UserLookupCache()
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users import search
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the users full-text search index and its triggers if missing "
+        "(e.g. after a migration rebuilt the users table) and reindex every user"
+    )
+
+    def handle(self, *args, **options):
+        if not search.enabled():
+            raise CommandError('The full-text search index is only used on SQLite')
+
+        start = time.perf_counter()
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {User.objects.count()} users in {time.perf_counter() - start:.1f}s"
+        ))
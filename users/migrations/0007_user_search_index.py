@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:49
+
+from django.db import migrations
+
+INDEX = 'users_user_search'
+COLUMNS = 'email, first_name, last_name'
+NEW = 'new.email, new.first_name, new.last_name'
+OLD = 'old.email, old.first_name, old.last_name'
+
+CREATE_INDEX = [
+    f"CREATE VIRTUAL TABLE {INDEX} USING fts5({COLUMNS}, content='users_user', content_rowid='id', prefix='2 3')",
+    f"CREATE TRIGGER {INDEX}_insert AFTER INSERT ON users_user BEGIN "
+    f"INSERT INTO {INDEX} (rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    f"CREATE TRIGGER {INDEX}_delete AFTER DELETE ON users_user BEGIN "
+    f"INSERT INTO {INDEX} ({INDEX}, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); END",
+    f"CREATE TRIGGER {INDEX}_update AFTER UPDATE OF {COLUMNS} ON users_user BEGIN "
+    f"INSERT INTO {INDEX} ({INDEX}, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD}); "
+    f"INSERT INTO {INDEX} (rowid, {COLUMNS}) VALUES (new.id, {NEW}); END",
+    f"INSERT INTO {INDEX} ({INDEX}) VALUES ('rebuild')",
+]
+DROP_INDEX = [
+    f"DROP TRIGGER {INDEX}_insert",
+    f"DROP TRIGGER {INDEX}_delete",
+    f"DROP TRIGGER {INDEX}_update",
+    f"DROP TABLE {INDEX}",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # Full-text search is only indexed on SQLite, see users.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_remove_user_groups_alter_user_first_name_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_INDEX), run(DROP_INDEX)),
+    ]
@@ -0,0 +1,121 @@
+"""
+Full-text search over users' email addresses and names.
+
+On SQLite, users_user_search is an FTS5 index of users_user. It is an
+external content table, so the text is not stored twice. Triggers keep it in
+step with every insert, update and delete, bulk writes included (see
+migration 0007). Every word of a query must prefix-match a word of the email
+or names, and matches are ranked with bm25. A search costs a few index page
+reads however many users there are, where the admin's default
+`LIKE '%term%'` lookups scan every row. Other databases fall back to those
+icontains lookups.
+
+When a migration alters users_user, Django's SQLite backend rebuilds the
+table and its triggers are lost. restore_index() runs after every migrate
+(see apps.py) and, when the triggers are missing, recreates them and
+reindexes every user, since writes made meanwhile missed the index. The
+`rebuild_search_index` command does the same on demand.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import User
+
+INDEX_TABLE = 'users_user_search'
+INDEXED_FIELDS = ('email', 'first_name', 'last_name')
+INDEX_OBJECTS = (INDEX_TABLE, f'{INDEX_TABLE}_insert', f'{INDEX_TABLE}_delete', f'{INDEX_TABLE}_update')
+# The migration creating the index; restore_index() leaves databases migrated to before it alone
+INDEX_MIGRATION = ('users', '0007_user_search_index')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+_WORD = re.compile(r'\w+')
+
+_COLUMNS = ', '.join(INDEXED_FIELDS)
+_NEW = ', '.join(f'new.{field}' for field in INDEXED_FIELDS)
+_OLD = ', '.join(f'old.{field}' for field in INDEXED_FIELDS)
+INDEX_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+    f"{_COLUMNS}, content='users_user', content_rowid='id', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_insert AFTER INSERT ON users_user BEGIN "
+    f"INSERT INTO {INDEX_TABLE} (rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_delete AFTER DELETE ON users_user BEGIN "
+    f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX_TABLE}_update AFTER UPDATE OF {_COLUMNS} ON users_user BEGIN "
+    f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}, rowid, {_COLUMNS}) VALUES ('delete', old.id, {_OLD}); "
+    f"INSERT INTO {INDEX_TABLE} (rowid, {_COLUMNS}) VALUES (new.id, {_NEW}); END",
+]
+
+
+def enabled():
+    return connection.vendor == 'sqlite'
+
+
+def rebuild_index(using=DEFAULT_DB_ALIAS):
+    """Create the index and its triggers if missing, and reindex every user"""
+    with connections[using].cursor() as cursor:
+        for statement in INDEX_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('rebuild')")
+
+
+def restore_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate handler: rebuild_index() if a migration dropped the triggers"""
+    database = connections[using]
+    if database.vendor != 'sqlite' or INDEX_MIGRATION not in MigrationRecorder(database).applied_migrations():
+        return
+    with database.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(INDEX_OBJECTS))})",
+            INDEX_OBJECTS,
+        )
+        if cursor.fetchone()[0] == len(INDEX_OBJECTS):
+            return
+    rebuild_index(using)
+
+
+def words(text):
+    return _WORD.findall((text or '').lower())
+
+
+def fts_query(text):
+    """`text` as an FTS5 query matching every word as a prefix, '' without words"""
+    return ' '.join(f'"{word}"*' for word in words(text))
+
+
+def _like(text):
+    matches = Q()
+    for word in words(text):
+        matches &= Q(email__icontains=word) | Q(first_name__icontains=word) | Q(last_name__icontains=word)
+    return User.objects.filter(matches)
+
+
+def user_ids(text):
+    """
+    Subquery of the ids of the users matching `text`, for
+    ``filter(user__in=...)`` or ``filter(id__in=...)``
+    """
+    if not enabled():
+        return _like(text).values('id')
+    return RawSQL(f"SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s", [fts_query(text)])
+
+
+def search_users(text, limit=DEFAULT_LIMIT):
+    """Up to `limit` users matching `text`, best match first"""
+    if not words(text):
+        return []
+    if not enabled():
+        return list(_like(text).order_by('email')[:limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+            [fts_query(text), limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+    users = User.objects.in_bulk(ids)
+    return [users[user_id] for user_id in ids if user_id in users]
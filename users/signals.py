@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .cache import user_lookup_cache
+from .models import User
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_email(sender, instance, **kwargs):
+    """Keep the email as loaded so a changed address can be evicted after saving"""
+    instance._loaded_email = instance.__dict__.get('email')
+
+
+@receiver(post_save, sender=User)
+def invalidate_lookup_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_loaded_email', None)
+    if previous and previous != instance.email:
+        user_lookup_cache.invalidate(previous)
+    user_lookup_cache.invalidate(instance.email)
+    instance._loaded_email = instance.email
+
+
+@receiver(post_delete, sender=User)
+def invalidate_lookup_on_delete(sender, instance, **kwargs):
+    user_lookup_cache.invalidate(instance.email)
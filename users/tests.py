@@ -1,8 +1,15 @@
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from . import search
+from .cache import UserLookupCache, user_lookup_cache
 from .models import User
+import io
 import json
 
 class UserAPITests(TestCase):
@@ -55,3 +62,152 @@ class UserAPITests(TestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(User.objects.count(), 0)
+
+
+class UserLookupCacheTests(TestCase):
+    def setUp(self):
+        self.cache = UserLookupCache(max_size=2)
+        self.user = User.objects.create(
+            email='member@example.com', user_type='member', first_name='Member', last_name='User'
+        )
+
+    def test_lookup_is_cached(self):
+        """Test that a repeated lookup does not hit the database"""
+        with self.assertNumQueries(1):
+            first = self.cache.get(' member@EXAMPLE.com ')
+            second = self.cache.get('member@example.com')
+        self.assertEqual(first.id, self.user.id)
+        self.assertEqual(second.first_name, 'Member')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_unknown_email(self):
+        self.assertIsNone(self.cache.get('nobody@example.com'))
+        self.assertIsNone(self.cache.get(''))
+
+    def test_size_is_bounded(self):
+        """Test that the least recently used entry is evicted"""
+        for i in range(3):
+            User.objects.create(email=f'extra{i}@example.com')
+            self.cache.get(f'extra{i}@example.com')
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_signals_invalidate_shared_cache(self):
+        """Test that saving or deleting a user drops the cached entry"""
+        user_lookup_cache.clear()
+        user_lookup_cache.get('member@example.com')
+
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertEqual(user_lookup_cache.get('member@example.com').first_name, 'Renamed')
+
+        self.user.email = 'moved@example.com'
+        self.user.save()
+        self.assertIsNone(user_lookup_cache.get('member@example.com'))
+
+        self.user.delete()
+        self.assertIsNone(user_lookup_cache.get('moved@example.com'))
+
+    def test_stats_endpoint_requires_staff(self):
+        url = reverse('user-lookup-cache-stats')
+        self.assertEqual(APIClient().get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = User.objects.create(email='staff@example.com', is_staff=True, is_superuser=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', response.data)
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(email='alice@example.com', first_name='Alice', last_name='Smith')
+        self.staff = User.objects.create(email='staff@example.com', is_staff=True, is_superuser=True)
+        User.objects.bulk_create([
+            User(email='bob@example.com', first_name='Bob', last_name='Alison'),
+            User(email='carol@example.com', first_name='Carol', last_name='Smithers'),
+        ])
+
+    def emails(self, text):
+        return [user.email for user in search.search_users(text)]
+
+    def test_index_follows_writes(self):
+        """Test that creates, bulk creates, updates and deletes reach the index"""
+        self.assertEqual(self.emails('ali'), ['alice@example.com', 'bob@example.com'])
+        self.assertEqual(self.emails('smith'), ['alice@example.com', 'carol@example.com'])
+        self.assertEqual(self.emails('alice smith'), ['alice@example.com'])
+
+        self.alice.last_name = 'Jones'
+        self.alice.save()
+        User.objects.filter(email='bob@example.com').update(last_name='Brown')
+        self.assertEqual(self.emails('smith'), ['carol@example.com'])
+        self.assertEqual(self.emails('jones'), ['alice@example.com'])
+
+        self.alice.delete()
+        self.assertEqual(self.emails('ali'), [])
+        self.assertEqual(self.emails('"*) OR'), [])
+
+    def test_ranked_best_match_first(self):
+        """Test that users matching in more fields rank first"""
+        User.objects.create(email='smith@example.com', first_name='Smith', last_name='Smith')
+        self.assertEqual(self.emails('smith')[0], 'smith@example.com')
+
+    def test_search_endpoint(self):
+        """Test that staff search with one index query and one user query"""
+        url = reverse('user-search')
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get(url, {'q': 'smith'}).status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(self.staff)
+        with self.assertNumQueries(2):
+            response = client.get(url, {'q': 'Smi', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['last_name'], 'Smith')
+        self.assertEqual(client.get(url, {'q': 'smith', 'limit': 'all'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_admin_searches_index(self):
+        """Test that the admin changelist queries the index instead of LIKE scans"""
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:users_user_changelist'), {'q': 'smith'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(user.email for user in response.context['cl'].result_list),
+            ['alice@example.com', 'carol@example.com'],
+        )
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertIn(search.INDEX_TABLE, sql)
+        self.assertNotIn('LIKE', sql)
+
+    def test_rebuild_command(self):
+        """Test that the command restores triggers a table rebuild dropped"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {search.INDEX_TABLE}_insert")
+        User.objects.create(email='dave@example.com', first_name='Dave')
+        self.assertEqual(self.emails('dave'), [])
+
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self.emails('dave'), ['dave@example.com'])
+        User.objects.create(email='erin@example.com', first_name='Dave')
+        self.assertEqual(self.emails('dave'), ['dave@example.com', 'erin@example.com'])
+
+    def test_migrate_restores_triggers(self):
+        """Test that migrate recreates dropped triggers and indexes the users written meanwhile"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {search.INDEX_TABLE}_update")
+        User.objects.filter(email='bob@example.com').update(first_name='Dave')
+        self.assertEqual(self.emails('dave'), [])
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db=connection.alias)
+        self.assertEqual(self.emails('dave'), ['bob@example.com'])
+        User.objects.filter(email='carol@example.com').update(first_name='Dave')
+        self.assertEqual(self.emails('dave'), ['bob@example.com', 'carol@example.com'])
+
+        # With the triggers in place there is nothing to reindex
+        with CaptureQueriesContext(connection) as queries:
+            search.restore_index(sender=None, using=connection.alias)
+        self.assertNotIn('rebuild', ' '.join(query['sql'] for query in queries))
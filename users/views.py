@@ -7,9 +7,12 @@ import json
 
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from .serializers import UserSerializer
+from .cache import user_lookup_cache
+from . import search
 
 
 @api_view(['GET'])
@@ -57,6 +60,34 @@ def user_delete(request, pk):
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def lookup_cache_stats(request):
+    """Hit/miss counters of the email lookup cache used by sign-in"""
+    return Response(user_lookup_cache.stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def user_search(request):
+    """
+    Staff lookup of users by email and names: every word of `q` must match
+    the start of a word, best matches first. `limit` caps the results
+    (default 20, at most 100).
+    """
+    try:
+        limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(max(limit, 1), search.MAX_LIMIT)
+
+    users = search.search_users(request.GET.get('q', ''), limit)
+    return Response({'results': [
+        {field: getattr(user, field) for field in ('id', 'email', 'first_name', 'last_name', 'user_type')}
+        for user in users
+    ]})
+
+
 class UserProfileView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = UserSerializer(data=request.data)